@@ -23,19 +23,72 @@
 # Implemented loading default directory from .data.txt and GUI prompt/save if not found.
 # Added message boxes for prompting and confirming default directory selection.
 # Last generated: 05-01-25 18:05
+# Tkinter and BeautifulSoup are now imported lazily so the processing core can be imported without a display.
 
-import tkinter as tk # Import the Tkinter library for creating the GUI
-from tkinter import messagebox, filedialog, ttk # Import specific modules, including ttk
 import os # Import the os module for interacting with the operating system (file paths, etc.)
 import sys # Import the sys module for system-specific parameters and functions (like stderr)
-from bs4 import BeautifulSoup # Import BeautifulSoup for parsing HTML/XML content
-from tkinter.font import Font # Import Font for custom text styling in the GUI
-from tkinter.ttk import Progressbar # Import Progressbar for showing processing progress
-from tkinter import BooleanVar # Import BooleanVar for checkboxes
 import datetime # Import datetime for timestamps in logs
 from pathlib import Path # Use pathlib for easier path manipulation
 import re # Import the regular expression module for text pattern matching
+import functools # lru_cache for memoizing repeated conversions
+import queue # Thread-safe queue between the processing worker and the Tk thread
+import threading # Background worker thread for processing
+import time # Monotonic clock for stage budgets
+
+# --- Lazily imported GUI modules ---
+# These stay None until load_tk() is called, so "import bookfix" for scripting or
+# headless batch work never pulls in Tk (and never needs a display).
+tk = None
+messagebox = None
+filedialog = None
+ttk = None
+Font = None
+Progressbar = None
+BooleanVar = None
+
+
+def load_tk():
+    """
+    Imports Tkinter and binds the GUI module globals used by the interactive functions.
+    Safe to call more than once.
+    """
+    global tk, messagebox, filedialog, ttk, Font, Progressbar, BooleanVar
+    if tk is not None:
+        return
+    import tkinter # Import the Tkinter library for creating the GUI
+    from tkinter import messagebox as _messagebox, filedialog as _filedialog, ttk as _ttk
+    from tkinter.font import Font as _Font # Import Font for custom text styling in the GUI
+    tk = tkinter
+    messagebox = _messagebox
+    filedialog = _filedialog
+    ttk = _ttk
+    Font = _Font
+    Progressbar = _ttk.Progressbar # Progressbar for showing processing progress
+    BooleanVar = tkinter.BooleanVar # BooleanVar for checkboxes
+
+
+def show_error(title, message):
+    """Shows an error message box when the GUI is running; otherwise only logs it."""
+    if messagebox is not None and root is not None:
+        if threading.current_thread() is threading.main_thread():
+            messagebox.showerror(title, message)
+        else: # Called from the processing worker
+            ui_queue.put(('call', (messagebox.showerror, (title, message), threading.Event(), {})))
+
+
+class StaticFlag:
+    """
+    Stand-in for a Tk BooleanVar when running without the GUI.
+    run_processing only ever calls .get() on its checkbox variables.
+    """
+    def __init__(self, value):
+        self.value = bool(value)
+
+    def get(self):
+        return self.value
 
+    def set(self, value):
+        self.value = bool(value)
 
 
 # --- Global Variables (used across functions) ---
@@ -50,6 +103,8 @@ start_processing_button = None # New global variable for the start button
 text = "" # Global variable to hold the text content
 log_file_path = "bookfix_execution.log" # Path for the execution log file
 matches = [] # List to hold match objects for the current word
+choice_prefetcher = None # ChoicePrefetcher while process_choices() runs
+last_run_seconds = 0.0 # Wall-clock time of the last GUI processing run (recorded in the library index)
 
 # Data loaded from .data.txt
 choices = {} # Dictionary for interactive word choices (original bookfix)
@@ -82,40 +137,483 @@ convert_lowercase_var = None # Original bookfix checkbox
 process_all_caps_var = None # New checkbox for all-caps processing
     # New checkbox variable for blank-line removal
 remove_blank_lines_var = None
-
-# This is the full code so I know I can simply paste it in
-# --- Helper function for logging match data ---
-def log_matches_state(location):
-    """Logs the state of current_word, current_match, and matches to matches.txt."""
-    print(f"DEBUG: Entering log_matches_state from location: {location}") # Added print statement
-    global current_word, current_match, matches
+trim_whitespace_var = None # Checkbox for stripping leading/trailing whitespace from every line
+plugin_stages_var = None # Checkbox for running the stages from bookfix_plugins/ and entry points
+segment_output_var = None # Checkbox for splitting the output into TTS chunks
+detect_chapters_var = None # Checkbox for chapter detection and per-chapter output
+verbalize_numbers_var = None # Checkbox for spelling out numbers, ordinals, years and currency
+normalize_characters_var = None # Checkbox for the # NORMALIZE character clean-up pass
+change_report_var = None # Checkbox for writing <stem>_changes.html next to the output
+
+# --- Choice Trace ---
+# Optional debug trace of the interactive choices, replacing the old matches.txt dumps
+# (which rewrote every match of the word before and after each choice, so a word with
+# 500 hits wrote hundreds of megabytes). Off by default; --choice-trace or
+# BOOKFIX_CHOICE_TRACE=1 turns it on. The trace is JSON Lines with one event per step:
+#     'word'   a word's matches when it comes up: [start, end, text, line, column] each
+#     'choice' one decided match: index, span, old and new text, line and column
+#     'end'    the word is finished (index = matches decided)
+#     'stray'  handle_choice() was called with no match left
+# Only deltas are written after the 'word' event. The file is capped at
+# CHOICE_TRACE_MAX_BYTES; when full it is moved to choice_trace.jsonl.1 (replacing the
+# previous one) and a new file is started. expand_choice_trace() replays the events into
+# the old verbose matches.txt format when that is needed (--expand-choice-trace).
+CHOICE_TRACE_FILE = "choice_trace.jsonl"
+CHOICE_TRACE_MAX_BYTES = 4 * 1024 * 1024 # Per file; at most one rotated file is kept
+
+choice_trace_enabled = os.environ.get('BOOKFIX_CHOICE_TRACE', '').lower() not in ('', '0', 'off', 'no')
+_choice_trace_bytes = None # Size of the current trace file, read on the first write
+
+
+def reset_choice_trace():
+    """Starts an empty trace for a new run (only when tracing is on)."""
+    global _choice_trace_bytes
+    if not choice_trace_enabled:
+        return
+    try:
+        open(CHOICE_TRACE_FILE, 'w', encoding='utf-8').close()
+        if os.path.exists(CHOICE_TRACE_FILE + '.1'):
+            os.remove(CHOICE_TRACE_FILE + '.1')
+        _choice_trace_bytes = 0
+        log_message(f"Cleared {CHOICE_TRACE_FILE}.")
+    except OSError as e:
+        log_message(f"Error clearing {CHOICE_TRACE_FILE}: {e}", level="ERROR")
+
+
+def trace_choice(event, **fields):
+    """Appends one event to the choice trace, rotating the file when it is full."""
+    global _choice_trace_bytes
+    if not choice_trace_enabled:
+        return
+    import json
+    fields = dict(event=event, time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **fields)
+    data = (json.dumps(fields, ensure_ascii=False) + "\n").encode('utf-8')
     try:
-        with open('matches.txt', 'a', encoding='utf-8') as f:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"--- Log Entry ({timestamp}) ---\n")
-            f.write(f"Location: {location}\n")
-            f.write(f"Current Word: '{current_word}'\n")
-            f.write(f"Current Match Index: {current_match}\n")
-            f.write(f"Total Matches Found: {len(matches)}\n")
-            f.write("Matches Details:\n")
-            if matches:
-                for i, match in enumerate(matches):
-                    # Safely get the matched text, handling potential issues
-                    try:
-                         matched_text = match.group(0)
-                    except IndexError:
-                         matched_text = "[Error getting match text]"
-                         # You might also want to log this error to your main log_file_path
-                         # log_message(f"Error getting match group(0) for match {i} at location {location}", level="WARNING")
-
-                    f.write(f"  Match {i}: Span=({match.start()}, {match.end()}), Text='{matched_text}'\n")
+        if _choice_trace_bytes is None:
+            _choice_trace_bytes = os.path.getsize(CHOICE_TRACE_FILE) if os.path.exists(CHOICE_TRACE_FILE) else 0
+        if _choice_trace_bytes and _choice_trace_bytes + len(data) > CHOICE_TRACE_MAX_BYTES:
+            os.replace(CHOICE_TRACE_FILE, CHOICE_TRACE_FILE + '.1')
+            _choice_trace_bytes = 0
+        with open(CHOICE_TRACE_FILE, 'ab') as f:
+            f.write(data)
+        _choice_trace_bytes += len(data)
+    except OSError as e:
+        log_message(f"Error writing to {CHOICE_TRACE_FILE}: {e}", level="WARNING")
+
+
+def trace_word_matches(word, word_matches):
+    """Traces the matches of a word as it comes up, with their line and column."""
+    if not choice_trace_enabled:
+        return
+    index = get_line_index(text) if word_matches else None
+    spans = []
+    for match in word_matches:
+        line, column = index.line_col(match.start())
+        spans.append([match.start(), match.end(), match.group(0), line, column])
+    trace_choice('word', word=word, matches=spans)
+
+
+def trace_decided_choice(word, position, start, end, replacement):
+    """Traces one decided match; call it before the replacement is spliced into the text."""
+    if not choice_trace_enabled:
+        return
+    line, column = get_line_index(text).line_col(start)
+    trace_choice('choice', word=word, index=position, start=start, end=end,
+                 old=text[start:end], new=replacement, line=line, column=column)
+
+
+def _advance_line_col(line, column, segment):
+    """(line, column) just after `segment` when it starts at (line, column)."""
+    breaks = segment.count('\n')
+    if breaks:
+        return line + breaks, len(segment) - segment.rfind('\n') - 1
+    return line, column + len(segment)
+
+
+def _format_matches_state(location, timestamp, word, position, spans):
+    """One entry in the old matches.txt format."""
+    lines = [f"--- Log Entry ({timestamp}) ---", f"Location: {location}", f"Current Word: '{word}'",
+             f"Current Match Index: {position}", f"Total Matches Found: {len(spans)}", "Matches Details:"]
+    if spans:
+        for i, (start, end, matched_text, line, column) in enumerate(spans):
+            lines.append(f"  Match {i}: Span=({start}, {end}), Line={line + 1}:{column + 1}, Text='{matched_text}'")
+    else:
+        lines.append("  No matches found.")
+    return "\n".join(lines) + "\n---\n\n"
+
+
+def expand_choice_trace(paths=None):
+    """
+    Replays choice trace files (default: the rotated file, then the current one) and
+    yields the entries the old log_matches_state() wrote to matches.txt, with the full
+    match list before and after every choice.
+    """
+    import json
+    if paths is None:
+        paths = [path for path in (CHOICE_TRACE_FILE + '.1', CHOICE_TRACE_FILE) if os.path.exists(path)]
+    word, position, spans = None, 0, None
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for raw in f:
+                if not raw.strip():
+                    continue
+                event = json.loads(raw)
+                kind, timestamp = event['event'], event.get('time', '')
+                if kind == 'word':
+                    word, position, spans = event['word'], 0, [list(span) for span in event['matches']]
+                    yield _format_matches_state(f"Start_of_word_{word}_in_process_choices", timestamp, word, 0, spans)
+                    continue
+                if spans is None or event.get('word') != word: # The start of this word was rotated away
+                    continue
+                if kind == 'choice':
+                    position = event['index']
+                    yield _format_matches_state("Before_handle_choice_replacement", timestamp, word, position, spans)
+                    start, end, old, new = event['start'], event['end'], event['old'], event['new']
+                    old_end = _advance_line_col(event['line'], event['column'], old)
+                    new_end = _advance_line_col(event['line'], event['column'], new)
+                    delta = len(new) - (end - start)
+                    for span in spans[position + 1:]: # Same shift handle_choice() applies to the later matches
+                        if span[3] == old_end[0]: # On the line the edit ends on: the column moves too
+                            span[4] += new_end[1] - old_end[1]
+                        span[3] += new_end[0] - old_end[0]
+                        span[0] += delta
+                        span[1] += delta
+                    if position < len(spans):
+                        spans[position] = [start, start + len(new), new, event['line'], event['column']]
+                    position += 1
+                    yield _format_matches_state("After_handle_choice_replacement_and_refind", timestamp, word, position, spans)
+                elif kind == 'end':
+                    yield _format_matches_state(f"End_of_word_{word}_in_process_choices", timestamp, word, event['index'], spans)
+                elif kind == 'stray':
+                    yield _format_matches_state("Before_handle_choice_replacement", timestamp, word, event['index'], spans)
+                    yield _format_matches_state("End_of_matches_for_word_in_handle_choice", timestamp, word, event['index'], spans)
+
+
+# --- ASCII Fast Path ---
+# Most books are pure ASCII once normalized. On an ASCII string a pattern compiled with
+# re.ASCII finds exactly what its Unicode twin finds (\w, \d and \b agree on ASCII
+# characters) but runs about twice as fast, because the engine skips the Unicode
+# category lookups. str.isascii() is O(1) (CPython keeps the flag on the string), so
+# the check costs nothing. Two differences are guarded: Unicode \s also matches the
+# ASCII separators \x1c-\x1f, and under IGNORECASE a non-ASCII letter such as the long
+# s or the Kelvin sign matches an ASCII one.
+_UNICODE_ONLY_SPACES_RE = re.compile(r"[\x1c-\x1f]") # \s in Unicode mode, not in ASCII mode
+
+
+@functools.lru_cache(maxsize=512)
+def _ascii_twin(pattern):
+    """The re.ASCII compilation of `pattern`, or None if it could match differently on ASCII text."""
+    source = pattern.pattern
+    if not isinstance(source, str) or pattern.flags & re.ASCII:
+        return None
+    if pattern.flags & re.IGNORECASE and any(not c.isascii() and any(v.isascii() for v in c.lower() + c.upper() + c.casefold())
+                                             for c in source):
+        return None
+    return re.compile(source, (pattern.flags & ~re.UNICODE) | re.ASCII)
+
+
+def fast_regex(pattern, text_content):
+    """Returns the ASCII-mode twin of `pattern` when `text_content` is ASCII and both give the same matches."""
+    if not text_content.isascii():
+        return pattern
+    twin = _ascii_twin(pattern)
+    if twin is None:
+        return pattern
+    if ("\\s" in pattern.pattern or "\\S" in pattern.pattern) and _UNICODE_ONLY_SPACES_RE.search(text_content):
+        return pattern
+    return twin
+
+
+# --- Token Table ---
+# The document is tokenized once into parallel arrays (start offset, length, interned
+# token id) plus a lazily built token id -> token positions inverted index. Word-level
+# stages look their words up here and apply all of their edits in one splice, instead
+# of running one \b...\b regex over the whole text per rule.
+# A token is a maximal run of \w characters, so for any word made only of \w characters
+# "token == word" matches exactly where re.search(r'\bword\b') would.
+_WORD_RE = re.compile(r"\w+")
+_WORD_SPLIT_RE = re.compile(r"(\w+)") # re.split() keeps the tokens between the separators
+_NON_WORD_RE = re.compile(r"\W")
+TOKENIZE_BLOCK_CHARS = 1 << 20 # Characters split per block (bounds the temporary lists)
+_ALL_CAPS_TOKEN_RE = re.compile(r"[A-Z]+")
+
+
+class TextMatch:
+    """Minimal stand-in for re.Match (start/end/span/group(0)) whose span can be shifted after edits."""
+    __slots__ = ('_start', '_end', '_text')
+
+    def __init__(self, start, end, matched_text):
+        self._start = start
+        self._end = end
+        self._text = matched_text
+
+    def start(self):
+        return self._start
+
+    def end(self):
+        return self._end
+
+    def span(self):
+        return (self._start, self._end)
+
+    def group(self, index=0):
+        if index != 0:
+            raise IndexError("no such group")
+        return self._text
+
+    def shift(self, delta):
+        """Moves the match by `delta` characters (used after an earlier edit changed the length)."""
+        self._start += delta
+        self._end += delta
+
+
+class TokenTable:
+    """
+    Array-backed token stream over one immutable text string. Tables built for the Tk
+    thread's own tools pass cancellable=False, so a Cancel or stage budget meant for the
+    processing run does not stop them.
+    """
+
+    def __init__(self, text_content, _arrays=None, cancellable=True):
+        from array import array
+        self.text = text_content
+        self.cancellable = cancellable
+        if _arrays is not None:
+            self.starts, self.lengths, self.ids, self.words, self.vocab = _arrays
+        else:
+            self.starts = array('I')
+            self.lengths = array('I')
+            self.ids = array('I')
+            self.words = [] # token id -> token text
+            self.vocab = {} # token text -> token id
+            self._tokenize(text_content)
+        self._postings = None
+        self._folded = None
+
+    def _tokenize(self, text_content):
+        """
+        Fills the arrays a block at a time. Each block is split once into alternating
+        separators and tokens, and offsets, lengths and ids are computed by C-level
+        map/accumulate over that list rather than a Python loop over match objects.
+        """
+        from array import array
+        from itertools import accumulate
+        split_re = fast_regex(_WORD_SPLIT_RE, text_content)
+        boundary_re = fast_regex(_NON_WORD_RE, text_content)
+        vocab = self.vocab
+        pos = 0
+        while pos < len(text_content):
+            if self.cancellable:
+                check_cancelled()
+            boundary = boundary_re.search(text_content, min(len(text_content), pos + TOKENIZE_BLOCK_CHARS))
+            end = boundary.start() if boundary else len(text_content) # Never cut a token in two
+            parts = split_re.split(text_content[pos:end]) # Separator, token, separator, ..., separator
+            tokens = parts[1::2]
+            offsets = array('I', accumulate(map(len, parts), initial=pos))
+            self.starts.extend(offsets[1:2 * len(tokens):2])
+            self.lengths.extend(map(len, tokens))
+            for token in dict.fromkeys(tokens):
+                if token not in vocab:
+                    vocab[token] = len(self.words)
+                    self.words.append(token)
+            self.ids.extend(map(vocab.__getitem__, tokens))
+            pos = end if end > pos else pos + 1
+
+    def _intern(self, token):
+        token_id = self.vocab.get(token)
+        if token_id is None:
+            token_id = self.vocab[token] = len(self.words)
+            self.words.append(token)
+        return token_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def postings(self, token_id):
+        """Returns the token positions (indices into the arrays) for a token id, in document order."""
+        if self._postings is None:
+            from array import array
+            self._postings = [array('I') for _ in self.words]
+            for i, token_id_at in enumerate(self.ids):
+                self._postings[token_id_at].append(i)
+        return self._postings[token_id]
+
+    def positions(self, word, ignore_case=False):
+        """Token positions where the token equals `word` (optionally case-insensitively), in order."""
+        if not ignore_case:
+            token_id = self.vocab.get(word)
+            return list(self.postings(token_id)) if token_id is not None else []
+        if self._folded is None:
+            self._folded = {}
+            for token_id, token in enumerate(self.words):
+                self._folded.setdefault(token.lower(), []).append(token_id)
+        token_ids = self._folded.get(word.lower(), [])
+        if len(token_ids) == 1:
+            return list(self.postings(token_ids[0]))
+        return sorted(i for token_id in token_ids for i in self.postings(token_id))
+
+    def count(self, word, ignore_case=False):
+        """Number of whole-word occurrences of `word`."""
+        if not ignore_case:
+            token_id = self.vocab.get(word)
+            return len(self.postings(token_id)) if token_id is not None else 0
+        return len(self.positions(word, ignore_case=True))
+
+    def span(self, i):
+        """(start, end) character offsets of token position i."""
+        start = self.starts[i]
+        return start, start + self.lengths[i]
+
+    def next_match(self, word, offset, ignore_case=False):
+        """Returns the (start, end) of the first occurrence of `word` at or after `offset`, or None."""
+        import bisect
+        positions = self.positions(word, ignore_case)
+        k = bisect.bisect_left(positions, offset, key=lambda i: self.starts[i])
+        return self.span(positions[k]) if k < len(positions) else None
+
+    def matches(self, word, ignore_case=False):
+        """TextMatch objects for every whole-word occurrence of `word`, in document order."""
+        result = []
+        for i in self.positions(word, ignore_case):
+            start, end = self.span(i)
+            result.append(TextMatch(start, end, self.text[start:end]))
+        return result
+
+    def replace(self, edits):
+        """
+        Applies {token position: replacement string} in one pass and returns the new TokenTable.
+        Replacement strings are tokenized on their own; unedited tokens keep their ids.
+        """
+        from array import array
+        if not edits:
+            return self
+        text_content = self.text
+        pieces = []
+        starts = array('I')
+        lengths = array('I')
+        ids = array('I')
+        new_table = TokenTable.__new__(TokenTable)
+        new_table.words = list(self.words)
+        new_table.vocab = dict(self.vocab)
+        prev_token = 0 # First token position not yet copied
+        prev_char = 0 # First character not yet copied
+        delta = 0
+        for n, i in enumerate(sorted(edits)):
+            if self.cancellable and not n % CHECK_EVERY:
+                check_cancelled()
+            start, end = self.span(i)
+            # Copy the untouched tokens between the previous edit and this one
+            starts.extend(s + delta for s in self.starts[prev_token:i])
+            lengths.extend(self.lengths[prev_token:i])
+            ids.extend(self.ids[prev_token:i])
+            pieces.append(text_content[prev_char:start])
+            replacement = edits[i]
+            out_start = start + delta
+            for m in _WORD_RE.finditer(replacement):
+                starts.append(out_start + m.start())
+                lengths.append(m.end() - m.start())
+                ids.append(new_table._intern(m.group(0)))
+            pieces.append(replacement)
+            delta += len(replacement) - (end - start)
+            prev_token = i + 1
+            prev_char = end
+        starts.extend(s + delta for s in self.starts[prev_token:])
+        lengths.extend(self.lengths[prev_token:])
+        ids.extend(self.ids[prev_token:])
+        pieces.append(text_content[prev_char:])
+        TokenTable.__init__(new_table, "".join(pieces),
+                            _arrays=(starts, lengths, ids, new_table.words, new_table.vocab), cancellable=self.cancellable)
+        return new_table
+
+    def all_caps_sequences(self, skip=()):
+        """
+        TextMatch objects equivalent to re.finditer(r"\\b[A-Z](?:[A-Z ]*[A-Z])\\b"): runs of
+        all-caps tokens joined only by spaces, at least two characters long. Tokens in `skip`
+        are treated as not all-caps (the dry run passes the words UPPER_TO_LOWER lowercases first).
+        """
+        caps_ids = {token_id for token_id, token in enumerate(self.words) if _ALL_CAPS_TOKEN_RE.fullmatch(token) and token not in skip}
+        text_content = self.text
+        result = []
+        run_start = run_end = None
+        for i, token_id in enumerate(self.ids):
+            start = self.starts[i]
+            end = start + self.lengths[i]
+            if token_id in caps_ids:
+                if run_start is not None and text_content[run_end:start].strip(" ") == "":
+                    run_end = end # Extend the run across the spaces
+                    continue
+                if run_start is not None and run_end - run_start >= 2:
+                    result.append(TextMatch(run_start, run_end, text_content[run_start:run_end]))
+                run_start, run_end = start, end
             else:
-                f.write("  No matches found.\n")
-            f.write("---\n\n")
-    except Exception as e:
-        # You might also want to log this error to your main log_file_path
-        # log_message(f"Error writing to matches.txt: {e}", level="ERROR")
-        print(f"ERROR: Failed to write to matches.txt: {e}") # Added print for the error
+                if run_start is not None and run_end - run_start >= 2:
+                    result.append(TextMatch(run_start, run_end, text_content[run_start:run_end]))
+                run_start = None
+        if run_start is not None and run_end - run_start >= 2:
+            result.append(TextMatch(run_start, run_end, text_content[run_start:run_end]))
+        return result
+
+
+_token_table = None # Cached TokenTable for the current text object
+
+
+def get_token_table(text_content):
+    """Returns the TokenTable for `text_content`, tokenizing only if the text object changed."""
+    global _token_table
+    if _token_table is None or _token_table.text is not text_content:
+        _token_table = TokenTable(text_content)
+    return _token_table
+
+
+def cache_token_table(table):
+    """Makes `table` the cached table (after an edit) and returns its text."""
+    global _token_table
+    _token_table = table
+    return table.text
+
+
+def replace_words(text_content, mapping, ignore_case=False, rule='WORD'):
+    """
+    Replaces whole-word occurrences of every key in `mapping` (word -> replacement, or
+    word -> callable(token) returning the replacement or None to keep it) using the token
+    table, with a single splice for all rules. Keys that are not plain word-character words fall back
+    to a regex. Returns the new text. Edits are recorded in the change log as "<rule>:<word>",
+    and for the data-file rule categories the hits per word are counted for the rule analytics.
+    """
+    table = get_token_table(text_content)
+    edits = {}
+    rules = {}
+    fallback = {}
+    for word, replacement in mapping.items():
+        if not _WORD_RE.fullmatch(word):
+            fallback[word] = replacement
+            continue
+        for i in table.positions(word, ignore_case):
+            new = replacement(table.words[table.ids[i]]) if callable(replacement) else replacement
+            if new is not None and i not in edits: # First rule wins, as with sequential passes
+                edits[i] = new
+                rules[i] = word
+    if change_log_enabled:
+        record_changes([(*table.span(i), text_content[slice(*table.span(i))], new, f"{rule}:{rules[i]}")
+                        for i, new in edits.items()])
+    hits = {}
+    for word in rules.values():
+        hits[word] = hits.get(word, 0) + 1
+    text_content = cache_token_table(table.replace(edits))
+    for word, replacement in fallback.items():
+        flags = re.IGNORECASE if ignore_case else 0
+        pattern = fast_regex(re.compile(r'\b' + re.escape(word) + r'\b', flags), text_content)
+        found = [] # Each replacement computed once, for both the change log and the splice
+        for m in pattern.finditer(text_content):
+            new = replacement(m.group(0)) if callable(replacement) else replacement
+            if new is not None and new != m.group(0):
+                found.append((m.start(), m.end(), new))
+        hits[word] = len(found) # Only the matches that were changed
+        text_content = splice_edits(text_content, found, rule=f"{rule}:{word}")
+    if rule in ANALYTICS_CATEGORIES:
+        count_rule_hits(rule, hits)
+    return text_content
+
 
 # --- Applies defined upper to lower section of datafile before interactive ---
 def apply_upper_to_lower(text, upper_to_lower):
@@ -124,11 +622,8 @@ def apply_upper_to_lower(text, upper_to_lower):
     We want to lowercase EVERY standalone occurrence of UPPER
     (even when it’s part of a longer all‑caps phrase).
     """
-    for up, low in upper_to_lower.items():
-        # \b ensures we replace whole words only
-        pattern = re.compile(rf'\b{re.escape(up)}\b')
-        text = pattern.sub(low, text)
-    return text
+    # Whole-word lookups in the token table, all rules applied in one splice
+    return replace_words(text, upper_to_lower, rule='UPPER_TO_LOWER')
 
 
 # ---- Center main window on screen ---
@@ -168,6 +663,8 @@ PERIODS_SECTION_MARKER = "# PERIODS" # Corrected marker spacing based on user fi
 IGNORE_SECTION_MARKER = "# CAP_IGNORE" # From caps.py
 LOWERCASE_SECTION_MARKER = "# UPPER_TO_LOWER" # From caps.py
 DEFAULT_DIR_SECTION_MARKER = "# DEFAULT_FILE_DIR" # New marker for default directory
+STAGE_BUDGETS_SECTION_MARKER = "# STAGE_BUDGETS" # Per-stage time budgets in seconds ("stage -> seconds")
+NORMALIZE_SECTION_MARKER = "# NORMALIZE" # Character -> replacement map for the normalization pass (plus optional NFKC)
 
 # List of all section markers to help identify the end of a section's content
 ALL_SECTION_MARKERS = {
@@ -176,7 +673,9 @@ ALL_SECTION_MARKERS = {
     PERIODS_SECTION_MARKER,
     IGNORE_SECTION_MARKER,
     LOWERCASE_SECTION_MARKER,
-    DEFAULT_DIR_SECTION_MARKER # Include the new marker
+    DEFAULT_DIR_SECTION_MARKER, # Include the new marker
+    STAGE_BUDGETS_SECTION_MARKER,
+    NORMALIZE_SECTION_MARKER
 }
 
 
@@ -186,7 +685,8 @@ def load_data_file():
     by manually parsing the .data.txt file based on # SECTION markers.
     Corrected parsing logic to stop collecting content only at the *next* section marker.
     """
-    global choices, replacements, periods, ignore_set, lowercase_set, default_file_directory # Declare globals
+    global choices, replacements, periods, ignore_set, lowercase_set, default_file_directory, stage_budgets, \
+           normalization, normalize_nfkc, normalization_table # Declare globals
 
     choices = {}
     replacements = {}
@@ -194,6 +694,9 @@ def load_data_file():
     ignore_set = set()
     lowercase_set = set()
     default_file_directory = None # Reset default directory on load
+    stage_budgets = {}
+    normalization = {}
+    normalize_nfkc = False
 
     script_dir = os.path.dirname(os.path.abspath(__file__))
     data_file_path = os.path.join(script_dir, DATA_FILE_NAME)
@@ -228,6 +731,10 @@ def load_data_file():
                         current_section = 'lowercase'
                     elif stripped_line == DEFAULT_DIR_SECTION_MARKER: # Handle new section
                          current_section = 'default_dir'
+                    elif stripped_line == STAGE_BUDGETS_SECTION_MARKER:
+                         current_section = 'stage_budgets'
+                    elif stripped_line == NORMALIZE_SECTION_MARKER:
+                         current_section = 'normalize'
                     continue # Skip to the next line after processing a marker
 
                 # If we are in a section and the line is not empty and not a comment, process it
@@ -258,6 +765,25 @@ def load_data_file():
                     elif current_section == 'lowercase':
                         lowercase_set.add(stripped_line)
                         log_message(f"DEBUG: Added lowercase sequence: '{stripped_line}'")
+                    elif current_section == 'stage_budgets':
+                        parts = stripped_line.split('->')
+                        try:
+                            stage_budgets[parts[0].strip()] = float(parts[1])
+                            log_message(f"DEBUG: Added stage budget: '{parts[0].strip()}' -> {stage_budgets[parts[0].strip()]}s")
+                        except (IndexError, ValueError):
+                            log_message(f"DEBUG: Skipping malformed stage budget line: '{stripped_line}'", level="WARNING")
+                    elif current_section == 'normalize':
+                        if stripped_line.upper() == 'NFKC':
+                            normalize_nfkc = True
+                            log_message("DEBUG: NFKC normalization enabled.")
+                            continue
+                        parts = line.strip().split('->') # Unstripped of BOM/NBSP so those can be mapped too
+                        source = decode_codepoints(parts[0].strip())
+                        if len(parts) == 2 and len(source) == 1:
+                            normalization[source] = decode_codepoints(parts[1].strip())
+                            log_message(f"DEBUG: Added normalization: U+{ord(source):04X} -> {normalization[source]!r}")
+                        else:
+                            log_message(f"DEBUG: Skipping malformed normalization line: '{stripped_line}'", level="WARNING")
                     elif current_section == 'default_dir': # Process default directory line
                          # Take the first non-comment, non-empty line as the default directory
                          if default_file_directory is None: # Only set if not already set
@@ -278,6 +804,7 @@ def load_data_file():
             log_message("DEBUG: Finished data file parsing.")
             log_message(f"Loaded {len(choices)} choice rules, {len(replacements)} replacement rules, {len(periods)} period rules.")
             log_message(f"Loaded {len(ignore_set)} ignore sequences, {len(lowercase_set)} automatic lowercase sequences.")
+            log_message(f"Loaded {len(normalization)} normalization mappings (NFKC {'on' if normalize_nfkc else 'off'}).")
             if default_file_directory:
                  log_message(f"Loaded default file directory: {default_file_directory}")
             else:
@@ -293,10 +820,14 @@ def load_data_file():
             ignore_set = set()
             lowercase_set = set()
             default_file_directory = None # Ensure this is also reset
+            normalization = {}
+            normalize_nfkc = False
 
     else:
         log_message(f"Data file '{DATA_FILE_NAME}' not found. Starting with empty rules.", level="WARNING")
 
+    normalization_table = str.maketrans(normalization) # Compiled once per load, used by normalize_characters()
+    load_plugins() # Plugin stages are reloaded with the rules
     log_message(f"DEBUG: load_data_file complete.  ignore_set={ignore_set}", level="DEBUG")
 
 
@@ -339,7 +870,9 @@ def save_default_directory_to_data_file(directory_path):
                    PERIODS_SECTION_MARKER: 'periods',
                    IGNORE_SECTION_MARKER: 'ignore',
                    LOWERCASE_SECTION_MARKER: 'lowercase',
-                   DEFAULT_DIR_SECTION_MARKER: 'default_dir'
+                   DEFAULT_DIR_SECTION_MARKER: 'default_dir',
+                   STAGE_BUDGETS_SECTION_MARKER: 'stage_budgets',
+                   NORMALIZE_SECTION_MARKER: 'normalize'
               }.get(stripped_line)
               current_section_start_idx = i + 1 # Content starts on the line after the marker
 
@@ -439,7 +972,9 @@ def save_caps_data_file(ignore_set, lowercase_set):
                    PERIODS_SECTION_MARKER: 'periods',
                    IGNORE_SECTION_MARKER: 'ignore',
                    LOWERCASE_SECTION_MARKER: 'lowercase',
-                   DEFAULT_DIR_SECTION_MARKER: 'default_dir'
+                   DEFAULT_DIR_SECTION_MARKER: 'default_dir',
+                   STAGE_BUDGETS_SECTION_MARKER: 'stage_budgets',
+                   NORMALIZE_SECTION_MARKER: 'normalize'
               }.get(stripped_line)
               current_section_start_idx = i + 1 # Content starts on the line after the marker
 
@@ -566,6 +1101,104 @@ def select_file():
     log_message("File selection cancelled.")
     return None
 
+# --- Interactive Prefetch ---
+# While process_choices() waits for the user, a background thread looks up the next
+# CHOICE word(s) on a snapshot of the text: one token table serves every word up to and
+# including the next one that occurs at all, so the next prompt comes from a prepared
+# list. The user's edits to the current word are journaled; at hand-over the prepared
+# spans are shifted through the journal by bisect. An edit that could create or remove
+# an occurrence of a prepared word (its text contains the word, or it joins two words)
+# discards the prefetch and that word is looked up synchronously, as before.
+class ChoicePrefetcher:
+    """Looks up the matches of upcoming CHOICE words on a background thread."""
+
+    def __init__(self, words):
+        self.words = words
+        self.thread = None
+        self.snapshot = None # Text the running/finished lookup was made on
+        self.first = None # Index of the first word it looks up
+        self.found = {} # Word index -> [TextMatch] in snapshot offsets
+        self.snap_starts = [] # Journal: start and end of each edit, in snapshot offsets...
+        self.snap_ends = []
+        self.deltas = [] # ...and the total length change up to and including it
+        self.valid = True
+
+    def prefetch(self, first, text_content):
+        """Starts looking up words[first:] on `text_content` unless the current lookup covers them."""
+        if first >= len(self.words):
+            return
+        if self.valid and self.first is not None and self.first <= first and \
+                (first in self.found or self.thread.is_alive()):
+            return # The words before `first` had no matches, so the running lookup goes on to it
+        self.snapshot = text_content
+        self.first = first
+        self.found = {}
+        self.snap_starts = []
+        self.snap_ends = []
+        self.deltas = []
+        self.valid = True
+        self.thread = threading.Thread(target=self._lookup, args=(first, text_content), daemon=True)
+        self.thread.start()
+
+    def _lookup(self, first, text_content):
+        """Thread body: matches for each word from `first` until one of them occurs."""
+        try:
+            table = TokenTable(text_content) # Private table; the cached one belongs to the Tk thread
+            for position in range(first, len(self.words)):
+                word = self.words[position]
+                if _WORD_RE.fullmatch(word):
+                    found = table.matches(word, ignore_case=True)
+                else:
+                    found = find_word_matches(text_content, word) # Phrases use a regex and no table
+                self.found[position] = found
+                if found:
+                    break
+        except Exception:
+            self.found = {} # take() falls back to a synchronous lookup
+
+    def record_edit(self, start, end, replacement, text_before):
+        """Journals text_before[start:end] = replacement, made after the snapshot."""
+        if not self.valid or self.snapshot is None:
+            return
+        previous = self.deltas[-1] if self.deltas else 0
+        snap_start = start - previous
+        if self.snap_ends and snap_start < self.snap_ends[-1]:
+            self.valid = False # Not left to right: not worth mapping
+            return
+        changed = (text_before[start:end] + "\x00" + replacement).lower()
+        if any(self.words[p].lower() in changed for p in range(self.first, len(self.words))):
+            self.valid = False # The edit may create or remove an occurrence of an upcoming word
+            return
+        joins = (replacement[:1].isalnum() and start > 0 and text_before[start - 1].isalnum()) or \
+                (replacement[-1:].isalnum() and end < len(text_before) and text_before[end].isalnum())
+        if joins:
+            self.valid = False
+            return
+        self.snap_starts.append(snap_start)
+        self.snap_ends.append(snap_start + end - start)
+        self.deltas.append(previous + len(replacement) - (end - start))
+
+    def take(self, position):
+        """Returns the matches of words[position] in the current text, or None to look it up now."""
+        if self.thread is None or self.first is None or position < self.first:
+            return None
+        self.thread.join() # Usually finished long ago, while the user was deciding
+        found = self.found.get(position)
+        if found is None or not self.valid:
+            return None
+        if self.deltas:
+            import bisect
+            shifts = []
+            for match in found:
+                k = bisect.bisect_right(self.snap_ends, match.start())
+                if k < len(self.snap_starts) and self.snap_starts[k] < match.end():
+                    return None # A phrase overlapping an edited word (e.g. "lead singer" after "lead")
+                shifts.append(self.deltas[k - 1] if k else 0)
+            for match, delta in zip(found, shifts): # Each word is taken once, so its spans are shifted once
+                match.shift(delta)
+        return found
+
+
 # --- Interactive Choice Processing Function (Original Bookfix) ---
 # This is the full code so I know I can simply paste it in
 # Modified process_choices function with logging
@@ -575,14 +1208,14 @@ def process_choices():
     For each word found in the text, it highlights the match, presents buttons
     for the user to select the replacement, and updates the text accordingly.
     Includes a progress bar. Implemented re-searching after each replacement for accurate highlighting.
-    Includes logging to matches.txt.
+    Decisions go to the choice trace when it is on.
     """
-    global text, choices, current_word, current_match, matches, progress_bar, progress_label, choice_var
+    global text, choices, current_word, current_match, matches, progress_bar, progress_label, choice_var, choice_prefetcher
     # Declare progress_bar and progress_label as global within this function
     global progress_bar, progress_label
 
     # log_message("Starting interactive choices processing.") # Optional: keep for main log
-    # Clearing matches.txt is now handled in start_processing_button_command
+    # Clearing the choice trace is handled in start_processing_button_command
 
     # Get the total number of unique words requiring choices to track progress
     total_words = len(choices)
@@ -601,29 +1234,30 @@ def process_choices():
 
     # Clear the text area and load the current state of the text before starting choices
     # Ensure text_area contains the current global 'text' content at the start
-    text_area.delete("1.0", tk.END)
-    text_area.insert("1.0", text)
+    render_text_view()
     # log_message("Text area synced with global text before starting choices loop.") # Optional: keep for main log
 
 
     # Loop through each word that needs interactive replacement
-    for word in choices.keys():
+    words = list(choices)
+    choice_prefetcher = ChoicePrefetcher(words)
+    for position, word in enumerate(words):
         current_word = word # Set the current word being processed
         current_match = 0 # Reset the match index for the new word
 
         # Find all occurrences of the current word in the *current* text.
         # This search happens once per word, at the start of processing that word.
         # The matches list will be updated dynamically within handle_choice.
-        # Use re.finditer to find all matches and store them as a list
-        # \b ensures whole word matching
-        # re.escape handles special characters in the word
-        # re.IGNORECASE makes the search case-insensitive
-        matches[:] = list(re.finditer(r'\b' + re.escape(current_word) + r'\b', text, re.IGNORECASE))
-
+        # Usually prepared in the background while the previous word was being decided;
+        # otherwise a whole-word, case-insensitive lookup in the token table (no rescan of the text)
+        prefetched = choice_prefetcher.take(position)
+        matches[:] = prefetched if prefetched is not None else find_word_matches(text, current_word)
+        choice_prefetcher.prefetch(position + 1, text) # Look up the next words while the user decides
+        count_rule_hits('CHOICE', {current_word: len(matches)})
 
         # log_message(f"Processing word for choices: '{current_word}' - Found {len(matches)} initial matches.") # Optional: keep for main log
-        # Log initial matches state for the word
-        log_matches_state(f"Start_of_word_{current_word}_in_process_choices")
+        # Trace the word's matches once; later trace events only carry the decisions
+        trace_word_matches(current_word, matches)
 
 
         # If there are matches for the current word
@@ -666,13 +1300,15 @@ def process_choices():
                 # Wait here until handle_choice signals completion by setting choice_var
                 choice_var.set(0) # Reset choice_var before waiting
                 root.wait_variable(choice_var)
+                if cancel_event.is_set(): # Cancel button released the wait
+                    break
                 # log_message(f"Choice signal received for '{current_word}'.") # Optional: keep for main log
 
 
             # After the while loop finishes (all matches for the word are processed or skipped)
             # log_message(f"Finished all matches for '{current_word}'.") # Optional: keep for main log
-            # Log final state for the word
-            log_matches_state(f"End_of_word_{current_word}_in_process_choices")
+            # Trace that the word is finished
+            trace_choice('end', word=current_word, index=current_match)
 
 
             # Unbind number keys after completing a word's choices
@@ -682,6 +1318,8 @@ def process_choices():
 
 
         # Update progress after processing all matches for a word (or skipping if no matches)
+        if cancel_event.is_set():
+            break
         processed_words += 1
         progress_percent = int((processed_words / total_words) * 100)
         progress_bar['value'] = progress_percent
@@ -690,6 +1328,8 @@ def process_choices():
         # log_message(f"Progress updated: {processed_words}/{total_words} words processed.") # Optional: keep for main log
 
 
+    choice_prefetcher = None
+
     # Hide the progress bar and label once all words are processed
     progress_bar.pack_forget()
     progress_label.pack_forget()
@@ -699,15 +1339,24 @@ def process_choices():
         widget.destroy()
     # log_message("Choice buttons cleared.") # Optional: keep for main log
 
-    # Update the main text variable with the final changes made (already synced in handle_choice, but good final sync)
-    text = text_area.get("1.0", tk.END).strip() # Ensure final text is synced
-    # log_message("Final text synced from text area to global variable.") # Optional: keep for main log
+    # The global text already holds every change made in handle_choice; the text area
+    # only shows a window of it, so it is never read back.
 
     # log_message("Finished interactive choices processing.") # Optional: keep for main log
     status_label.config(text="Interactive choices processing complete.")
 
 
 # --- Helper Functions for Original Choice Processing ---
+def find_word_matches(text_content, word):
+    """
+    Returns TextMatch objects for every whole-word, case-insensitive occurrence of `word`.
+    Plain words come from the token table; phrases (e.g. "tear gas") use a regex.
+    """
+    if _WORD_RE.fullmatch(word):
+        return get_token_table(text_content).matches(word, ignore_case=True)
+    pattern = fast_regex(re.compile(r'\b' + re.escape(word) + r'\b', re.IGNORECASE), text_content)
+    return [TextMatch(m.start(), m.end(), m.group(0)) for m in pattern.finditer(text_content)]
+
 def highlight_current_match():
     """Highlights the currently selected match in the text area."""
     global current_match, matches, text_area, current_word
@@ -717,13 +1366,8 @@ def highlight_current_match():
     if matches and current_match < len(matches):
         # Get the start and end indices (span) of the current match
         start, end = matches[current_match].span()
-        # Add a highlight tag to the text area at the match's position
-        # Tkinter text indices are like "line.column"
-        text_area.tag_add("highlight", f"1.0+{start}c", f"1.0+{end}c")
-        # Configure the appearance of the highlight tag
-        text_area.tag_config("highlight", background="lightblue", foreground="black")
-        # Scroll the text area to make the highlighted match visible
-        text_area.see(f"1.0+{start}c")
+        # Highlight it (loading the window of lines around it if needed) and scroll to it
+        show_span("highlight", start, end, background="lightblue", foreground="black")
         # Update the status label to show progress for the current word
         status_label.config(text=f"Replacing {current_word}: {current_match + 1}/{len(matches)}")
     else:
@@ -737,30 +1381,31 @@ def handle_choice(choice):
     Handles the user's selection of a replacement option.
     Modifies the global text string, updates the text area from the string,
     re-finds matches, logs it, and prepares for the next match or word.
-    Includes logging to matches.txt.
+    Decisions go to the choice trace when it is on.
     """
-    global text_area, current_match, matches, choice_var, text, current_word
+    global text_area, current_match, matches, choice_var, text, current_word, choice_prefetcher
 
     # log_message(f"Handling choice '{choice}' for '{current_word}' (Match {current_match + 1})") # Optional: keep for main log
 
-    # Log state before replacement
-    log_matches_state("Before_handle_choice_replacement")
-
-
     # Check if there is a valid match to process at the current_match index
     if matches and current_match < len(matches):
         # Get the start and end indices (span) of the current match from the *current* matches list
         # These are relative to the global 'text' string *before* this replacement is applied
         start, end = matches[current_match].span()
 
+        # Trace the decision (match and replacement only) before the text changes
+        trace_decided_choice(current_word, current_match, start, end, choice)
+
         # --- Perform the replacement in the global text string ---
         # Modify the global text string using slicing
-        text = text[:start] + choice + text[end:] # Modified: Update global text string first
+        text_before = text
+        splice_text(start, end, choice, rule=f"CHOICE:{current_word}") # Modified: Update global text string (and its line index) first
+        if choice_prefetcher is not None: # The background lookup of the next words maps its spans through this edit
+            choice_prefetcher.record_edit(start, end, choice, text_before)
         # --- End of global text string replacement ---
 
         # --- Update the text area from the modified global text string ---
-        text_area.delete("1.0", tk.END) # Modified: Clear the entire text area
-        text_area.insert("1.0", text) # Modified: Insert the entire updated text string
+        patch_text_view(start, end, choice, text_before) # Edit the loaded window in place instead of reloading it
         # --- End of text area update ---
 
 
@@ -774,23 +1419,19 @@ def handle_choice(choice):
             pass # Basic error handling
 
 
-        # Re-find *all* matches for the current word in the *updated* global text.
-        # This is the key step to get correct, current positions after the text length might have changed.
-        # Use re.finditer to find all matches and store them as a list
-        # \b ensures whole word matching
-        # re.escape handles special characters in the word
-        # re.IGNORECASE makes the search case-insensitive
-        matches[:] = list(re.finditer(r'\b' + re.escape(current_word) + r'\b', text, re.IGNORECASE)) # Modified: Re-finding matches on updated global text
-        # log_message(f"Re-found {len(matches)} matches for '{current_word}' after replacement.") # Optional: keep for main log
+        # Shift the remaining matches by the change in length instead of re-searching the text.
+        # (Re-searching dropped the replaced match from the list, so incrementing
+        # current_match afterwards skipped the next occurrence.)
+        delta = len(choice) - (end - start)
+        if delta:
+            for later_match in matches[current_match + 1:]:
+                later_match.shift(delta)
+        matches[current_match] = TextMatch(start, start + len(choice), choice)
 
 
-        # Move to the next match index *within the potentially new matches list*
+        # Move to the next match index
         current_match += 1 # Modified: Incrementing current_match
 
-
-        # Log state after re-finding matches and incrementing current_match
-        log_matches_state("After_handle_choice_replacement_and_refind")
-
         # Explicitly update the GUI to ensure visual changes are processed before highlighting
         root.update_idletasks() # Added: Force GUI update
 
@@ -813,8 +1454,8 @@ def handle_choice(choice):
         # or if the last match was just processed and current_match is now equal to len(matches),
         # signal to move on. This condition is also hit after the last match is processed above.
         # log_message(f"No more valid matches found for '{current_word}' at index {current_match} in handle_choice. Signalling next word/completion.") # Optional: keep for main log
-        # Log state when no valid match is found or after processing the last match
-        log_matches_state("End_of_matches_for_word_in_handle_choice")
+        # Trace that no valid match was left
+        trace_choice('stray', word=current_word, index=current_match)
         choice_var.set(choice_var.get() + 1) # Signal to move on
 
 
@@ -840,21 +1481,15 @@ def handle_caps_choice(choice):
             original_span = m.span()
             break
 
-    # 2) Prepare the regex for whole‑word matching
-    pattern = re.compile(r'\b' + re.escape(seq) + r'\b')
-
     # --- Handle each button ---
     if choice.lower() in ('y', 'yes'):
         # YES: lowercase just this instance, record its span
-        text_area.delete(f"1.0+{start_pos}c", f"1.0+{end_pos}c")
-        text_area.insert(f"1.0+{start_pos}c", seq.lower())
-        text = text_area.get("1.0", tk.END).strip()
+        splice_text(start_pos, end_pos, seq.lower(), rule=f"CAPS:{seq}")
         if original_span:
             lowercased_original_spans.add(original_span)
         decided_sequences_text.add(seq)
          # —— Bulk‑lower all remaining instances of this sequence ——
-        bulk_pattern = re.compile(rf'\b{re.escape(seq)}\b')
-        text = bulk_pattern.sub(seq.lower(), text)
+        text = replace_words(text, {seq: seq.lower()}, rule='CAPS')
         update_text_area()
         log_message(f"Bulk‑lowercased all remaining instances of '{seq}'")
 
@@ -881,9 +1516,7 @@ def handle_caps_choice(choice):
         save_caps_data_file(ignore_set, lowercase_set)
 
         # Bulk‑lowercase _all_ persisted sequences in the buffer
-        for w in lowercase_set:
-            p = re.compile(r'\b' + re.escape(w) + r'\b')
-            text = p.sub(w.lower(), text)
+        text = replace_words(text, {w: w.lower() for w in lowercase_set}, rule='UPPER_TO_LOWER')
         update_text_area()
 
         # Mark all original spans for this seq as done
@@ -927,12 +1560,9 @@ def process_all_caps_sequences_gui():
     original_for_detection = text  # keep original for matching only
     log_message(f"Original text length: {len(original_for_detection)} chars", level="DEBUG")
 
-    # 2) Compile regex (no newlines, uppercase & spaces only)
-    sequence_pattern = re.compile(r"\b[A-Z](?:[A-Z ]*[A-Z])\b")
-    log_message(f"Using sequence_pattern: {sequence_pattern.pattern}", level="DEBUG")
-
-    # 3) Detect sequences in the original text
-    all_caps_matches_original = list(sequence_pattern.finditer(original_for_detection))
+    # 2) + 3) Detect sequences (uppercase words joined by spaces, no newlines) in the
+    # original text from the token table; same matches as \b[A-Z](?:[A-Z ]*[A-Z])\b
+    all_caps_matches_original = get_token_table(original_for_detection).all_caps_sequences()
     log_message(
         "All-caps sequences detected: " + ", ".join(m.group(0) for m in all_caps_matches_original),
         level="DEBUG"
@@ -944,16 +1574,13 @@ def process_all_caps_sequences_gui():
 
     # 4) Pre-pass: auto-lowercase words from lowercase_set in the text buffer
     log_message("Pre-pass: applying lowercase_set auto-lowercasing", level="DEBUG")
-    working_text = original_for_detection
-    for w in lowercase_set:
-        working_text = re.sub(rf'\b{re.escape(w)}\b', w.lower(), working_text)
+    working_text = replace_words(original_for_detection, {w: w.lower() for w in lowercase_set}, rule='UPPER_TO_LOWER')
 
     # Update the main text variable to include pre-pass changes
     text = working_text
 
     # Initialize the text area with the current text
-    text_area.delete("1.0", tk.END)
-    text_area.insert("1.0", text)
+    render_text_view(first_line=0)
     log_message("Text area initialized with current text", level="DEBUG")
 
     # 5) Prepare the UI
@@ -997,15 +1624,11 @@ def process_all_caps_sequences_gui():
         start, end = span
         current_caps_sequence = seq_text
         current_caps_span = (start, end)
-        log_message(f"Highlighting sequence '{seq_text}' at span {span}", level="DEBUG")
-
-        # Display current text (with any prior modifications) and highlight the span
-        text_area.delete("1.0", tk.END)
-        text_area.insert("1.0", text)
-        text_area.tag_remove("highlight_caps", "1.0", tk.END)
-        text_area.tag_add("highlight_caps", f"1.0+{start}c", f"1.0+{end}c")
-        text_area.tag_config("highlight_caps", background="yellow", foreground="black")
-        text_area.see(f"1.0+{start}c")
+        log_message(f"Highlighting sequence '{seq_text}' at span {span} (line {get_line_index(text).position(start)})", level="DEBUG")
+
+        # Display current text (with any prior modifications) and highlight the span;
+        # only the window of lines around it is reloaded
+        show_span("highlight_caps", start, end, background="yellow", foreground="black")
         root.update_idletasks()
 
         # Wait for user choice
@@ -1013,6 +1636,8 @@ def process_all_caps_sequences_gui():
         choice_var.set(0)
         log_message(f"Waiting for user choice on '{seq_text}'", level="DEBUG")
         root.wait_variable(choice_var)
+        if cancel_event.is_set(): # Cancel button released the wait
+            break
         log_message(f"User completed choice for '{seq_text}'", level="DEBUG")
 
     # 7) Cleanup after interactive pass
@@ -1031,10 +1656,29 @@ def apply_automatic_replacements():
     """Applies all find and replace rules loaded from the data file."""
     global text, replacements
     log_message("Starting automatic replacements.")
+    hits = {}
     # Iterate through each old/new pair in the replacements dictionary
     for old, new in replacements.items():
+        check_cancelled() # One full-text pass per rule; check between rules
+        if change_log_enabled and old: # Each rule is its own layer: it sees the previous rule's output
+            edits = []
+            pos = text.find(old)
+            while pos != -1:
+                edits.append((pos, pos + len(old), old, new, f"REPLACE:{old}"))
+                pos = text.find(old, pos + len(old))
+            record_changes(edits)
         # Replace all occurrences of 'old' with 'new' in the text
-        text = text.replace(old, new)
+        replaced = text.replace(old, new)
+        # Hits for the rule analytics, without another pass: str.replace hands back the same
+        # object when nothing matched, and otherwise the length change gives the count
+        if replaced is text or not old:
+            hits[old] = 0
+        elif len(old) != len(new):
+            hits[old] = (len(text) - len(replaced)) // (len(old) - len(new))
+        else:
+            hits[old] = text.count(old)
+        text = replaced
+    count_rule_hits('REPLACE', hits)
     log_message("Finished automatic replacements.")
 
 
@@ -1042,14 +1686,9 @@ def insert_periods_into_abbreviations():
     """Inserts periods into specified abbreviations (e.g., 'Mr' -> 'M.r.')."""
     global text, periods
     log_message("Starting inserting periods into abbreviations.")
-    # Iterate through each abbreviation that needs periods
-    for abbr in periods:
-        # Create a regex pattern to find the whole word abbreviation
-        pattern = r'\b' + re.escape(abbr) + r'\b'
-        # Create the replacement string with periods inserted between characters and at the end
-        replacement = '.'.join(abbr) + '.'
-        # Use re.sub to replace all matches of the pattern with the replacement string
-        text = re.sub(pattern, replacement, text)
+    # Replacement strings have periods inserted between characters and at the end;
+    # all abbreviations are looked up in the token table and applied in one splice
+    text = replace_words(text, {abbr: '.'.join(abbr) + '.' for abbr in periods}, rule='PERIODS')
     log_message("Finished inserting periods.")
 
 
@@ -1062,6 +1701,7 @@ def convert_to_lowercase():
 
 
 # --- Roman Numeral Conversion Functions ---
+_ROMAN_TOKEN_RE = re.compile(r"[VXLCDM]|[MDCLXVI]{2,}") # Tokens that may be Roman numerals (shared with the dry run)
 
 def convert_roman_numerals():
     """
@@ -1077,18 +1717,35 @@ def convert_roman_numerals():
     #  • a single‑letter [V X L C D M]  (I is never in this set)
     #  • or a multi‑letter run of [MDCLXVI] length ≥ 2
     # with no apostrophe immediately before or after.
-    roman_pattern = r"(?<!')\b(?:[VXLCDM]|[MDCLXVI]{2,})\b(?!')"
+    # Each distinct token in the token table is tested once; only its occurrences are edited.
+    roman_token = _ROMAN_TOKEN_RE
 
-    def _replace(m):
-        token = m.group(0)
+    def _replace(token):
         val = roman_to_arabic(token)
         # only replace if we got back a positive integer
         if isinstance(val, int) and val > 0:
             return str(val)
         # otherwise, leave the original token alone
-        return token
+        return None
 
-    text = re.sub(roman_pattern, _replace, text)
+    table = get_token_table(text)
+    edits = {}
+    for token_id, token in enumerate(table.words):
+        if not token_id % CHECK_EVERY:
+            check_cancelled()
+        if not roman_token.fullmatch(token):
+            continue
+        replacement = _replace(token)
+        if replacement is None:
+            continue
+        for i in table.postings(token_id):
+            start, end = table.span(i)
+            if (start > 0 and text[start - 1] == "'") or text[end:end + 1] == "'":
+                continue # Adjacent to an apostrophe
+            edits[i] = replacement
+    if change_log_enabled:
+        record_changes([(*table.span(i), text[slice(*table.span(i))], new, 'ROMAN') for i, new in edits.items()])
+    text = cache_token_table(table.replace(edits)) # Keep the updated table for the next word-level stage
     update_text_area()
     log_message("Finished converting Roman numerals.", level="INFO")
 
@@ -1122,11 +1779,1220 @@ def roman_to_arabic(roman):
     return total
 
 
+# --- Line Index ---
+# Start offset of every line of the current text, maintained alongside it. Offsets are
+# turned into (line, column) by bisect for highlighting and for the line numbers in
+# the choice trace, pagination_debug.txt and the chapter/chunk manifests. Single edits
+# (interactive choices) update the index instead of rebuilding it.
+_line_index = None # LineIndex for the most recently indexed text
+
+
+class LineIndex:
+    """Start offset of every line of a text, for offset -> (line, column) lookups by bisect."""
+
+    def __init__(self, text_content):
+        from array import array
+        from itertools import accumulate
+        self.text = text_content
+        self.starts = array('I', [0])
+        self.starts.extend(accumulate(len(line) + 1 for line in text_content.split("\n")[:-1]))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def line_of(self, offset):
+        """0-based line containing character `offset`."""
+        import bisect
+        return bisect.bisect_right(self.starts, offset) - 1
+
+    def line_col(self, offset):
+        """(line, column) of character `offset`, both 0-based."""
+        line = self.line_of(offset)
+        return line, offset - self.starts[line]
+
+    def line_start(self, line):
+        """Offset of the first character of `line`, or len(text) past the last line."""
+        return self.starts[line] if line < len(self.starts) else len(self.text)
+
+    def position(self, offset):
+        """Human-readable "line:column" (both 1-based) of `offset`, for logs and reports."""
+        line, column = self.line_col(offset)
+        return f"{line + 1}:{column + 1}"
+
+    def apply_edit(self, start, end, replacement, new_text):
+        """
+        Returns the index of `new_text`, which is this text with [start:end) replaced by
+        `replacement`. Lines before the edit are reused, and lines after it are only shifted.
+        """
+        from array import array
+        first = self.line_of(start)
+        last = self.line_of(end)
+        delta = len(replacement) - (end - start)
+        edited = LineIndex.__new__(LineIndex)
+        edited.text = new_text
+        if "\n" not in replacement and "\n" not in self.text[start:end]:
+            if delta == 0:
+                edited.starts = self.starts # Same lines (e.g. a case change): share the array
+                return edited
+            edited.starts = self.starts[:last + 1]
+        else:
+            edited.starts = self.starts[:first + 1]
+            newline = replacement.find("\n")
+            while newline != -1:
+                edited.starts.append(start + newline + 1)
+                newline = replacement.find("\n", newline + 1)
+        edited.starts.extend(array('I', [offset + delta for offset in self.starts[last + 1:]]))
+        return edited
+
+
+def get_line_index(text_content):
+    """Returns the LineIndex for `text_content`, rebuilding it only if the text object changed."""
+    global _line_index
+    if _line_index is None or _line_index.text is not text_content:
+        _line_index = LineIndex(text_content)
+    return _line_index
+
+
+def splice_text(start, end, replacement, rule='EDIT'):
+    """Replaces text[start:end] in the global text, carrying the line index along. Returns the new text."""
+    global text, _line_index, _search_index
+    record_changes([(start, end, text[start:end], replacement, rule)])
+    index = get_line_index(text)
+    previous = text
+    text = text[:start] + replacement + text[end:]
+    _line_index = index.apply_edit(start, end, replacement, text)
+    if _search_index is not None and _search_index.text is previous:
+        if len(_search_index.journal) < SEARCH_MAX_JOURNAL:
+            _search_index.apply_edit(start, end, replacement, text)
+        else:
+            _search_index = None # Cheaper to rebuild than to map positions through a long journal
+    return text
+
+
+# --- Search Index ---
+# Find-in-book and rule previews are answered from an index instead of a scan of the
+# text. The index is a suffix array over the book's vocabulary: every suffix of every
+# distinct (lower-cased) word, sorted once. A query's leading word part is looked up in
+# it by binary search (O(m log V)); that gives the words containing it and where, and
+# the token table gives their occurrences, so only real hits are ever compared. Edits
+# made through splice_text() update the index in place: the edit is journaled (older
+# positions are mapped through the journal when read) and the words around it are
+# re-tokenized. Stages that rewrite the whole text just leave it to be rebuilt by the
+# next query. Queries starting with a non-word character fall back to a plain scan.
+SEARCH_CONTEXT_CHARS = 40 # Characters shown on each side of a hit
+SEARCH_LIST_LIMIT = 200 # Hits listed in the rule preview (all are counted)
+SEARCH_MAX_JOURNAL = 512 # Edits journaled before the index is rebuilt instead
+
+_search_index = None # SearchIndex of the current text (or of an older one, rebuilt on demand)
+find_entry = None # Find box widgets
+find_whole_word_var = None
+find_match_case_var = None
+find_label = None
+find_position = 0 # Offset just past the start of the last hit shown; the next search starts there
+
+
+class SearchIndex:
+    """Vocabulary suffix array plus per-word occurrence lists over one text, kept current through splice_text()."""
+
+    def __init__(self, text_content):
+        table = TokenTable(text_content, cancellable=False) # Own table: the find box may run while the worker uses the cached one
+        self.text = text_content
+        self.table = table
+        self.words = sorted({token.lower() for token in table.words})
+        self.vocabulary = set(self.words)
+        suffixes = sorted(((word[offset:], w, offset) for w, word in enumerate(self.words) for offset in range(len(word))))
+        from array import array
+        self.sa_words = array('I', (w for _, w, _ in suffixes)) # Suffix array: word number...
+        self.sa_offsets = array('I', (offset for _, _, offset in suffixes)) # ...and offset in the word
+        self.starts = {} # Lower-cased word -> its start offsets in the indexed text (built on demand)
+        self.journal = [] # (start, end, replacement length) of each edit since the index was built
+        self.added = [] # [start, lower-cased word] of the words the edits created, in current offsets
+
+    def apply_edit(self, start, end, replacement, new_text):
+        """Brings the index up to date with new_text = text[:start] + replacement + text[end:]."""
+        delta = len(replacement) - (end - start)
+        self.journal.append((start, end, len(replacement)))
+        kept = []
+        for entry in self.added: # Words created by earlier edits are shifted or dropped like any other
+            if entry[0] + len(entry[1]) < start:
+                kept.append(entry)
+            elif entry[0] > end:
+                kept.append([entry[0] + delta, entry[1]])
+        # Re-tokenize the edited stretch, widened to whole words on both sides
+        left = start
+        while left > 0 and _WORD_RE.match(new_text, left - 1):
+            left -= 1
+        right = start + len(replacement)
+        while right < len(new_text) and _WORD_RE.match(new_text, right):
+            right += 1
+        kept.extend([m.start(), m.group(0).lower()] for m in _WORD_RE.finditer(new_text, left, right))
+        self.added = kept
+        self.text = new_text
+
+    def _current(self, position, length):
+        """Maps a word at `position` in the indexed text through the journal; None if an edit touched it."""
+        for start, end, new_length in self.journal:
+            if position > end:
+                position += new_length - (end - start)
+            elif position + length >= start:
+                return None # Rewritten, or joined to the edit; the edit's own words are in self.added
+        return position
+
+    def occurrences(self, word):
+        """Current start offsets of the lower-cased `word`."""
+        starts = self.starts.get(word)
+        if starts is None:
+            table = self.table
+            starts = self.starts[word] = [table.starts[i] for i in table.positions(word, ignore_case=True)]
+        if self.journal:
+            starts = [p for p in (self._current(p, len(word)) for p in starts) if p is not None]
+        return starts + [p for p, added_word in self.added if added_word == word]
+
+    def words_containing(self, part, whole=False):
+        """(word, offset) for each place `part` occurs in a vocabulary word (as the whole word if `whole`)."""
+        import bisect
+        if whole:
+            return [(part, 0)]
+        key = lambda k: self.words[self.sa_words[k]][self.sa_offsets[k]:self.sa_offsets[k] + len(part)]
+        first = bisect.bisect_left(range(len(self.sa_words)), part, key=key)
+        last = bisect.bisect_right(range(len(self.sa_words)), part, lo=first, key=key)
+        found = [(self.words[self.sa_words[k]], self.sa_offsets[k]) for k in range(first, last)]
+        found.extend((word, offset) for _, word in self.added if word not in self.vocabulary # New words are not in the suffix array
+                     for offset in range(len(word)) if word.startswith(part, offset))
+        return list(dict.fromkeys(found))
+
+    def search(self, query, whole_word=False, match_case=False):
+        """Sorted (start, end) of every occurrence of `query` (case-insensitive unless match_case)."""
+        if not query:
+            return []
+        folded = query.lower()
+        lead = _WORD_RE.match(folded)
+        text_content = self.text
+        if lead is None or len(folded) != len(query): # Punctuation first (or case folding changes the length)
+            flags = 0 if match_case else re.IGNORECASE
+            pattern = re.escape(query)
+            if whole_word:
+                pattern = r"(?<!\w)" + pattern + r"(?!\w)"
+            return [m.span() for m in re.finditer(pattern, text_content, flags)]
+        lead = lead.group(0)
+        continues = len(lead) < len(folded) # Something follows the leading word part, so it must end its word
+        hits = set()
+        for word, offset in self.words_containing(lead, whole=whole_word):
+            if continues and offset + len(lead) != len(word):
+                continue
+            for position in self.occurrences(word):
+                start = position + offset
+                found = text_content[start:start + len(query)]
+                if (found == query) if match_case else (found.lower() == folded):
+                    if whole_word and continues and _WORD_RE.match(query[-1]) and _WORD_RE.match(text_content, start + len(query)):
+                        continue # A phrase whose last word runs on ("tear gas" in "tear gasoline")
+                    hits.add(start)
+        return [(start, start + len(query)) for start in sorted(hits)]
+
+
+def get_search_index(text_content):
+    """Returns the SearchIndex for `text_content`, rebuilding it if the text changed other than through splice_text()."""
+    global _search_index
+    if _search_index is None or _search_index.text is not text_content:
+        _search_index = SearchIndex(text_content)
+    return _search_index
+
+
+def search_text(query, whole_word=False, match_case=False, text_content=None):
+    """Sorted (start, end) of every occurrence of `query` in `text_content` (default: the global text)."""
+    return get_search_index(text if text_content is None else text_content).search(query, whole_word, match_case)
+
+
+def search_context(start, end, text_content=None):
+    """("line:col", text before, hit, text after) for one hit, for the find box and rule preview."""
+    text_content = text if text_content is None else text_content
+    before = text_content[max(0, start - SEARCH_CONTEXT_CHARS):start].rsplit("\n", 1)[-1]
+    after = text_content[end:end + SEARCH_CONTEXT_CHARS].split("\n", 1)[0]
+    return get_line_index(text_content).position(start), before, text_content[start:end], after
+
+
+def preview_rule(kind, key, target, text_content=None):
+    """
+    The hits a new rule would get on the text: REPLACE is a case-sensitive substring rule,
+    CHOICE a case-insensitive whole-word one. Returns (hit count, report lines).
+    """
+    hits = search_text(key, whole_word=(kind == 'CHOICE'), match_case=(kind == 'REPLACE'), text_content=text_content)
+    lines = [f"{len(hits)} hit(s) for {kind} '{key}'" + (f" -> '{target}'" if target else "")]
+    for start, end in hits[:SEARCH_LIST_LIMIT]:
+        position, before, found, after = search_context(start, end, text_content)
+        lines.append(f"{position:>10}  ...{before}[{found} -> {target}]{after}..." if target else
+                     f"{position:>10}  ...{before}[{found}]{after}...")
+    if len(hits) > SEARCH_LIST_LIMIT:
+        lines.append(f"... and {len(hits) - SEARCH_LIST_LIMIT} more")
+    return len(hits), lines
+
+
+def find_next_command(event=None):
+    """Find box: highlights the next hit after the last one found (wrapping round), with the hit count."""
+    global find_position
+    import bisect
+    query = find_entry.get()
+    if not query:
+        return
+    hits = search_text(query, whole_word=find_whole_word_var.get(), match_case=find_match_case_var.get())
+    if not hits:
+        text_area.tag_remove("find", "1.0", tk.END)
+        find_label.config(text="No hits")
+        return
+    k = bisect.bisect_left(hits, (find_position,))
+    if k == len(hits):
+        k = 0
+    start, end = hits[k]
+    find_position = start + 1
+    show_span("find", start, end, background="yellow", foreground="black")
+    find_label.config(text=f"{k + 1}/{len(hits)} (line {get_line_index(text).position(start)})")
+
+
+def rule_preview_button_command():
+    """Opens the rule preview: the hits a REPLACE or CHOICE rule would get, updated as it is typed."""
+    window = tk.Toplevel(root)
+    window.title("Preview Rule")
+    form = tk.Frame(window)
+    form.pack(fill=tk.X, padx=5, pady=5)
+    kind_var = tk.StringVar(value='REPLACE')
+    ttk.Combobox(form, textvariable=kind_var, values=('REPLACE', 'CHOICE'), state='readonly', width=10).pack(side=tk.LEFT)
+    key_entry = tk.Entry(form, width=30)
+    key_entry.pack(side=tk.LEFT, padx=5)
+    tk.Label(form, text="->").pack(side=tk.LEFT)
+    target_entry = tk.Entry(form, width=30)
+    target_entry.pack(side=tk.LEFT, padx=5)
+    report_area = tk.Text(window, wrap=tk.NONE, width=100, height=25)
+    scrollbar = tk.Scrollbar(window, command=report_area.yview)
+    report_area.config(yscrollcommand=scrollbar.set)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    report_area.pack(fill=tk.BOTH, expand=True)
+
+    def refresh(event=None):
+        report_area.config(state=tk.NORMAL)
+        report_area.delete("1.0", tk.END)
+        if key_entry.get():
+            _, lines = preview_rule(kind_var.get(), key_entry.get(), target_entry.get())
+            report_area.insert(tk.END, "\n".join(lines))
+        report_area.config(state=tk.DISABLED)
+
+    key_entry.bind("<KeyRelease>", refresh)
+    target_entry.bind("<KeyRelease>", refresh)
+    kind_var.trace_add("write", lambda *args: refresh())
+    key_entry.focus_set()
+
+
+# --- Change Log ---
+# When 'Write Change Report' is on, every text mutation records the edits it applies as
+# one ChangeLayer of (start, end, before, after, rule) in the coordinates of the text it
+# was applied to. At save time one backward sweep over the layers maps every edit to an
+# offset in the original input, so the review report is built without diffing input
+# against output. A stage that does not itemize its edits is recorded as
+# one edit covering everything between its first and last change.
+CHANGE_REPORT_FORMATS = ("html", "txt") # <stem>_changes.html or <stem>_changes.txt next to the output
+CHANGE_CONTEXT_CHARS = 40 # Characters of original text shown on each side of an edit
+CHANGE_SHOW_CHARS = 200 # Longer before/after strings are shortened in the report
+CHANGE_SUMMARY_ONLY_RULES = {'BLANK_LINE', 'LINE_ENDING', 'CHAPTER_MARK', 'TRIM'} # Counted, but not listed one by one
+CHANGE_REPORT_BLOCK = 128 # Offsets per block while the report maps edits back to the original
+
+change_log_enabled = False # Edits are being recorded (for the report, or to track HTML text nodes)
+change_report_wanted = False # Set per run from the 'change_report' step
+change_log_source = None # Text at the start of the run; report offsets refer to it
+change_layers = [] # One ChangeLayer per recorded mutation, in the order they were applied
+change_notes = [] # Stages that changed text in place without itemizing (e.g. lowercasing)
+change_stage = None # Name of the running stage, used to label layers
+change_report_format = "html" # One of CHANGE_REPORT_FORMATS
+
+
+class ChangeLayer:
+    """The edits of one text mutation, sorted and non-overlapping, with their offsets before and after."""
+
+    def __init__(self, stage, edits):
+        from array import array
+        self.stage = stage
+        self.edits = edits
+        self.in_starts = array('I')
+        self.in_ends = array('I')
+        self.out_starts = array('I')
+        self.out_ends = array('I')
+        delta = 0
+        for start, end, before, after, rule in edits:
+            self.in_starts.append(start)
+            self.in_ends.append(end)
+            self.out_starts.append(start + delta)
+            delta += len(after) - (end - start)
+            self.out_ends.append(end + delta)
+
+    def to_input(self, offset, at_end=False):
+        """Maps an offset in this layer's output back to its input. Offsets inside a replacement map to its edges."""
+        import bisect
+        if at_end:
+            k = bisect.bisect_left(self.out_starts, offset) - 1
+            if k >= 0 and offset <= self.out_ends[k]:
+                return self.in_ends[k]
+        else:
+            k = bisect.bisect_right(self.out_starts, offset) - 1
+            if k >= 0 and offset < self.out_ends[k]:
+                return self.in_starts[k]
+        return offset if k < 0 else offset - self.out_ends[k] + self.in_ends[k]
+
+    def to_output(self, offsets):
+        """
+        Maps sorted offsets in this layer's input to its output. An edit starting exactly at
+        an offset lands after it; an offset inside an edit maps to the end of the replacement.
+        """
+        import bisect
+        result = []
+        pos = 0
+        delta = 0
+        for k in range(len(self.in_starts)):
+            start, end = self.in_starts[k], self.in_ends[k]
+            split = bisect.bisect_right(offsets, start, pos)
+            result.extend([offset + delta for offset in offsets[pos:split]])
+            pos = bisect.bisect_right(offsets, end, split)
+            result.extend([self.out_ends[k]] * (pos - split))
+            delta = self.out_ends[k] - end
+        result.extend([offset + delta for offset in offsets[pos:]])
+        return result
+
+
+def begin_change_log(enabled, track=False):
+    """
+    Starts (or switches off) change recording for a run over the current global text.
+    `enabled` asks for the report; `track` records the edits without one (HTML inputs).
+    """
+    global change_log_enabled, change_log_source, change_report_wanted
+    change_report_wanted = enabled
+    change_log_enabled = enabled or track
+    change_log_source = text if change_log_enabled else None
+    change_layers.clear()
+    change_notes.clear()
+
+
+def record_changes(edits, stage=None):
+    """Records one layer of (start, end, before, after, rule) edits, relative to the text they were applied to."""
+    if change_log_enabled and edits:
+        change_layers.append(ChangeLayer(stage or change_stage or 'interactive', sorted(edits, key=lambda e: (e[0], e[1]))))
+
+
+def _common_prefix_length(a, b):
+    """Length of the common prefix of two strings, compared a block at a time."""
+    limit = min(len(a), len(b))
+    pos = 0
+    size = 1 << 16
+    while size: # Skip equal blocks, halving the block size at the first difference
+        while pos + size <= limit and a[pos:pos + size] == b[pos:pos + size]:
+            pos += size
+        size //= 2
+    return pos
+
+
+DIFF_WORD_LIMIT = 4000 # Changed blocks up to this many characters are diffed word by word
+_DIFF_TOKEN_RE = re.compile(r"\w+|\s+|[^\w\s]")
+
+
+def _diff_block(old, new, base, edits):
+    """Adds the edits turning `old` (at offset `base`) into `new`, word by word if small enough."""
+    import difflib
+    from itertools import accumulate
+    if old == new:
+        return
+    if len(old) + len(new) > DIFF_WORD_LIMIT:
+        prefix = _common_prefix_length(old, new)
+        suffix = _common_prefix_length(old[prefix:][::-1], new[prefix:][::-1])
+        edits.append((base + prefix, base + len(old) - suffix, new[prefix:len(new) - suffix]))
+        return
+    old_tokens = _DIFF_TOKEN_RE.findall(old)
+    new_tokens = _DIFF_TOKEN_RE.findall(new)
+    old_starts = list(accumulate(map(len, old_tokens), initial=base))
+    new_starts = list(accumulate(map(len, new_tokens), initial=0))
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal': # Whole words are replaced, so an edit never ends half-way into a word
+            edits.append((old_starts[i1], old_starts[i2], new[new_starts[j1]:new_starts[j2]]))
+
+
+def diff_edits(old, new):
+    """
+    Returns (start, end, replacement) edits in `old` that turn it into `new`, for stages that
+    hand back a whole new text: a line diff finds the changed blocks, and each changed line
+    (or small block) is narrowed to the words that changed. Itemized edits keep HTML
+    text nodes apart, where one edit over the whole text would merge them.
+    """
+    import difflib
+    if old == new:
+        return []
+    prefix = old.rfind("\n", 0, _common_prefix_length(old, new)) + 1 # Skip the unchanged lines
+    old_lines = old[prefix:].splitlines(True)
+    new_lines = new[prefix:].splitlines(True)
+    old_starts = [prefix]
+    for line in old_lines:
+        old_starts.append(old_starts[-1] + len(line))
+    edits = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        if i2 - i1 == j2 - j1: # Line for line: diff each pair
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                _diff_block(old_lines[i], new_lines[j], old_starts[i], edits)
+        else:
+            _diff_block("".join(old_lines[i1:i2]), "".join(new_lines[j1:j2]), old_starts[i1], edits)
+    return edits
+
+
+def record_unitemized_change(old, new, stage):
+    """Records a stage that changed the text without itemizing its edits."""
+    if not change_log_enabled or old == new:
+        return
+    if len(old) == len(new): # In-place changes (e.g. lowercasing) do not move any offsets
+        change_notes.append(f"{stage}: changed characters in place (not itemized)")
+        return
+    prefix = _common_prefix_length(old, new)
+    suffix = _common_prefix_length(old[prefix:][::-1], new[prefix:][::-1])
+    record_changes([(prefix, len(old) - suffix, old[prefix:len(old) - suffix], new[prefix:len(new) - suffix],
+                     f"{stage} (not itemized)")], stage)
+
+
+def record_line_filter(text_content, predicates, trim=False):
+    """
+    Records the edits made by filter_lines(text_content, predicates, trim): each dropped line
+    under the name of the predicate that dropped it, trimmed whitespace as TRIM.
+    """
+    if not change_log_enabled:
+        return
+    edits = []
+    pos = 0
+    last_ending = None # (start, end, ending) of the previous kept line's line break
+    for segment in text_content.splitlines(True):
+        line = segment.splitlines()[0]
+        rule = next((name for name, drop in predicates if drop(line)), None)
+        if rule is None:
+            if last_ending and last_ending[2] != "\n": # Kept lines are re-joined with "\n"
+                edits.append((last_ending[0], last_ending[1], last_ending[2], "\n", 'LINE_ENDING'))
+            last_ending = (pos + len(line), pos + len(segment), segment[len(line):])
+            if trim:
+                leading = len(line) - len(line.lstrip())
+                trailing = len(line) - len(line.rstrip()) if leading < len(line) else 0
+                if leading:
+                    edits.append((pos, pos + leading, line[:leading], "", 'TRIM'))
+                if trailing:
+                    edits.append((pos + len(line) - trailing, pos + len(line), line[len(line) - trailing:], "", 'TRIM'))
+        else:
+            edits.append((pos, pos + len(segment), segment, "", rule))
+        pos += len(segment)
+    if last_ending and last_ending[2]: # The last kept line loses its line break
+        edits.append((last_ending[0], last_ending[1], last_ending[2], "", 'LINE_ENDING'))
+    record_changes(edits)
+
+
+class _OffsetBlocks:
+    """
+    Sorted (offset, id) pairs mapped back through change layers for build_change_report().
+    They are kept in blocks with a pending shift each: a layer moves a whole block that
+    lies between two of its edits by adjusting that shift, and only blocks that an edit
+    touches are mapped offset by offset. Mapping never reorders offsets, so blocks stay sorted.
+    """
+
+    def __init__(self, at_end):
+        self.at_end = at_end # End offsets snap to the end of a replacement they fall in
+        self.blocks = [] # [shift, offsets, ids]
+
+    def map_through(self, layer):
+        """Maps every offset from `layer`'s output to its input, as ChangeLayer.to_input() would."""
+        import bisect
+        find = bisect.bisect_left if self.at_end else bisect.bisect_right # Edit k with offset in or after it
+        split = bisect.bisect_right if self.at_end else bisect.bisect_left # Offsets up to a boundary
+        out_starts, out_ends, in_starts, in_ends = layer.out_starts, layer.out_ends, layer.in_starts, layer.in_ends
+        for block in self.blocks:
+            shift, offsets, ids = block
+            first = find(out_starts, offsets[0] + shift) - 1
+            last = find(out_starts, offsets[-1] + shift) - 1
+            if first == last and (first < 0 or split([offsets[0] + shift], out_ends[first]) == 0): # Between two edits
+                block[0] += 0 if first < 0 else in_ends[first] - out_ends[first]
+                continue
+            mapped = []
+            i = 0
+            for k in range(first, last + 1): # Offsets between edit k and edit k + 1
+                j = len(offsets) if k == last else split(offsets, out_starts[k + 1] - shift, i)
+                if k < 0:
+                    mapped.extend([offset + shift for offset in offsets[i:j]])
+                else:
+                    inside = split(offsets, out_ends[k] - shift, i, j) # Offsets inside the replacement map to its edge
+                    mapped.extend([in_ends[k] if self.at_end else in_starts[k]] * (inside - i))
+                    delta = shift + in_ends[k] - out_ends[k]
+                    mapped.extend([offset + delta for offset in offsets[inside:j]])
+                i = j
+            block[0] = 0
+            block[1] = mapped
+
+    def add(self, pairs):
+        """Merges sorted (offset, id) pairs into the blocks they fall in; other blocks are left alone."""
+        import bisect
+        if not pairs:
+            return
+        if not self.blocks:
+            self.blocks = self._chunk(0, pairs)
+            return
+        firsts = [block[1][0] + block[0] for block in self.blocks]
+        blocks = []
+        pos = 0
+        for b, block in enumerate(self.blocks):
+            split = len(pairs) if b + 1 == len(firsts) else bisect.bisect_left(pairs, (firsts[b + 1],), pos)
+            if split == pos:
+                blocks.append(block)
+                continue
+            shift, offsets, ids = block
+            blocks.extend(self._chunk(shift, sorted(list(zip(offsets, ids)) + [(offset - shift, i) for offset, i in pairs[pos:split]])))
+            pos = split
+        self.blocks = blocks
+
+    @staticmethod
+    def _chunk(shift, pairs):
+        """Splits sorted (offset, id) pairs into blocks of CHANGE_REPORT_BLOCK, or keeps them whole when they fit twice."""
+        size = CHANGE_REPORT_BLOCK if len(pairs) > 2 * CHANGE_REPORT_BLOCK else len(pairs)
+        return [[shift, [offset for offset, _ in pairs[n:n + size]], [i for _, i in pairs[n:n + size]]]
+                for n in range(0, len(pairs), size)]
+
+    def values(self):
+        """{id: offset} for every pair."""
+        return {i: offset + shift for shift, offsets, ids in self.blocks for offset, i in zip(offsets, ids)}
+
+
+def build_change_report():
+    """
+    Maps every recorded edit back to the original text in one backward sweep over the
+    layers: each layer maps all later edits to its input at once (_OffsetBlocks), then
+    adds its own. Returns (entries sorted by original offset, {rule: count}).
+    """
+    counts = {}
+    for layer in change_layers:
+        for edit in layer.edits:
+            counts[edit[4]] = counts.get(edit[4], 0) + 1
+    listed = [] # (layer number, edit number, before, after, rule, stage)
+    starts = _OffsetBlocks(at_end=False)
+    ends = _OffsetBlocks(at_end=True)
+    for k in range(len(change_layers) - 1, -1, -1):
+        layer = change_layers[k]
+        starts.map_through(layer)
+        ends.map_through(layer)
+        new_starts = []
+        new_ends = []
+        for n, (start, end, before, after, rule) in enumerate(layer.edits):
+            if rule in CHANGE_SUMMARY_ONLY_RULES:
+                continue
+            new_starts.append((start, len(listed)))
+            new_ends.append((end, len(listed)))
+            listed.append((k, n, before, after, rule, layer.stage))
+        starts.add(new_starts)
+        ends.add(sorted(new_ends))
+    start_of = starts.values()
+    end_of = ends.values()
+    entries = sorted(((start_of[i], max(start_of[i], end_of[i]), k, n, *rest) for i, (k, n, *rest) in enumerate(listed)),
+                     key=lambda entry: entry[:1] + entry[2:4]) # Same order as the edits were made, for equal offsets
+    return [(start, end, *rest) for start, end, k, n, *rest in entries], counts
+
+
+def _report_snippet(value):
+    """Shortens a before/after string for the report and makes markers and line breaks visible."""
+    value = value.replace(CHAPTER_MARK, "").replace(SCENE_MARK, "").replace("\n", "\u21b5")
+    return value if len(value) <= CHANGE_SHOW_CHARS else value[:CHANGE_SHOW_CHARS] + f"... (+{len(value) - CHANGE_SHOW_CHARS} chars)"
+
+
+def write_change_report(output_path, fmt=None):
+    """Writes <stem>_changes.html/.txt next to `output_path` from the change log. Returns the report path."""
+    import html
+    fmt = fmt or change_report_format
+    output_path = Path(output_path)
+    report_path = output_path.with_name(output_path.stem + "_changes." + fmt)
+    entries, counts = build_change_report()
+    source = change_log_source or ""
+    lines = LineIndex(source)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        if fmt == "html":
+            f.write("<!DOCTYPE html><meta charset='utf-8'><title>Changes</title>"
+                    "<style>body{font-family:sans-serif}td{vertical-align:top;padding:2px 6px}"
+                    "del{background:#fdd}ins{background:#dfd}.ctx{color:#666}</style>\n")
+            f.write(f"<h1>Changes to {html.escape(str(output_path.name))}</h1>\n<h2>Summary</h2>\n<ul>\n")
+            for rule, count in sorted(counts.items(), key=lambda item: -item[1]):
+                f.write(f"<li>{html.escape(str(rule))}: {count}</li>\n")
+            for note in change_notes:
+                f.write(f"<li>{html.escape(note)}</li>\n")
+            f.write("</ul>\n<h2>Edits</h2>\n<table>\n<tr><th>Line</th><th>Rule</th><th>Change in context</th></tr>\n")
+            for start, end, before, after, rule, stage in entries:
+                left = source[max(0, start - CHANGE_CONTEXT_CHARS):start]
+                right = source[end:end + CHANGE_CONTEXT_CHARS]
+                f.write(f"<tr><td>{lines.position(start)}</td><td>{html.escape(str(rule))}</td><td>"
+                        f"<span class='ctx'>{html.escape(_report_snippet(left))}</span>"
+                        f"<del>{html.escape(_report_snippet(before))}</del><ins>{html.escape(_report_snippet(after))}</ins>"
+                        f"<span class='ctx'>{html.escape(_report_snippet(right))}</span></td></tr>\n")
+            f.write("</table>\n")
+        else:
+            f.write(f"Changes to {output_path.name}\n\nSummary:\n")
+            for rule, count in sorted(counts.items(), key=lambda item: -item[1]):
+                f.write(f"  {rule}: {count}\n")
+            for note in change_notes:
+                f.write(f"  {note}\n")
+            f.write("\nEdits (line:column in the original, rule, ...context [before -> after] context...):\n")
+            for start, end, before, after, rule, stage in entries:
+                left = source[max(0, start - CHANGE_CONTEXT_CHARS):start]
+                right = source[end:end + CHANGE_CONTEXT_CHARS]
+                f.write(f"{lines.position(start)}\t{rule}\t...{_report_snippet(left)}"
+                        f"[{_report_snippet(before)} -> {_report_snippet(after)}]{_report_snippet(right)}...\n")
+    log_message(f"Wrote change report with {len(entries)} edit(s) to '{report_path}'.")
+    return report_path
+
+
+# --- HTML Documents ---
+# HTML/XHTML books are tokenized once into a flat list of markup and text parts that
+# keeps the source exactly. The text stages only ever see the text nodes, decoded and
+# joined in document order (with a newline between blocks that have no whitespace of
+# their own), so rules can still match across inline tags but never touch tag names,
+# attributes or CSS classes. Every edit is recorded in the change log, and at the end the
+# node boundaries are mapped forward through it to cut the final text back into the
+# nodes; the document is serialized once, with the markup untouched.
+HTML_EXTENSIONS = (".xhtml", ".html")
+HTML_BLOCK_TAGS = {'address', 'article', 'aside', 'blockquote', 'body', 'br', 'dd', 'div', 'dl', 'dt',
+                   'figcaption', 'figure', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'head', 'header',
+                   'hr', 'html', 'li', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'title', 'tr', 'ul'}
+HTML_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+_MARKUP_RE = re.compile(
+    r"<!--.*?-->|<!\[CDATA\[.*?\]\]>|<[?!][^>]*>" # Comments, CDATA, <?xml ...?>, <!DOCTYPE ...>
+    r"|<(script|style)\b(?:\"[^\"]*\"|'[^']*'|[^'\">])*>.*?</\1\s*>" # Script and style bodies are not text
+    r"|</?([A-Za-z][\w:.-]*)(?:\"[^\"]*\"|'[^']*'|[^'\">])*>", re.S | re.I)
+_PAGE_NUMBER_ATTR_RE = re.compile(r"\b(?:class|id)\s*=\s*[\"'][^\"']*page-number", re.I)
+_DIGITS_ONLY_RE = re.compile(r"\s*\d+\s*")
+_BLANK_LINES_RE = re.compile(r"[ \t\r\f\v]*\n(?:[ \t\r\f\v]*\n)+")
+
+html_document = None # HtmlDocument of the HTML book being processed, between parsing and serialization
+
+
+def is_html_path(path):
+    """True if `path` is processed as HTML/XHTML rather than plain text."""
+    return str(path).lower().endswith(HTML_EXTENSIONS)
+
+
+class HtmlDocument:
+    """One parse of an HTML/XHTML book: its parts, the joined text of its text nodes, and pagination candidates."""
+
+    def __init__(self, markup):
+        import html
+        self.parts = [] # Markup and raw text parts, in source order; "".join(parts) == markup
+        self.part_offsets = [] # Source offset of each part (for line numbers in logs)
+        self.piece_parts = [] # For each piece of the joined text: its text part, or None (block newline or line layout)
+        self.piece_starts = [] # Offset of each piece in the joined text
+        self.removed = set() # Part indices dropped from the output (pagination)
+        self.page_elements = [] # (first part, last part) of elements that look like page numbers
+        self.layer_base = None # len(change_layers) when the joined text became the global text
+        pieces = []
+        length = 0
+        last_char = "\n"
+        block_break = False # A block tag was passed since the last text
+        stack = [] # Open elements: [name, first part, start tag, has child elements, text pieces]
+
+        def add_piece(piece, part):
+            nonlocal length, last_char, block_break
+            if block_break and part is not None and not last_char.isspace() and not piece[:1].isspace():
+                block_break = False
+                add_piece("\n", None) # Keep the words of neighbouring blocks apart
+            block_break = False
+            self.piece_parts.append(part)
+            self.piece_starts.append(length)
+            pieces.append(piece)
+            length += len(piece)
+            if piece:
+                last_char = piece[-1]
+
+        def add_part(raw, offset):
+            self.parts.append(raw)
+            self.part_offsets.append(offset)
+            return len(self.parts) - 1
+
+        pos = 0
+        for n, m in enumerate(fast_regex(_MARKUP_RE, markup).finditer(markup)):
+            if not n % CHECK_EVERY:
+                check_cancelled()
+            if m.start() > pos: # Text node
+                raw = markup[pos:m.start()]
+                node = html.unescape(raw) if "&" in raw else raw
+                part = add_part(raw, pos)
+                if "\n" in node and not node.strip(): # Line layout between tags: the stages see it, the output keeps it
+                    add_piece(node, None)
+                else:
+                    add_piece(node, part)
+                    if stack:
+                        stack[-1][4].append(node)
+            tag = m.group(0)
+            name = (m.group(1) or m.group(2) or "").lower()
+            part = add_part(tag, m.start())
+            if name in HTML_BLOCK_TAGS:
+                block_break = True
+            if m.group(2):
+                if tag.startswith("</"):
+                    self._close_element(stack, name, part)
+                elif not tag.endswith("/>") and name not in HTML_VOID_TAGS:
+                    if stack:
+                        stack[-1][3] = True
+                    stack.append([name, part, tag, False, []])
+                elif stack:
+                    stack[-1][3] = True
+            pos = m.end()
+        if pos < len(markup):
+            add_piece(html.unescape(markup[pos:]), add_part(markup[pos:], pos))
+        self.piece_starts.append(length) # End of the last piece
+        self.text = "".join(pieces)
+
+    def _close_element(self, stack, name, end_part):
+        """Pops the element `name` (and anything left open inside it) and notes it if it looks like a page number."""
+        for depth in range(len(stack) - 1, -1, -1):
+            if stack[depth][0] == name:
+                break
+        else:
+            return # Stray end tag
+        element_name, start_part, start_tag, has_children, texts = stack[depth]
+        del stack[depth:]
+        if stack and (has_children or texts):
+            stack[-1][3] = True
+        # Same elements the BeautifulSoup version removed: a page-number class or id, or a tag
+        # whose name contains "p" (p, span, sup, ...) and whose only content is a number
+        if _PAGE_NUMBER_ATTR_RE.search(start_tag) or (
+                "p" in element_name and not has_children and _DIGITS_ONLY_RE.fullmatch("".join(texts))):
+            self.page_elements.append((start_part, end_part))
+
+    def current_offsets(self):
+        """The piece boundaries mapped through every edit recorded since the text was handed to the pipeline."""
+        offsets = self.piece_starts
+        for layer in change_layers[self.layer_base:]:
+            offsets = layer.to_output(offsets)
+        return offsets
+
+    def serialize(self, text_content, squeeze_blank_lines=False):
+        """
+        Cuts `text_content` (the processed joined text) back into the text nodes and returns
+        the markup. Unchanged nodes are copied from the source, so unprocessed markup
+        round-trips byte for byte. Line layout between tags is kept, with empty lines
+        dropped if asked.
+        """
+        import html
+        offsets = self.current_offsets()
+        node_text = {part: text_content[offsets[k]:offsets[k + 1]]
+                     for k, part in enumerate(self.piece_parts) if part is not None}
+        output = []
+        for part, raw in enumerate(self.parts):
+            if part in self.removed:
+                continue
+            if part in node_text:
+                node = node_text[part]
+                if node == raw or ("&" in raw and node == html.unescape(raw)):
+                    output.append(raw) # Unchanged node: keep its source spelling (entities, bare ">")
+                else:
+                    output.append(html.escape(node, quote=False))
+            elif squeeze_blank_lines and not raw.strip() and "\n" in raw:
+                output.append(_BLANK_LINES_RE.sub("\n", raw))
+            else:
+                output.append(raw)
+        return "".join(output)
+
+
+def begin_html_document():
+    """Parses the global HTML text once and replaces it with the joined text of its text nodes."""
+    global text, html_document
+    html_document = HtmlDocument(text)
+    text = html_document.text
+    log_message(f"Parsed HTML into {len(html_document.parts)} parts, {len(html_document.text)} characters of text.")
+
+
+def remove_html_pagination(pagination_log):
+    """Removes the page-number elements of html_document: their text from the global text, their markup from the output."""
+    global text
+    offsets = html_document.current_offsets()
+    part_pieces = {part: k for k, part in enumerate(html_document.piece_parts) if part is not None}
+    lines = LineIndex("".join(html_document.parts)) if html_document.page_elements else None
+    edits = []
+    covered_to = -1
+    for first, last in sorted(html_document.page_elements):
+        if first <= covered_to: # Inside an element that is already removed
+            continue
+        covered_to = last
+        check_cancelled()
+        pagination_log.append(f"Removed (line {lines.line_of(html_document.part_offsets[first]) + 1}): "
+                              + "".join(html_document.parts[first:last + 1]))
+        if html_document.parts[last + 1:last + 2] and not html_document.parts[last + 1].strip():
+            last += 1 # Also drop the line break after the element, so no empty line is left
+        for part in range(first, last + 1):
+            html_document.removed.add(part)
+            k = part_pieces.get(part)
+            if k is not None and offsets[k] < offsets[k + 1]:
+                edits.append((offsets[k], offsets[k + 1], ""))
+    text = splice_edits(text, edits, rule='PAGINATION')
+
+
+def finish_html_document(squeeze_blank_lines=False):
+    """Serializes html_document once with the processed text and makes the markup the global text again."""
+    global text, html_document
+    text = html_document.serialize(text, squeeze_blank_lines)
+    html_document = None
+    log_message("Serialized the HTML document.")
+
+
+# --- Character Normalization ---
+# Curly quotes, dashes, ellipses, ligatures, soft hyphens, zero-width characters and
+# non-breaking spaces are mapped to plain equivalents in a single str.translate pass
+# (optionally after NFKC) before any rule runs, so the rules only need the plain
+# spelling and TTS never sees the odd characters. The map comes from # NORMALIZE in
+# .data.txt; characters can be written as themselves or as U+XXXX.
+_CODEPOINT_RE = re.compile(r'U\+([0-9A-Fa-f]{4,6})')
+
+normalization = {} # Character -> replacement, from # NORMALIZE
+normalize_nfkc = False # 'NFKC' line in # NORMALIZE: apply unicodedata NFKC first
+normalization_table = {} # str.translate table compiled from `normalization`
+
+
+def decode_codepoints(spec):
+    """Replaces every U+XXXX in a # NORMALIZE entry with the character it names."""
+    return _CODEPOINT_RE.sub(lambda m: chr(int(m.group(1), 16)), spec)
+
+
+_NON_ASCII_RUN_RE = re.compile(r"[^\x00-\x7f]+")
+
+
+def nfkc_edits(text_content):
+    """
+    Returns the (start, end, replacement) edits that apply NFKC to `text_content`, one per
+    changed character (with its combining marks). ASCII never changes and never combines
+    with what precedes it, so each run of non-ASCII characters (plus the character
+    before it, which a combining mark may join) is normalized on its own. Characters that
+    compose across clusters (Hangul jamo, some vowel signs) make their run one edit.
+    """
+    import unicodedata
+    edits = []
+    for m in _NON_ASCII_RUN_RE.finditer(text_content):
+        start = max(m.start() - 1, 0)
+        run = text_content[start:m.end()]
+        normalized = unicodedata.normalize('NFKC', run)
+        if normalized == run:
+            continue
+        clusters = []
+        for char in run: # A cluster is a starter and the combining marks after it
+            if clusters and unicodedata.combining(char):
+                clusters[-1] += char
+            else:
+                clusters.append(char)
+        pieces = [unicodedata.normalize('NFKC', cluster) for cluster in clusters]
+        if "".join(pieces) != normalized:
+            edits.append((start, m.end(), normalized))
+            continue
+        pos = start
+        for cluster, piece in zip(clusters, pieces):
+            if piece != cluster:
+                edits.append((pos, pos + len(cluster), piece))
+            pos += len(cluster)
+    return edits
+
+
+def normalize_characters():
+    """Normalizes the global text: optional NFKC, then one str.translate pass with the # NORMALIZE map."""
+    global text
+    log_message("Starting character normalization.")
+    before = len(text)
+    if normalize_nfkc:
+        import unicodedata
+        if change_log_enabled: # Itemized, so the report (and HTML text nodes) see each changed character
+            text = splice_edits(text, nfkc_edits(text), rule='NFKC')
+        else:
+            text = unicodedata.normalize('NFKC', text)
+    if change_log_enabled and normalization:
+        pattern = re.compile("[" + "".join(re.escape(c) for c in normalization) + "]")
+        record_changes([(m.start(), m.end(), m.group(0), normalization[m.group(0)], 'NORMALIZE')
+                        for m in pattern.finditer(text)])
+    text = text.translate(normalization_table)
+    log_message(f"Character normalization complete ({before} -> {len(text)} chars).")
+
+
+# --- Number Verbalization ---
+# Replaces the old one-line-per-ordinal REPLACE rules. A single compiled scan finds
+# currency, calibers, decimals, ordinals, years and cardinals, and each distinct token
+# is spelled out once (results are memoized, books repeat the same numbers a lot).
+# A leading minus is read as "minus" and a trailing % as "percent". A bare 1100-2099
+# is only read as a year after a cue word ("in 1984", "the summer of 1969") or when no
+# word follows it ("It was 1984."), so "1500 soldiers" stays a quantity. With the step
+# off, apply_replacements still gets ordinals and calibers spelled out, as the REPLACE
+# rules this took over used to do.
+_ONES = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine",
+         "ten", "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen",
+         "seventeen", "eighteen", "nineteen"]
+_TENS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+_SCALES = [(10 ** 12, "trillion"), (10 ** 9, "billion"), (10 ** 6, "million"), (1000, "thousand")]
+_ORDINAL_WORDS = {"one": "first", "two": "second", "three": "third", "five": "fifth",
+                  "eight": "eighth", "nine": "ninth", "twelve": "twelfth"}
+_CURRENCIES = {"$": ("dollar", "dollars", "cent", "cents"),
+               "£": ("pound", "pounds", "penny", "pence"),
+               "€": ("euro", "euros", "cent", "cents")}
+
+NUMBER_PATTERN = re.compile(
+    r"(?P<skip>\d+(?:[-/:]\d+)+|\d+(?:\.\d+){2,})" # Dates, times, phone numbers, versions: leave alone
+    r"|(?P<currency>[$£€])\s?(?P<amount>\d{1,3}(?:,\d{3})+|\d+)(?:\.(?P<minor>\d{1,2}))?"
+    r"(?:\s+(?P<scale>thousand|million|billion|trillion)\b)?"
+    r"|(?<![\w.])\.(?P<caliber>\d{2,3})\b" # .45, .357
+    r"|\b(?P<ordinal>\d+)(?P<suffix>st|nd|rd|th)\b"
+    r"|(?P<minus>(?<![\w.,\-−])[-−])?\b(?:(?P<decimal>\d+\.\d+)|(?P<cardinal>\d{1,3}(?:,\d{3})+|\d+))\b"
+    r"(?P<percent>\s?%)?", # "-5" is not a range, "Catch-22" is not negative
+    re.IGNORECASE
+)
+_YEAR_CUE_RE = re.compile(r"\b(?:in|since|by|of|from|until|till|before|after|during|circa|around|c\.|ca\.)\s+$", re.IGNORECASE)
+_FOLLOWING_WORD_RE = re.compile(r"[ \t]*[^\W\d_]") # A word follows on the same line
+YEAR_CUE_LOOKBEHIND = 8 # Characters before a number searched for a year cue word
+_NUMBER_KINDS = ('skip', 'currency', 'caliber', 'decimal', 'ordinal', 'cardinal') # Alternatives in NUMBER_PATTERN
+
+
+def _hundreds_to_words(n):
+    """Spells out 0 < n < 1000."""
+    words = []
+    if n >= 100:
+        words.append(_ONES[n // 100] + " hundred")
+        n %= 100
+    if n >= 20:
+        words.append(_TENS[n // 10] + ("-" + _ONES[n % 10] if n % 10 else ""))
+    elif n:
+        words.append(_ONES[n])
+    return " ".join(words)
+
+
+def number_to_words(n):
+    """Spells out a non-negative integer, e.g. 1234 -> 'one thousand two hundred thirty-four'."""
+    if n < 20:
+        return _ONES[n]
+    if n >= 10 ** 15: # Too large to be read as a quantity; read the digits
+        return " ".join(_ONES[int(d)] for d in str(n))
+    words = []
+    for value, name in _SCALES:
+        if n >= value:
+            words.append(number_to_words(n // value) + " " + name)
+            n %= value
+    if n:
+        words.append(_hundreds_to_words(n))
+    return " ".join(words)
+
+
+def ordinal_to_words(n):
+    """Spells out an ordinal, e.g. 101 -> 'one hundred first', 22 -> 'twenty-second'."""
+    words = number_to_words(n)
+    head, sep, last = max(words.rpartition(" "), words.rpartition("-"), key=lambda p: len(p[0]))
+    if last in _ORDINAL_WORDS:
+        last = _ORDINAL_WORDS[last]
+    elif last.endswith("y"):
+        last = last[:-1] + "ieth"
+    else:
+        last += "th"
+    return head + sep + last
+
+
+def year_to_words(n):
+    """Spells out a year the way it is spoken, e.g. 1984 -> 'nineteen eighty-four', 1905 -> 'nineteen oh five'."""
+    if 2000 <= n < 2010:
+        return number_to_words(n)
+    high, low = divmod(n, 100)
+    if low == 0:
+        return number_to_words(high) + " hundred"
+    if low < 10:
+        return number_to_words(high) + " oh " + _ONES[low]
+    return number_to_words(high) + " " + number_to_words(low)
+
+
+def _is_year(digits):
+    """Four-digit numbers in this range can be years (see _reads_as_year for when they are)."""
+    return len(digits) == 4 and 1100 <= int(digits) <= 2099
+
+
+def _reads_as_year(m):
+    """True when the bare cardinal matched by `m` is spoken as a year: after a cue word, or with no word after it."""
+    if m.group('minus') or m.group('percent') or not _is_year(m.group('cardinal')):
+        return False
+    start = m.start('cardinal')
+    if _YEAR_CUE_RE.search(m.string, max(0, start - YEAR_CUE_LOOKBEHIND), start):
+        return True
+    return not _FOLLOWING_WORD_RE.match(m.string, m.end())
+
+
+def _verbalize_number_match(m):
+    """re.sub callback for NUMBER_PATTERN."""
+    kind = next(k for k in _NUMBER_KINDS if m.group(k) is not None)
+    if kind == 'currency':
+        return _verbalize_token(kind, m.group(0), m.group('amount'), m.group('minor'), m.group('scale'))
+    if kind in ('decimal', 'cardinal'):
+        spoken = _verbalize_token(kind, m.group(kind), year=kind == 'cardinal' and _reads_as_year(m))
+        if m.group('minus'):
+            spoken = "minus " + spoken
+        return spoken + " percent" if m.group('percent') else spoken
+    return _verbalize_token(kind, m.group(0))
+
+
+@functools.lru_cache(maxsize=4096)
+def _verbalize_token(kind, token, amount=None, minor=None, scale=None, year=False):
+    """Spells out one matched number token. Memoized on the token text."""
+    if kind == 'skip':
+        return token
+    if kind == 'currency':
+        one, many, minor_one, minor_many = _CURRENCIES[token.lstrip()[0]]
+        value = int(amount.replace(",", ""))
+        if scale: # "$5 million" -> "five million dollars", "$2.5 billion" -> "two point five billion dollars"
+            spoken = number_to_words(value) + (" point " + " ".join(_ONES[int(d)] for d in minor) if minor else "")
+            return f"{spoken} {scale.lower()} {many}"
+        cents = int(minor.ljust(2, "0")) if minor else 0
+        spoken_cents = f"{number_to_words(cents)} {minor_one if cents == 1 else minor_many}"
+        if value == 0 and cents: # "$0.99" -> "ninety-nine cents"
+            return spoken_cents
+        spoken = f"{number_to_words(value)} {one if value == 1 else many}"
+        return spoken + f" and {spoken_cents}" if cents else spoken
+    if kind == 'caliber':
+        digits = token.lstrip(".")
+        if len(digits) == 3: # .357 -> "three fifty-seven", .308 -> "three oh eight"
+            low = int(digits[1:])
+            return _ONES[int(digits[0])] + " " + (number_to_words(low) if low >= 10 else "oh " + _ONES[low])
+        return number_to_words(int(digits))
+    if kind == 'decimal':
+        whole, frac = token.split(".")
+        return number_to_words(int(whole)) + " point " + " ".join(_ONES[int(d)] for d in frac)
+    if kind == 'ordinal':
+        return ordinal_to_words(int(token[:-2]))
+    if kind == 'cardinal':
+        if year:
+            return year_to_words(int(token))
+        return number_to_words(int(token.replace(",", "")))
+    return token
+
+
+VERBALIZE_BLOCK_CHARS = 1 << 20 # Text is verbalized in ~1 MB blocks split at line ends
+
+
+def verbalize_text(text_content, kinds=None):
+    """
+    Returns `text_content` with every number spelled out in one regex pass, run in
+    line-aligned blocks so cancellation and stage budgets are checked between blocks.
+    `kinds` limits it to some of the NUMBER_PATTERN kinds (e.g. ('ordinal', 'caliber')).
+    """
+    pieces = []
+    edits = []
+    pos = 0
+    while pos < len(text_content):
+        check_cancelled()
+        end = text_content.find("\n", pos + VERBALIZE_BLOCK_CHARS)
+        end = len(text_content) if end == -1 else end + 1
+        substitute = _verbalize_number_match
+        if kinds is not None:
+            def substitute(m):
+                return _verbalize_number_match(m) if any(m.group(k) is not None for k in kinds) else m.group(0)
+        if change_log_enabled:
+            def substitute(m, base=pos, spell=substitute):
+                new = spell(m)
+                if new != m.group(0):
+                    edits.append((base + m.start(), base + m.end(), m.group(0), new, 'NUMBER'))
+                return new
+        block = text_content[pos:end]
+        pieces.append(fast_regex(NUMBER_PATTERN, block).sub(substitute, block))
+        pos = end
+    record_changes(edits)
+    return "".join(pieces)
+
+
+def verbalize_numbers():
+    """Pipeline stage: spells out cardinals, ordinals, years, decimals and currency in the global text."""
+    global text
+    log_message("Starting number verbalization.")
+    text = verbalize_text(text)
+    info = _verbalize_token.cache_info()
+    log_message(f"Finished number verbalization ({info.currsize} distinct numbers, {info.hits} cache hits).")
+
+
+def verbalize_ordinals():
+    """Pipeline stage with Spell Out Numbers off: only ordinals and calibers, as the old REPLACE rules did."""
+    global text
+    log_message("Starting ordinal verbalization.")
+    text = verbalize_text(text, kinds=('ordinal', 'caliber'))
+    log_message("Finished ordinal verbalization.")
+
+
 # --- Pagination Removal Function ---
+# Besides bare page numbers, TXT books carry running headers and footers ("THE LOST
+# FLEET 213", the author's name) every page. detect_running_headers() finds them in one
+# pass: each short line is reduced to its shape (digits masked, case and spacing folded)
+# and a hash counter keeps, per shape, its count and the sum and sum of squares of the
+# line gaps between occurrences. Shapes that recur often at a steady page-like period are
+# headers and are removed in the same pass as the page numbers. When the counter reaches
+# HEADER_MAX_SHAPES it is cut down to the most frequent half of its shapes, so it
+# never holds more than HEADER_MAX_SHAPES entries and each cut is paid for by the new
+# shapes that filled it. Headers recur every page, so they are never the ones dropped.
+HEADER_MAX_CHARS = 80 # Longer lines are text, never headers
+HEADER_MIN_REPEATS = 5 # A header must appear at least this often
+HEADER_MIN_PERIOD = 15 # Mean line gap between repeats must look like a page: at least this many lines...
+HEADER_MAX_PERIOD = 150 # ...and at most this many (alternating left/right headers repeat every other page)
+HEADER_MAX_GAP_CV = 0.6 # Gap standard deviation / mean; chapter openers without headers make gaps uneven
+HEADER_MAX_SHAPES = 50000 # Counter size that triggers pruning down to the most frequent half
+HEADER_REPORT_CANDIDATES = 20 # Frequent short lines listed in pagination_debug.txt
+
+_DIGIT_RUN_RE = re.compile(r"\d+")
+_SPACE_RUN_RE = re.compile(r"\s+")
+
+
+def line_shape(line):
+    """The header shape of a line: digits masked, spacing collapsed, case folded. None for lines that cannot be headers."""
+    stripped = line.strip()
+    if not stripped or len(stripped) > HEADER_MAX_CHARS or stripped.isdigit() or stripped[0] in (CHAPTER_MARK, SCENE_MARK):
+        return None
+    return _SPACE_RUN_RE.sub(" ", _DIGIT_RUN_RE.sub("#", stripped)).casefold()
+
+
+def _prune_shape_stats(stats):
+    """Keeps the most frequent half of a detect_running_headers() counter, ties going to the shapes seen latest."""
+    import heapq
+    return dict(heapq.nlargest(HEADER_MAX_SHAPES // 2, stats.items(), key=lambda item: (item[1][0], item[1][1])))
+
+
+def detect_running_headers(lines):
+    """
+    Returns (header shapes, report lines) for a list of lines. A shape is a header if it
+    appears at least HEADER_MIN_REPEATS times with a mean gap in the page-like range and
+    gaps regular enough (coefficient of variation at most HEADER_MAX_GAP_CV).
+    """
+    stats = {} # shape -> [count, last line, gap sum, gap sum of squares]
+    for n, line in enumerate(lines):
+        if not n % CHECK_EVERY:
+            check_cancelled()
+        shape = line_shape(line)
+        if shape is None:
+            continue
+        entry = stats.get(shape)
+        if entry is None:
+            if len(stats) >= HEADER_MAX_SHAPES: # Forget the rarest shapes; headers recur long before this fills up
+                stats = _prune_shape_stats(stats)
+            stats[shape] = [1, n, 0, 0]
+            continue
+        gap = n - entry[1]
+        entry[0] += 1
+        entry[1] = n
+        entry[2] += gap
+        entry[3] += gap * gap
+
+    headers = set()
+    report = []
+    frequent = sorted(((entry[0], shape) for shape, entry in stats.items() if entry[0] >= HEADER_MIN_REPEATS), reverse=True)
+    for count, shape in frequent:
+        gaps = count - 1
+        mean = stats[shape][2] / gaps
+        cv = max(0.0, stats[shape][3] / gaps - mean * mean) ** 0.5 / mean
+        is_header = HEADER_MIN_PERIOD <= mean <= HEADER_MAX_PERIOD and cv <= HEADER_MAX_GAP_CV
+        if is_header and re.fullmatch(_HEADING_KEYWORD_RE.pattern + r"[\s#.:ivxlcdm-]*", shape):
+            is_header = False # "Chapter 12" lines of a book with short, even chapters are headings, not headers
+        if is_header:
+            headers.add(shape)
+        if is_header or len(report) < HEADER_REPORT_CANDIDATES:
+            report.append(f"{'Header' if is_header else 'Kept'}: {shape!r} x{count}, every {mean:.0f} lines (gap cv {cv:.2f})")
+    return headers, report
+
+
 def remove_pagination():
     """
     Attempts to remove pagination elements from the text based on file type.
-    Uses BeautifulSoup for HTML/XHTML and simple line checks for TXT files.
+    Uses the parsed document for HTML/XHTML and simple line checks for TXT files.
     Logs removed elements to a debug file.
     """
     global text, filepath
@@ -1135,46 +3001,31 @@ def remove_pagination():
 
     try:
         # Check if the file is HTML or XHTML
-        if filepath.lower().endswith((".xhtml", ".html")):
-            soup = BeautifulSoup(text, 'xml') # Parse the text using BeautifulSoup's XML parser
-
-            # Find elements commonly used for pagination based on class or ID
-            page_number_elements = soup.find_all(class_=re.compile(r"page-number", re.IGNORECASE))
-            page_number_elements.extend(soup.find_all(id=re.compile(r"page-number", re.IGNORECASE)))
-            # Find <p> tags containing only digits (common for simple page numbers)
-            page_number_elements.extend(soup.find_all(name=re.compile(r"p", re.IGNORECASE), string=re.compile(r"^\s*\d+\s*$", re.IGNORECASE)))
-
-            # Iterate through found elements
-            for element in page_number_elements:
-                pagination_log.append(f"Removed: {element}") # Log the element
-                element.decompose() # Remove the element from the soup
-
-            text = str(soup) # Convert the modified soup back to a string
-            # Remove any empty lines that might result from element removal
-            lines = text.splitlines()
-            filtered_lines = [line for line in lines if line.strip()]
-            text = "\n".join(filtered_lines)
+        if html_document is not None:
+            # Page-number elements were found while parsing; drop them from the tree and their text from the text
+            remove_html_pagination(pagination_log)
 
         # Check if the file is a plain text file
         elif filepath.lower().endswith(".txt"):
+            # run_processing does this through apply_line_filters()
             lines = text.splitlines() # Split text into lines
-            filtered_lines = [] # List for lines to keep
-            # Iterate through each line
-            for line in lines:
-                # If the line contains only digits (potential page number)
-                if line.strip().isdigit():
-                    pagination_log.append(f"Removed: {line}") # Log the line
-                    # Skip adding this line to filtered_lines (effectively removing it)
-                else:
-                    filtered_lines.append(line) # Keep lines that are not just digits
-            text = "\n".join(filtered_lines) # Join filtered lines back
+            dropped = []
+            text, _ = filter_lines(text, [page_line_predicate(lines, pagination_log)], lines=lines, dropped=dropped)
+            pagination_log.extend(f"Removed (line {n + 1}): {line}" for n, line, _ in dropped)
 
+    except (ProcessingCancelled, StageBudgetExceeded):
+        raise # Not an error: let run_stage / the worker deal with it
     except Exception as e:
         # Handle errors during pagination removal
         log_message(f"Error removing pagination: {e}", level="ERROR")
-        messagebox.showerror("Error", f"Error removing pagination: {e}")
+        show_error("Error", f"Error removing pagination: {e}")
 
-    # Save the log of removed pagination to a file
+    write_pagination_log(pagination_log)
+    log_message("Finished removing pagination.")
+
+
+def write_pagination_log(pagination_log):
+    """Saves the log of removed pagination to pagination_debug.txt."""
     try:
         with open("pagination_debug.txt", "w", encoding="utf-8") as log_file:
             log_file.write("\n".join(pagination_log))
@@ -1182,38 +3033,1748 @@ def remove_pagination():
     except Exception as e:
         log_message(f"Error saving pagination debug log: {e}", level="ERROR")
 
-    log_message("Finished removing pagination.")
 
-# --- Remove blank lines from doucment
+def page_line_predicate(lines, pagination_log):
+    """
+    Returns ('PAGINATION', drop(line)) for the TXT page lines of `lines`: lines holding only
+    a page number, and the running headers/footers found by detect_running_headers().
+    """
+    headers, header_report = detect_running_headers(lines)
+    pagination_log.extend(header_report)
+    if not headers:
+        return 'PAGINATION', lambda line: line.strip().isdigit()
+    return 'PAGINATION', lambda line: line.strip().isdigit() or line_shape(line) in headers
+
+# --- Line Filters ---
+# Page-number/header removal, blank-line removal and whitespace trimming all work line by
+# line. Instead of each one splitting the whole text, building a new list and joining it
+# again, they run as one stage: a single pass over the lines applies every enabled drop
+# predicate and the trim, counts what each predicate removed, and the result is joined
+# once. iter_filtered_lines() is that pass as a generator for callers that stream lines.
+BLANK_LINE_PREDICATE = ('BLANK_LINE', lambda line: not line.strip())
+
+
+def iter_filtered_lines(lines, predicates, trim=False, counts=None, dropped=None):
+    """
+    Yields the lines no predicate drops, stripped of surrounding whitespace if `trim`.
+    `predicates` is a list of (name, drop(line)); a dropped line is counted under the first
+    predicate that drops it in `counts`, and (index, line, name) is appended to `dropped`.
+    """
+    for n, line in enumerate(lines):
+        if not n % CHECK_EVERY:
+            check_cancelled()
+        for name, drop in predicates:
+            if drop(line):
+                if counts is not None:
+                    counts[name] = counts.get(name, 0) + 1
+                if dropped is not None:
+                    dropped.append((n, line, name))
+                break
+        else:
+            if trim:
+                stripped = line.strip()
+                if counts is not None and len(stripped) != len(line):
+                    counts['TRIM'] = counts.get('TRIM', 0) + 1
+                line = stripped
+            yield line
+
+
+def filter_lines(text_content, predicates, trim=False, lines=None, dropped=None):
+    """
+    Applies every predicate (and the trim) to the lines of `text_content` in one pass and
+    joins the kept lines with "\\n". `lines` may pass in text_content.splitlines() if the
+    caller already has it. Returns (new text, {predicate name or 'TRIM': lines affected}).
+    """
+    counts = {name: 0 for name, _ in predicates}
+    if trim:
+        counts['TRIM'] = 0
+    record_line_filter(text_content, predicates, trim)
+    if lines is None:
+        lines = text_content.splitlines()
+    return "\n".join(iter_filtered_lines(lines, predicates, trim, counts, dropped)), counts
+
+
+def apply_line_filters(paginate=False, drop_blank=False, trim=False):
+    """
+    Pipeline stage: page numbers and running headers (TXT), blank lines and surrounding
+    whitespace, whichever are asked for, in a single pass over the global text.
+    run_processing() filters pagination before the rules and blank lines and whitespace
+    as the last step, as before, so each is one pass.
+    """
+    global text
+    predicates = []
+    lines = None
+    pagination_log = []
+    paginate = paginate and html_document is None and filepath.lower().endswith(".txt")
+    if paginate:
+        lines = text.splitlines()
+        predicates.append(page_line_predicate(lines, pagination_log))
+    if drop_blank:
+        predicates.append(BLANK_LINE_PREDICATE)
+    dropped = []
+    text, counts = filter_lines(text, predicates, trim, lines, dropped)
+    if paginate:
+        pagination_log.extend(f"Removed (line {n + 1}): {line}" for n, line, name in dropped if name == 'PAGINATION')
+        write_pagination_log(pagination_log)
+    log_message("Line filters: " + ", ".join(f"{name} {count} line(s)" for name, count in counts.items()))
+
 
 def remove_blank_lines(text_content):
     """Removes blank lines (including lines with only whitespace) from the text content."""
     log_message("Removing blank lines...")
-    # Split the text into lines
-    lines = text_content.splitlines()
-    # Filter out lines that are empty or contain only whitespace
-    non_blank_lines = [line for line in lines if line.strip()]
-    # Join the remaining lines back together with newline characters
-    cleaned_text = "\n".join(non_blank_lines)
+    cleaned_text, _ = filter_lines(text_content, [BLANK_LINE_PREDICATE])
     log_message("Blank line removal complete.")
     return cleaned_text
 
+# --- Chapter Detection ---
+# Headings are found in one pass over the lines of the *original* text, before any rule
+# can rewrite them (e.g. the "* ->" rule deletes "* * *" scene breaks, and lowercasing
+# hides all-caps headings). Each heading line is tagged with an invisible private-use
+# marker that survives every later stage; collect_chapters() strips the markers at the
+# end and records their offsets in the final text.
+CHAPTER_MARK = "\ue000" # Prefixed to heading lines while the pipeline runs
+SCENE_MARK = "\ue001" # Replaces scene-break lines while the pipeline runs
+CHAPTERS_DIR_SUFFIX = "_chapters" # Per-chapter files are written to <stem>_chapters/
+CAPS_HEADING_MAX_CHARS = 60 # Longer all-caps lines are treated as text, not headings
+CAPS_HEADING_MAX_WORDS = 8
+
+ROMAN_HEADING_MAX_CHARS = 8 # A bare roman numeral line longer than this is text
+ROMAN_HEADING_MAX_VALUE = 150 # ... as is one above this ("DC", "MIX")
+
+# "Part", "Book" and "Section" start ordinary sentences too, so these keywords only make a
+# heading when followed by a number, numeral or number word, or when alone on the line.
+# "Prologue" and the like may instead be followed by a separator and a title.
+_HEADING_NUMBER = (r"(?:\d+|[ivxlcdm]+|(?:twenty|thirty|forty|fifty|sixty|seventy|eighty|ninety)"
+                   r"(?:[\s-]+(?:one|two|three|four|five|six|seven|eight|nine))?"
+                   r"|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|thirteen"
+                   r"|fourteen|fifteen|sixteen|seventeen|eighteen|nineteen|hundred)\b")
+_HEADING_KEYWORD_RE = re.compile(
+    r"(?:chapter|chap\.|part|book|section|prologue|epilogue|interlude|afterword|foreword|introduction)\b",
+    re.IGNORECASE
+)
+_NUMBERED_HEADING_RE = re.compile(
+    rf"(?:chapter|chap\.|part|book|section)\s*(?:$|{_HEADING_NUMBER})"
+    rf"|(?:prologue|epilogue|interlude|afterword|foreword|introduction)\b\s*(?:$|[:.\-–—]|{_HEADING_NUMBER})",
+    re.IGNORECASE
+)
+_ROMAN_HEADING_RE = re.compile(r"[IVXLCDM]+\.?")
+_SCENE_BREAK_RE = re.compile(r"[*#~•·=_\-–—](?:\s*[*#~•·=_\-–—])*")
+
+chapter_headings = [] # (kind, original heading text) for each CHAPTER_MARK, in document order
+chapters = [] # Final chapter index: dicts with index, kind, title, start, end
+scene_breaks = [] # Offsets of scene breaks in the final text
+
+
+def classify_heading_line(stripped, previous_blank, next_blank=True):
+    """
+    Returns 'numbered', 'roman', 'caps' or 'scene' if the stripped line is a chapter
+    heading or scene break, otherwise None. Headings must follow a blank line (or the
+    start of the file); a bare roman numeral must also be followed by one.
+    """
+    if not stripped or len(stripped) > 80:
+        return None
+    if _SCENE_BREAK_RE.fullmatch(stripped):
+        return 'scene'
+    if not previous_blank:
+        return None
+    if _NUMBERED_HEADING_RE.match(stripped):
+        return 'numbered'
+    if _ROMAN_HEADING_RE.fullmatch(stripped):
+        numeral = stripped.rstrip('.')
+        if not next_blank or len(numeral) > ROMAN_HEADING_MAX_CHARS:
+            return None
+        # A lone "I" is a valid heading on its own line even though roman_to_arabic skips it
+        if numeral == "I" or 0 < (roman_to_arabic(numeral) or 0) <= ROMAN_HEADING_MAX_VALUE:
+            return 'roman'
+        return None
+    if (previous_blank and len(stripped) <= CAPS_HEADING_MAX_CHARS
+            and stripped.upper() == stripped and sum(c.isalpha() for c in stripped) >= 2
+            and len(stripped.split()) <= CAPS_HEADING_MAX_WORDS
+            and stripped[-1] not in '!?,;:"”\'’' and stripped[0] not in '"“\'‘'):
+        return 'caps'
+    return None
+
+
+def mark_chapter_headings():
+    """Pipeline stage: tags chapter headings and scene breaks in the global text with markers."""
+    global text, chapter_headings
+    log_message("Starting chapter detection.")
+    chapter_headings = []
+    out_lines = []
+    previous_blank = True # Start of file counts as a blank line before the first heading
+    found_scenes = 0
+    edits = []
+    pos = 0
+    lines = text.split("\n")
+    for n, line in enumerate(lines):
+        if not n % CHECK_EVERY:
+            check_cancelled()
+        stripped = line.strip()
+        kind = classify_heading_line(stripped, previous_blank, n + 1 == len(lines) or not lines[n + 1].strip())
+        if kind == 'scene':
+            out_lines.append(SCENE_MARK)
+            edits.append((pos, pos + len(line), line, SCENE_MARK, 'SCENE_BREAK'))
+            found_scenes += 1
+        elif kind:
+            chapter_headings.append((kind, stripped))
+            out_lines.append(CHAPTER_MARK + line)
+            edits.append((pos, pos, "", CHAPTER_MARK, 'CHAPTER_MARK'))
+        else:
+            out_lines.append(line)
+        previous_blank = not stripped
+        pos += len(line) + 1
+    record_changes(edits)
+    text = "\n".join(out_lines)
+    log_message(f"Finished chapter detection: {len(chapter_headings)} heading(s), {found_scenes} scene break(s).")
+
+
+def collect_chapters():
+    """
+    Pipeline stage: removes the heading markers from the global text in one pass and builds
+    the chapter offsets index (`chapters`) and `scene_breaks` for the final text.
+    """
+    global text, chapters, scene_breaks
+    pieces = []
+    starts = []
+    scene_breaks = []
+    pos = 0
+    out_len = 0
+    markers = list(re.finditer(f"[{CHAPTER_MARK}{SCENE_MARK}]", text))
+    record_changes([(m.start(), m.end(), m.group(0), "", 'CHAPTER_MARK') for m in markers], 'collect_chapters')
+    for m in markers:
+        pieces.append(text[pos:m.start()])
+        out_len += m.start() - pos
+        (starts if m.group(0) == CHAPTER_MARK else scene_breaks).append(out_len)
+        pos = m.end()
+    pieces.append(text[pos:])
+    text = "".join(pieces)
+
+    if len(starts) != len(chapter_headings):
+        log_message(f"Expected {len(chapter_headings)} chapter markers but found {len(starts)}; "
+                    "a processing rule may have removed some.", level="WARNING")
+    chapters = []
+    if starts and text[:starts[0]].strip(): # Text before the first heading becomes front matter
+        starts.insert(0, 0)
+        kinds = [('front', '')] + list(chapter_headings)
+    else:
+        kinds = list(chapter_headings)
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(text)
+        line_end = text.find("\n", start)
+        title = text[start:line_end if line_end != -1 else end].strip()
+        kind = kinds[i][0] if i < len(kinds) else 'heading'
+        chapters.append({'index': i + 1, 'kind': kind, 'title': title, 'start': start, 'end': end})
+    log_message(f"Chapter index built: {len(chapters)} chapter(s), {len(scene_breaks)} scene break(s).")
+
+
+def write_chapters(text_content, chapter_list, output_path, scene_break_offsets=None):
+    """
+    Writes one file per chapter into <stem>_chapters/ next to `output_path`, plus
+    chapters.json with each chapter's offsets in the output file. Returns the directory.
+    """
+    import json
+    output_path = Path(output_path)
+    chapter_dir = output_path.with_name(output_path.stem + CHAPTERS_DIR_SUFFIX)
+    chapter_dir.mkdir(parents=True, exist_ok=True)
+    for stale in chapter_dir.glob("chapter_*.txt"): # Drop files from a previous run
+        stale.unlink()
+    index = []
+    lines = get_line_index(text_content)
+    for chapter in chapter_list:
+        name = f"chapter_{chapter['index']:03d}.txt"
+        with open(chapter_dir / name, 'w', encoding='utf-8') as f:
+            f.write(text_content[chapter['start']:chapter['end']].strip("\n"))
+        index.append(dict(chapter, file=name, line=lines.line_of(chapter['start']) + 1))
+    with open(chapter_dir / "chapters.json", 'w', encoding='utf-8') as f:
+        json.dump({'output': str(output_path), 'chapters': index,
+                   'scene_breaks': list(scene_break_offsets or [])}, f, indent=1)
+    log_message(f"Wrote {len(index)} chapter file(s) to '{chapter_dir}'.")
+    return chapter_dir
+
+
+# --- TTS Segmenter ---
+# Splits the finished text into sentence-aligned chunks under a size budget so
+# downstream TTS workers can render them in parallel.
+SEGMENT_MAX_CHARS = 4000 # Default chunk budget in characters
+SEGMENT_FORMATS = ("files", "jsonl") # Numbered chunk_0001.txt files, or a single chunks.jsonl
+CHUNKS_DIR_SUFFIX = "_chunks" # Chunks are written to <stem>_chunks/ next to the output
+
+# A sentence ends at . ! ? (optionally followed by closing quotes/brackets) and whitespace,
+# or at a line break (each line is a paragraph once blank lines are removed).
+_SENTENCE_END_RE = re.compile(r'[.!?…]+["\'”’)\]]*[ \t]+|\n')
+_TOKEN_RE = re.compile(r'\S+')
+
+segment_max_chars = SEGMENT_MAX_CHARS # Active budget in characters (None to disable)
+segment_max_tokens = None # Active budget in whitespace-separated tokens (None to disable)
+segment_format = "files" # Active output format, one of SEGMENT_FORMATS
+segment_chunks = [] # Chunks computed by the last run of segment_for_tts()
+
+
+def configure_segmenter(max_chars=None, max_tokens=None, fmt=None):
+    """Sets the chunk budget (characters and/or tokens) and output format."""
+    global segment_max_chars, segment_max_tokens, segment_format
+    if max_chars is not None:
+        segment_max_chars = max_chars or None
+    if max_tokens is not None:
+        segment_max_tokens = max_tokens or None
+    if fmt is not None:
+        if fmt not in SEGMENT_FORMATS:
+            raise ValueError(f"Unknown chunk format '{fmt}', expected one of {SEGMENT_FORMATS}")
+        segment_format = fmt
+
+
+def iter_sentence_spans(text_content):
+    """
+    Yields (start, end, ends_paragraph) for every sentence in one regex scan.
+    Spans include their trailing whitespace so consecutive spans tile the text.
+    """
+    pos = 0
+    for m in _SENTENCE_END_RE.finditer(text_content):
+        end = m.end()
+        if end > pos:
+            yield pos, end, m.group(0) == '\n'
+        pos = end
+    if pos < len(text_content):
+        yield pos, len(text_content), True
+
+
+def segment_text(text_content, max_chars=None, max_tokens=None, chapter_starts=None):
+    """
+    Packs sentences into chunks whose size stays under the character and/or token budget.
+    Chunks never cross a chapter start (sorted offsets in `chapter_starts`); a single
+    sentence longer than the budget becomes its own chunk. Returns a list of dicts
+    with 'index', 'start', 'end', 'chars', 'tokens' and 'chapter' (1-based position in
+    chapter_starts, matching the chapter index, or None before the first chapter).
+    """
+    import bisect
+    chapter_starts = list(chapter_starts or [])
+    chunks = []
+    chunk_start = None
+    chunk_end = 0
+    chunk_tokens = 0
+    chunk_chapter = None
+
+    def flush():
+        if chunk_start is not None and chunk_end > chunk_start:
+            chunks.append({
+                'index': len(chunks) + 1,
+                'start': chunk_start,
+                'end': chunk_end,
+                'chars': chunk_end - chunk_start,
+                'tokens': chunk_tokens,
+                'chapter': chunk_chapter,
+            })
+
+    for n, (start, end, _) in enumerate(iter_sentence_spans(text_content)):
+        if not n % CHECK_EVERY:
+            check_cancelled()
+        tokens = len(_TOKEN_RE.findall(text_content, start, end)) if max_tokens else 0
+        chapter = bisect.bisect_right(chapter_starts, start) or None
+        if chunk_start is not None:
+            over_chars = max_chars and (end - chunk_start) > max_chars
+            over_tokens = max_tokens and (chunk_tokens + tokens) > max_tokens
+            if over_chars or over_tokens or chapter != chunk_chapter:
+                flush()
+                chunk_start = None
+        if chunk_start is None:
+            chunk_start, chunk_tokens, chunk_chapter = start, 0, chapter
+        chunk_end = end
+        chunk_tokens += tokens
+    flush()
+    return chunks
+
+
+def segment_for_tts():
+    """Pipeline stage: computes TTS chunks for the global text (written out when the output is saved)."""
+    global segment_chunks
+    log_message("Starting TTS segmentation.")
+    segment_chunks = segment_text(text, max_chars=segment_max_chars, max_tokens=segment_max_tokens,
+                                  chapter_starts=[c['start'] for c in chapters])
+    log_message(f"Finished TTS segmentation: {len(segment_chunks)} chunk(s).")
+
+
+def write_segments(text_content, chunks, output_path, fmt=None, chapters=None):
+    """
+    Writes `chunks` of `text_content` into <stem>_chunks/ next to `output_path`, either as
+    numbered text files or as one JSONL file, plus a manifest.json with offsets and
+    chapter ids. Returns the path of the chunk directory.
+    """
+    import json
+    fmt = fmt or segment_format
+    output_path = Path(output_path)
+    chunk_dir = output_path.with_name(output_path.stem + CHUNKS_DIR_SUFFIX)
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    for stale in chunk_dir.glob("chunk_*.txt"): # Drop chunks from a previous, longer run
+        stale.unlink()
+    manifest = {
+        'output': str(output_path),
+        'format': fmt,
+        'max_chars': segment_max_chars,
+        'max_tokens': segment_max_tokens,
+        'chapters': chapters or [],
+        'chunks': [],
+    }
+    jsonl = open(chunk_dir / "chunks.jsonl", 'w', encoding='utf-8') if fmt == "jsonl" else None
+    lines = get_line_index(text_content)
+    try:
+        for chunk in chunks:
+            body = text_content[chunk['start']:chunk['end']]
+            entry = dict(chunk, line=lines.line_of(chunk['start']) + 1)
+            if jsonl:
+                jsonl.write(json.dumps(dict(entry, text=body), ensure_ascii=False) + "\n")
+                entry['file'] = "chunks.jsonl"
+            else:
+                name = f"chunk_{chunk['index']:04d}.txt"
+                with open(chunk_dir / name, 'w', encoding='utf-8') as f:
+                    f.write(body)
+                entry['file'] = name
+            manifest['chunks'].append(entry)
+    finally:
+        if jsonl:
+            jsonl.close()
+        elif (chunk_dir / "chunks.jsonl").exists():
+            (chunk_dir / "chunks.jsonl").unlink()
+    with open(chunk_dir / "manifest.json", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    log_message(f"Wrote {len(chunks)} chunk(s) to '{chunk_dir}'.")
+    return chunk_dir
+
+
+# --- Headless Processing ---
+# Checkbox defaults used when running without the GUI. Interactive steps are off
+# because there is nobody to answer their prompts.
+HEADLESS_STEP_DEFAULTS = {
+    'process_choices': False,
+    'apply_replacements': True,
+    'insert_periods': False,
+    'remove_pagination': True,
+    'convert_roman': True,
+    'convert_lowercase': True,
+    'process_all_caps': True,
+    'remove_blank_lines': True,
+    'trim_whitespace': False,
+    'plugin_stages': True,
+    'segment_output': False,
+    'detect_chapters': False,
+    'verbalize_numbers': True,
+    'normalize_characters': True,
+    'change_report': False,
+}
+
+
+def set_step_flags(**steps):
+    """
+    Sets the processing-step checkbox globals to StaticFlag objects so run_processing
+    can be driven without Tk. Unspecified steps use HEADLESS_STEP_DEFAULTS.
+    """
+    global process_choices_var, apply_replacements_var, insert_periods_var, \
+           remove_pagination_var, convert_roman_var, convert_lowercase_var, \
+           process_all_caps_var, remove_blank_lines_var, segment_output_var, detect_chapters_var, \
+           verbalize_numbers_var, normalize_characters_var, change_report_var, trim_whitespace_var, plugin_stages_var
+    flags = dict(HEADLESS_STEP_DEFAULTS)
+    flags.update(steps)
+    process_choices_var = StaticFlag(flags['process_choices'])
+    apply_replacements_var = StaticFlag(flags['apply_replacements'])
+    insert_periods_var = StaticFlag(flags['insert_periods'])
+    remove_pagination_var = StaticFlag(flags['remove_pagination'])
+    convert_roman_var = StaticFlag(flags['convert_roman'])
+    convert_lowercase_var = StaticFlag(flags['convert_lowercase'])
+    process_all_caps_var = StaticFlag(flags['process_all_caps'])
+    remove_blank_lines_var = StaticFlag(flags['remove_blank_lines'])
+    segment_output_var = StaticFlag(flags['segment_output'])
+    detect_chapters_var = StaticFlag(flags['detect_chapters'])
+    verbalize_numbers_var = StaticFlag(flags['verbalize_numbers'])
+    normalize_characters_var = StaticFlag(flags['normalize_characters'])
+    change_report_var = StaticFlag(flags['change_report'])
+    trim_whitespace_var = StaticFlag(flags['trim_whitespace'])
+    plugin_stages_var = StaticFlag(flags['plugin_stages'])
+
+
+def process_text_headless(content, source_path, **steps):
+    """
+    Runs the automatic processing steps on `content` without any GUI and returns the result.
+    `source_path` is only used to tell plain text from HTML/XHTML (which is processed node by node).
+    Rules must already be loaded with load_data_file().
+    """
+    global text, filepath
+    set_step_flags(**steps)
+    text = content
+    filepath = str(source_path)
+    run_processing()
+    return text
+
+
+# --- Background Processing ---
+# run_processing runs on a worker thread so the window keeps repainting during the
+# automatic stages. The worker never touches Tk: status and text updates are posted to
+# ui_queue, which the Tk thread drains every UI_POLL_MS with root.after, and the
+# interactive stages are handed back to the Tk thread with run_on_ui_thread().
+UI_POLL_MS = 50 # How often the Tk thread drains ui_queue
+
+ui_queue = queue.Queue() # Messages from the worker to the Tk thread
+cancel_event = threading.Event() # Set by the Cancel button; checked by the worker between stages
+processing_thread = None # The running worker thread, if any
+cancel_button = None # Shown while processing is running
+run_started_at = None # datetime the current run started (for last_run_seconds)
+
+
+class ProcessingCancelled(Exception):
+    """Raised inside the worker when the user cancels processing."""
+
+
+def on_ui_thread():
+    """True when called on the Tk (main) thread."""
+    return threading.current_thread() is threading.main_thread()
+
+
+def check_cancelled():
+    """
+    Raises ProcessingCancelled if the user pressed Cancel, or StageBudgetExceeded if the
+    running stage is past its deadline. Stages call this at chunk boundaries.
+    """
+    if cancel_event.is_set():
+        raise ProcessingCancelled()
+    if stage_deadline is not None and time.monotonic() > stage_deadline:
+        raise StageBudgetExceeded()
+
+
+def run_on_ui_thread(func, *args):
+    """
+    Runs func(*args) on the Tk thread and blocks until it returns. Called from the
+    worker for the interactive stages; called on the Tk thread it just runs func.
+    """
+    if on_ui_thread():
+        return func(*args)
+    done = threading.Event()
+    result = {}
+    ui_queue.put(('call', (func, args, done, result)))
+    done.wait()
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+
+def poll_ui_queue():
+    """Drains ui_queue on the Tk thread, then reschedules itself."""
+    try:
+        while True:
+            kind, payload = ui_queue.get_nowait()
+            if kind == 'status':
+                status_label.config(text=payload)
+            elif kind == 'text':
+                render_text_view(payload)
+            elif kind == 'call':
+                func, args, done, result = payload
+                try:
+                    result['value'] = func(*args)
+                except Exception as e:
+                    result['error'] = e
+                finally:
+                    done.set()
+            elif kind == 'finished':
+                finish_background_run(payload)
+    except queue.Empty:
+        pass
+    root.after(UI_POLL_MS, poll_ui_queue)
+
+
+def _processing_worker(steps, original_text):
+    """Worker thread body: runs the workflow and reports the outcome to the Tk thread."""
+    global text
+    try:
+        run_processing(steps)
+        ui_queue.put(('finished', 'done'))
+    except ProcessingCancelled:
+        log_message("Processing cancelled by user. Restoring the text from before this run.")
+        text = original_text
+        ui_queue.put(('finished', 'cancelled'))
+    except Exception as e:
+        log_message(f"Error during processing: {e}", level="ERROR")
+        text = original_text
+        ui_queue.put(('finished', e))
+
+
+def start_background_run():
+    """Snapshots the checkboxes on the Tk thread and starts the worker thread."""
+    global processing_thread, run_started_at
+    steps = read_step_flags()
+    cancel_event.clear()
+    run_started_at = datetime.datetime.now()
+    if cancel_button is not None:
+        cancel_button.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+    processing_thread = threading.Thread(target=_processing_worker, args=(steps, text),
+                                         name="bookfix-processing", daemon=True)
+    processing_thread.start()
+
+
+def cancel_processing():
+    """Cancel button command: asks the worker to stop and releases any waiting prompt."""
+    log_message("Cancel requested.")
+    cancel_event.set()
+    update_status_label("Cancelling...")
+    if choice_var is not None: # Release an interactive stage waiting on root.wait_variable
+        choice_var.set(choice_var.get() + 1)
+
+
+def finish_background_run(outcome):
+    """Runs on the Tk thread when the worker ends: restores the buttons and reports the outcome."""
+    global last_run_seconds
+    last_run_seconds = (datetime.datetime.now() - run_started_at).total_seconds()
+    cancel_event.clear() # The Cancel was for this run only
+    if cancel_button is not None:
+        cancel_button.pack_forget()
+    start_processing_button.config(state=tk.NORMAL)
+    log_message("Start Processing button re-enabled.")
+    update_text_area()
+    if outcome == 'cancelled':
+        update_status_label("Processing cancelled. Text restored.")
+    elif isinstance(outcome, Exception):
+        update_status_label("Processing failed. Text restored.")
+        messagebox.showerror("Error", f"Error during processing: {outcome}")
+
+
+# --- Stage Budgets ---
+# Every automatic stage runs under run_stage(), which gives it an optional wall-clock
+# budget. Stages call check_cancelled() at chunk boundaries (every few thousand lines,
+# tokens or rules); past the deadline that raises StageBudgetExceeded, the stage's
+# changes are thrown away, the text from before the stage is kept and the stage is
+# marked in stage_report. One pathological book then cannot hold a batch worker for hours.
+CHECK_EVERY = 4096 # Loop iterations between cancellation/budget checks inside stages
+
+stage_budgets = {} # Stage name (or 'default') -> seconds, from # STAGE_BUDGETS in .data.txt
+stage_deadline = None # time.monotonic() deadline of the running stage, or None
+stage_report = [] # One entry per stage run in the current run_processing
+
+
+class StageBudgetExceeded(Exception):
+    """Raised by check_cancelled() when the running stage is past its time budget."""
+
+
+def stage_budget_for(stage):
+    """Returns the time budget in seconds for `stage`, or None for no limit."""
+    budget = stage_budgets.get(stage, stage_budgets.get('default'))
+    return budget if budget and budget > 0 else None
+
+
+def run_stage(stage, func, returns_text=False):
+    """
+    Runs one automatic stage under its time budget. `func` either updates the global
+    text itself or, with returns_text, takes the text and returns the new text.
+    If the budget runs out the text from before the stage is restored.
+    Returns True if the stage completed.
+    """
+    global text, stage_deadline, change_stage
+    snapshot = text
+    layers_before = len(change_layers)
+    change_stage = stage
+    budget = stage_budget_for(stage)
+    started = time.monotonic()
+    stage_deadline = started + budget if budget else None
+    status = 'ok'
+    try:
+        if profile_modes: # Opt-in profiling; a plain call otherwise
+            result = run_profiled(stage, (lambda: func(text)) if returns_text else func)
+        else:
+            result = func(text) if returns_text else func()
+        if returns_text:
+            text = result
+        if len(change_layers) == layers_before: # Stage did not itemize its edits
+            record_unitemized_change(snapshot, text, stage)
+    except StageBudgetExceeded:
+        text = snapshot
+        del change_layers[layers_before:] # Its recorded edits were rolled back too
+        status = 'skipped_over_budget'
+        log_message(f"Stage '{stage}' exceeded its {budget}s budget; skipped and kept the text from before it.", level="WARNING")
+    finally:
+        stage_deadline = None
+        change_stage = None
+    stage_report.append({'stage': stage, 'status': status, 'seconds': round(time.monotonic() - started, 3)})
+    return status == 'ok'
+
+
+def skipped_stages():
+    """
+    (stage, reason) for each stage of the last run that was skipped: 'over_budget' for a
+    stage that ran past its time budget, 'plugin_error' for a plugin pass that raised.
+    """
+    return [(entry['stage'], entry['status'][len('skipped_'):]) for entry in stage_report if entry['status'] != 'ok']
+
+
+def log_stage_report():
+    """Logs the per-stage timings and outcomes of the last run."""
+    for entry in stage_report:
+        log_message(f"Stage report: {entry['stage']}: {entry['status']} ({entry['seconds']}s)")
+
+
+def apply_lowercase_rules():
+    """Pre-applies the UPPER_TO_LOWER rules to the global text before the interactive all-caps pass."""
+    global text
+    mapping = { word: word.lower() for word in lowercase_set }
+    text = apply_upper_to_lower(text, mapping)
+    log_message(f"Auto‑lowercased {len(mapping)} words from lowercase_set: {mapping.keys()}")
+
+
+# --- Profiling ---
+# Opt-in per-stage profiling for "this book is slow" reports. With --profile cpu|mem|all
+# (or BOOKFIX_PROFILE=cpu|mem|all in the environment) every stage run by run_stage()
+# is wrapped in cProfile and/or tracemalloc, and each run gets its own directory under
+# --profile-dir (BOOKFIX_PROFILE_DIR, default bookfix_profile/) holding
+# <nn>_<stage>.prof (open with pstats or snakeviz), <nn>_<stage>.alloc.txt (the top
+# allocation sites of the stage) and stages.tsv (one line per stage). Watch and scan never
+# enter that directory (is_excluded_watch_dir). When profiling is off run_stage() only
+# tests profile_modes, so normal runs pay nothing for it.
+PROFILE_MODES = ('cpu', 'mem')
+PROFILE_TOP_ALLOCATIONS = 25 # Allocation sites listed per stage
+PROFILE_TRACE_FRAMES = 1 # tracemalloc frames kept per allocation (more is slower)
+
+
+def parse_profile_modes(value):
+    """Turns 'cpu', 'mem', 'all' or 'cpu,mem' into a frozenset of modes; '' or 'off' gives none."""
+    modes = set()
+    for part in (value or '').lower().replace('+', ',').split(','):
+        part = part.strip()
+        if part in ('', '0', 'off', 'none'):
+            continue
+        if part in ('all', 'both', '1', 'on'):
+            modes.update(PROFILE_MODES)
+        elif part in PROFILE_MODES:
+            modes.add(part)
+        else:
+            raise ValueError(f"Unknown profile mode '{part}' (use cpu, mem or all).")
+    return frozenset(modes)
+
+
+# Read from the environment at import, so worker processes of --scan/--watch inherit it
+try:
+    profile_modes = parse_profile_modes(os.environ.get('BOOKFIX_PROFILE'))
+except ValueError as e:
+    print(f"Ignoring BOOKFIX_PROFILE: {e}", file=sys.stderr)
+    profile_modes = frozenset()
+profile_dir = Path(os.environ.get('BOOKFIX_PROFILE_DIR') or 'bookfix_profile')
+profile_run_dir = None # Directory of the current run; created on the first profiled stage
+
+
+def configure_profiling(modes, directory=None):
+    """
+    Sets the profiling modes (and base directory) for this process and exports them to
+    the environment, so worker processes started later profile their books too.
+    """
+    global profile_modes, profile_dir
+    profile_modes = parse_profile_modes(modes) if isinstance(modes, str) else frozenset(modes)
+    os.environ['BOOKFIX_PROFILE'] = ','.join(sorted(profile_modes))
+    if directory:
+        profile_dir = Path(directory).expanduser()
+        os.environ['BOOKFIX_PROFILE_DIR'] = str(profile_dir)
+    if profile_modes:
+        log_message(f"Profiling stages ({', '.join(sorted(profile_modes))}) into {profile_dir}")
+
+
+def _profile_file_name(name):
+    """Makes a book or stage name safe to use in a file name."""
+    return re.sub(r'[^\w.-]+', '_', name)
+
+
+def profile_run_directory():
+    """Returns the profile directory of the current run, creating it on first use."""
+    global profile_run_dir
+    if profile_run_dir is None:
+        stem = _profile_file_name(Path(filepath).stem) if filepath else 'text'
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        profile_run_dir = profile_dir / f"{stamp}_{stem}_{os.getpid()}"
+        profile_run_dir.mkdir(parents=True, exist_ok=True)
+        log_message(f"Writing stage profiles to {profile_run_dir}")
+    return profile_run_dir
+
+
+def run_profiled(stage, call):
+    """
+    Runs call() for `stage` under the enabled profilers and writes that stage's files to
+    the run directory. Returns what call() returns; exceptions pass through after the
+    profile of the partial stage has been written.
+    """
+    import cProfile
+    import tracemalloc
+    directory = profile_run_directory()
+    base = directory / f"{len(stage_report) + 1:02d}_{_profile_file_name(stage)}"
+    profiler = cProfile.Profile() if 'cpu' in profile_modes else None
+    tracing = 'mem' in profile_modes
+    started_tracing = False
+    if tracing:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+            started_tracing = True
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+    started = time.monotonic()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            return call()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    finally:
+        seconds = time.monotonic() - started
+        peak = grown = 0
+        try:
+            if profiler is not None:
+                profiler.dump_stats(str(base) + '.prof')
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                differences = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+                grown = sum(difference.size_diff for difference in differences)
+                if started_tracing:
+                    tracemalloc.stop()
+                with open(str(base) + '.alloc.txt', 'w', encoding='utf-8') as f:
+                    f.write(f"Stage: {stage}\nSeconds: {seconds:.3f}\n"
+                            f"Peak traced: {peak / 1024:.1f} KiB\nNet growth: {grown / 1024:.1f} KiB\n\n"
+                            f"Top {PROFILE_TOP_ALLOCATIONS} allocation sites by growth:\n")
+                    for difference in differences[:PROFILE_TOP_ALLOCATIONS]:
+                        f.write(f"{difference}\n")
+            with open(directory / 'stages.tsv', 'a', encoding='utf-8') as f:
+                f.write(f"{base.name}\t{stage}\t{seconds:.3f}\t{peak // 1024}\t{grown // 1024}\n")
+        except OSError as e: # A full disk must not fail the book
+            log_message(f"Could not write the profile of stage '{stage}': {e}", level="WARNING")
+
+
+# --- Plugin Stages ---
+# House-specific transforms can be added without editing this file. A plugin is a .py
+# file in bookfix_plugins/ (next to .data.txt) or an installed package exposing a
+# "bookfix.stages" entry point; either provides BOOKFIX_STAGES, a list of dicts:
+#     {'name': 'house_ok', 'func': fix_ok, 'locality': 'line', 'after': 'apply_replacements'}
+# `func` maps one unit of text to its new text, where the declared locality says what a
+# unit is: 'token' (one word; must return a string), 'line' (one line without its line
+# break; returns one line, or None to drop it), 'paragraph' (text between blank lines;
+# None drops it) or 'document' (the whole text). `after` names the built-in step the
+# stage runs after (PLUGIN_ANCHORS; it runs whether or not that step is checked), and
+# 'pure': False marks a stage whose output depends on more than its unit.
+# The runtime uses the declarations: consecutive non-document stages at the same anchor
+# are fused into one pass over the coarsest of their units (a token stage inside a line
+# pass runs on the words of each line), token stages are batched so each distinct word
+# is transformed once, and pure passes over big books can be spread over processes
+# (--plugin-workers). iter_plugin_lines() is the same fused chain for streamed lines.
+# Each pass is one stage under run_stage(), so budgets, cancellation and the change
+# report apply; a plugin that raises leaves the text as it was before its pass.
+PLUGIN_DIR_NAME = "bookfix_plugins"
+PLUGIN_ENTRY_POINT_GROUP = "bookfix.stages"
+PLUGIN_LOCALITIES = ('token', 'line', 'paragraph', 'document') # Finest to coarsest
+PLUGIN_ANCHORS = ('normalize_characters', 'apply_replacements', 'line_filters', 'convert_lowercase')
+PLUGIN_PARALLEL_MIN_CHARS = 1 << 20 # Smaller texts are not worth starting worker processes for
+_PARAGRAPH_BREAK_RE = re.compile(r"\n[ \t]*\n")
+
+plugin_stages = [] # Validated stage dicts, in load order (plugin file name, then list order)
+plugin_workers = 1 # Processes for pure plugin passes over big books (1 = in process)
+
+
+class PluginError(Exception):
+    """A plugin stage was declared wrongly or broke its unit contract."""
+
+
+def _register_plugin_stages(declared, source, origin):
+    """Validates the BOOKFIX_STAGES list of one plugin and adds its stages to plugin_stages."""
+    names = {stage['name'] for stage in plugin_stages}
+    for entry in declared or []:
+        stage = {'pure': True}
+        stage.update(entry)
+        stage['source'] = source
+        name = stage.get('name')
+        if not name or name in names:
+            raise PluginError(f"{origin}: stage name {name!r} is missing or already used")
+        if not callable(stage.get('func')):
+            raise PluginError(f"{origin}: stage '{name}' has no callable 'func'")
+        if stage.get('locality') not in PLUGIN_LOCALITIES:
+            raise PluginError(f"{origin}: stage '{name}' locality must be one of {PLUGIN_LOCALITIES}")
+        stage.setdefault('after', PLUGIN_ANCHORS[-1])
+        if stage['after'] not in PLUGIN_ANCHORS:
+            raise PluginError(f"{origin}: stage '{name}' must run after one of {PLUGIN_ANCHORS}")
+        plugin_stages.append(stage)
+        names.add(name)
+
+
+def load_plugins():
+    """(Re)loads the plugin stages from bookfix_plugins/*.py and the bookfix.stages entry points."""
+    global plugin_stages
+    import hashlib
+    import importlib.util
+    plugin_stages = []
+    plugin_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), PLUGIN_DIR_NAME)
+    paths = sorted(Path(plugin_dir).glob("*.py")) if os.path.isdir(plugin_dir) else []
+    for path in paths:
+        if path.name.startswith("_"):
+            continue
+        module_name = f"{PLUGIN_DIR_NAME}.{path.stem}"
+        try:
+            source = path.read_bytes()
+            spec = importlib.util.spec_from_file_location(module_name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module # So worker processes can pickle references to it
+            spec.loader.exec_module(module)
+            _register_plugin_stages(getattr(module, 'BOOKFIX_STAGES', None), hashlib.sha1(source).hexdigest(), path.name)
+        except Exception as e:
+            log_message(f"Error loading plugin '{path}': {e}", level="ERROR")
+    try:
+        from importlib.metadata import entry_points
+        found = entry_points(group=PLUGIN_ENTRY_POINT_GROUP)
+    except Exception: # Very old importlib.metadata without the group= selector
+        found = []
+    for entry_point in found:
+        try:
+            loaded = entry_point.load()
+            declared = getattr(loaded, 'BOOKFIX_STAGES', loaded)
+            version = entry_point.dist.version if getattr(entry_point, 'dist', None) else ''
+            _register_plugin_stages(declared, f"{entry_point.value} {version}".strip(), entry_point.name)
+        except Exception as e:
+            log_message(f"Error loading plugin entry point '{entry_point.name}': {e}", level="ERROR")
+    for stage in plugin_stages:
+        log_message(f"Plugin stage '{stage['name']}' ({stage['locality']}, after {stage['after']}) loaded.")
+
+
+def plugin_fingerprint():
+    """What the library index hashes about the plugins: each stage's declaration and source."""
+    return [(stage['name'], stage['locality'], stage['after'], stage['pure'], stage['source']) for stage in plugin_stages]
+
+
+def plugin_pass_groups(anchor):
+    """
+    Splits the stages that run after `anchor` into passes: each run of consecutive
+    token/line/paragraph stages is one fused pass, each document stage a pass of its own.
+    """
+    groups = []
+    for stage in plugin_stages:
+        if stage['after'] != anchor:
+            continue
+        if groups and stage['locality'] != 'document' and groups[-1][-1]['locality'] != 'document':
+            groups[-1].append(stage)
+        else:
+            groups.append([stage])
+    return groups
+
+
+def _token_function(stage):
+    """A token stage as a function on the words of a longer unit, transforming each distinct word once."""
+    func = stage['func']
+    cache = {} if stage['pure'] else None
+
+    def transform(match):
+        word = match.group(0)
+        if cache is not None and word in cache:
+            return cache[word]
+        result = func(word)
+        if not isinstance(result, str):
+            raise PluginError(f"Token stage '{stage['name']}' returned {type(result).__name__}, not a string")
+        if cache is not None:
+            cache[word] = result
+        return result
+    return lambda unit: _WORD_RE.sub(transform, unit)
+
+
+def _line_function(stage):
+    """A line stage with its contract checked; chapter-heading markers are kept out of its sight."""
+    func = stage['func']
+
+    def transform(line):
+        if line.startswith(SCENE_MARK):
+            return line
+        mark = CHAPTER_MARK if line.startswith(CHAPTER_MARK) else ""
+        result = func(line[len(mark):])
+        if result is None:
+            return None
+        if not isinstance(result, str) or "\n" in result:
+            raise PluginError(f"Line stage '{stage['name']}' must return one line or None")
+        return mark + result
+    return transform
+
+
+def compose_plugin_group(group):
+    """
+    Fuses one pass's stages into a single unit -> new unit (or None to drop it) function.
+    Returns (unit locality, function). Finer stages run on the pieces of each unit.
+    """
+    locality = max((stage['locality'] for stage in group), key=PLUGIN_LOCALITIES.index)
+    steps = []
+    for stage in group:
+        if stage['locality'] == 'token':
+            steps.append(_token_function(stage))
+        elif stage['locality'] == 'line':
+            line_step = _line_function(stage)
+            if locality == 'line':
+                steps.append(line_step)
+            else: # Lines of a paragraph; the paragraph goes if all of them do
+                steps.append(lambda unit, line_step=line_step: "\n".join(
+                    kept for kept in map(line_step, unit.split("\n")) if kept is not None) or None)
+        else:
+            steps.append(stage['func'])
+
+    def apply(unit):
+        for step in steps:
+            unit = step(unit)
+            if unit is None:
+                break
+        return unit
+    return locality, apply
+
+
+def iter_plugin_lines(lines, group):
+    """Streams `lines` through a fused pass of token and line stages, yielding the kept lines."""
+    locality, apply = compose_plugin_group(group)
+    if locality not in ('token', 'line'):
+        raise PluginError("Only token and line stages can be streamed line by line")
+    for n, line in enumerate(lines):
+        if not n % CHECK_EVERY:
+            check_cancelled()
+        line = apply(line)
+        if line is not None:
+            yield line
+
+
+def _plugin_units(text_content, locality):
+    """
+    Yields (start, end, separator end) for each unit of `locality`: a word, a line (its
+    "\\n" is the separator) or a paragraph (the blank lines after it are the separator).
+    """
+    if locality == 'token':
+        for match in fast_regex(_WORD_RE, text_content).finditer(text_content):
+            yield match.start(), match.end(), match.end()
+        return
+    if locality == 'line':
+        pos = 0
+        while True:
+            end = text_content.find("\n", pos)
+            if end == -1:
+                yield pos, len(text_content), len(text_content)
+                return
+            yield pos, end, end + 1
+            pos = end + 1
+    pos = 0
+    for match in _PARAGRAPH_BREAK_RE.finditer(text_content):
+        yield pos, match.start(), match.end()
+        pos = match.end()
+    yield pos, len(text_content), len(text_content)
+
+
+def _plugin_pool_init():
+    """Worker process initializer for parallel plugin passes (spawned workers load the plugins themselves)."""
+    if not plugin_stages:
+        load_plugins()
+
+
+def _plugin_worker(names, units):
+    """Runs the fused pass of the named stages over a batch of units in a worker process."""
+    by_name = {stage['name']: stage for stage in plugin_stages}
+    _, apply = compose_plugin_group([by_name[name] for name in names])
+    return [apply(unit) for unit in units]
+
+
+def _map_plugin_units(group, apply, units):
+    """Applies the fused pass to every unit, in worker processes when that is allowed and worth it."""
+    import multiprocessing
+    parallel = (plugin_workers > 1 and all(stage['pure'] for stage in group)
+                and sum(map(len, units)) >= PLUGIN_PARALLEL_MIN_CHARS
+                and not multiprocessing.current_process().daemon) # Watch/scan workers cannot start their own
+    if not parallel:
+        results = []
+        for n, unit in enumerate(units):
+            if not n % CHECK_EVERY:
+                check_cancelled()
+            results.append(apply(unit))
+        return results
+    from concurrent.futures import ProcessPoolExecutor
+    names = [stage['name'] for stage in group]
+    size = max(1, len(units) // (plugin_workers * 4) + 1)
+    results = []
+    with ProcessPoolExecutor(max_workers=plugin_workers, initializer=_plugin_pool_init) as pool:
+        futures = [pool.submit(_plugin_worker, names, units[i:i + size]) for i in range(0, len(units), size)]
+        try:
+            for future in futures:
+                check_cancelled()
+                results.extend(future.result())
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return results
+
+
+def apply_plugin_group(group):
+    """Runs one plugin pass over the global text, recording each changed unit as an edit."""
+    global text
+    label = "+".join(stage['name'] for stage in group)
+    if group[0]['locality'] == 'document':
+        result = group[0]['func'](text)
+        if not isinstance(result, str):
+            raise PluginError(f"Document stage '{label}' returned {type(result).__name__}, not a string")
+        # Itemized, so HTML text nodes keep their own text and the report shows real edits
+        text = splice_edits(text, diff_edits(text, result), rule=f"PLUGIN:{label}") if change_log_enabled else result
+        return
+    locality, apply = compose_plugin_group(group)
+    spans = list(_plugin_units(text, locality))
+    results = _map_plugin_units(group, apply, [text[start:end] for start, end, _ in spans])
+    edits = []
+    last_kept = None # (end, separator end) of the last kept unit
+    trailing_drop = False
+    for (start, end, sep_end), result in zip(spans, results):
+        if result is None:
+            if locality == 'token':
+                raise PluginError(f"Token stage in '{label}' returned None")
+            edits.append((start, sep_end, "")) # The unit goes with the separator after it
+            trailing_drop = True
+        else:
+            if result != text[start:end]:
+                edits.append((start, end, result))
+            last_kept = (end, sep_end)
+            trailing_drop = False
+    if trailing_drop and last_kept and last_kept[1] > last_kept[0]:
+        edits.append((last_kept[0], last_kept[1], "")) # Nothing follows the last kept unit any more
+    if edits:
+        text = splice_edits(text, edits, rule=f"PLUGIN:{label}")
+    log_message(f"Plugin pass '{label}' ({locality}): {len(edits)} edit(s) over {len(spans)} unit(s).")
+
+
+def run_plugin_stages(anchor, steps):
+    """Runs the plugin passes declared to follow `anchor`, each as its own stage."""
+    if not steps.get('plugin_stages') or not plugin_stages:
+        return
+    for group in plugin_pass_groups(anchor):
+        check_cancelled()
+        label = "+".join(stage['name'] for stage in group)
+        failed = []
+
+        def plugin_pass(group=group, label=label):
+            try:
+                apply_plugin_group(group)
+            except (ProcessingCancelled, StageBudgetExceeded):
+                raise
+            except Exception as e: # The text is only assigned once a pass has finished
+                log_message(f"Plugin pass '{label}' failed and was skipped: {e}", level="ERROR")
+                failed.append(e)
+
+        update_status_label(f"Running plugin stage {label}...")
+        if run_stage(f"plugin:{label}", plugin_pass) and failed:
+            stage_report[-1]['status'] = 'skipped_plugin_error' # Reported apart from the over-budget stages
+        update_text_area()
+
+
+# --- Dry Run ---
+# Estimates what the enabled steps would do to a book without producing any new text:
+# hits per REPLACE, PERIODS, UPPER_TO_LOWER and CHOICE rule, Roman numeral conversions
+# and all-caps sequences. The word-level rules are all answered from one count of the
+# token table's ids (a single scan of the token stream). REPLACE rules are the exception:
+# they match substrings and are applied one after another with str.replace, so each is
+# counted with its own str.count pass. That gives exactly the per-rule counts, where one
+# combined alternation regex would let overlapping keys hide each other, and R C-level
+# passes are faster in CPython than a Python-level Aho-Corasick scan. Normalization and
+# tokenizing the (sampled) text are rerun for the estimate.
+# Counts are taken on the input, so a rule creating or removing another rule's matches
+# is not modelled. A sample (first N KB or N random paragraphs) gives instant feedback.
+# The GUI runs it on the Tk thread, so it never checks the processing run's Cancel or
+# stage budget (see check_cancelled).
+DRY_RUN_RUNAWAY_SHARE = 0.005 # A rule hitting more than this share of the book's words is flagged
+
+
+def sample_text(text_content, sample_kb=None, sample_paragraphs=None, seed=None):
+    """
+    Returns the part of `text_content` a sampled dry run looks at: the first `sample_kb`
+    KB (extended to the end of its line) or `sample_paragraphs` random paragraphs, kept
+    in book order. Without either the whole text is returned.
+    """
+    import random
+    if sample_kb:
+        cut = sample_kb * 1024
+        if cut >= len(text_content):
+            return text_content
+        line_end = text_content.find("\n", cut)
+        return text_content[:line_end if line_end != -1 else len(text_content)]
+    if sample_paragraphs:
+        paragraphs = re.split(r"\n[ \t]*\n", text_content)
+        if sample_paragraphs >= len(paragraphs):
+            return text_content
+        picked = sorted(random.Random(seed).sample(range(len(paragraphs)), sample_paragraphs))
+        return "\n\n".join(paragraphs[i] for i in picked)
+    return text_content
+
+
+def estimate_rule_hits(text_content, steps=None):
+    """
+    Counts the hits of every rule of the enabled steps (all steps if `steps` is None) in
+    `text_content`. Returns {'chars', 'words', 'REPLACE', 'PERIODS', 'UPPER_TO_LOWER',
+    'CHOICE', 'ROMAN', 'CAPS'}, where each rule category maps rule -> hits.
+    """
+    from collections import Counter
+    enabled = lambda step: steps is None or steps.get(step)
+    if enabled('normalize_characters') and normalization_table:
+        text_content = text_content.translate(normalization_table) # Rules are written for the normalized spelling
+    # Reuse the cached table if it is for this very text, but do not replace it with the sample's
+    table = (_token_table if _token_table is not None and _token_table.text is text_content
+             else TokenTable(text_content, cancellable=False))
+    token_counts = Counter(table.ids) # The single counting scan over the token stream
+    folded_counts = Counter()
+    for token_id, token in enumerate(table.words):
+        folded_counts[token.lower()] += token_counts[token_id]
+
+    def word_hits(word, ignore_case=False):
+        if not _WORD_RE.fullmatch(word): # Phrases fall back to a regex, as in replace_words()
+            pattern = re.compile(r'\b' + re.escape(word) + r'\b', re.IGNORECASE if ignore_case else 0)
+            return sum(1 for _ in fast_regex(pattern, text_content).finditer(text_content))
+        if ignore_case:
+            return folded_counts[word.lower()]
+        token_id = table.vocab.get(word)
+        return token_counts[token_id] if token_id is not None else 0
+
+    estimate = {'chars': len(text_content), 'words': len(table)}
+    estimate['REPLACE'] = {old: text_content.count(old) for old in replacements if old} if enabled('apply_replacements') else {}
+    estimate['PERIODS'] = {abbr: word_hits(abbr) for abbr in periods} if enabled('insert_periods') else {}
+    estimate['CHOICE'] = {word: word_hits(word, ignore_case=True) for word in choices} if enabled('process_choices') else {}
+    estimate['UPPER_TO_LOWER'] = {word: word_hits(word) for word in lowercase_set} if enabled('process_all_caps') else {}
+    roman = {}
+    if enabled('convert_roman'):
+        for token_id, token in enumerate(table.words):
+            if not _ROMAN_TOKEN_RE.fullmatch(token) or not roman_to_arabic(token):
+                continue
+            hits = 0
+            for i in table.postings(token_id):
+                start, end = table.span(i)
+                if not ((start > 0 and text_content[start - 1] == "'") or text_content[end:end + 1] == "'"):
+                    hits += 1
+            if hits:
+                roman[token] = hits
+    estimate['ROMAN'] = roman
+    caps = Counter()
+    if enabled('process_all_caps'):
+        # The UPPER_TO_LOWER rules run first, so their words never reach the caps questions
+        caps.update(m.group(0) for m in table.all_caps_sequences(skip=lowercase_set)
+                    if m.group(0) not in ignore_set and m.group(0) not in lowercase_set)
+    estimate['CAPS'] = dict(caps)
+    return estimate
+
+
+def format_dry_run_report(estimate, scale=1.0):
+    """
+    Formats an estimate_rule_hits() result as text, busiest rules first. With a sample,
+    `scale` (book size / sample size) projects the counts to the whole book.
+    """
+    projected = lambda hits: f"{hits}" if scale == 1.0 else f"{hits} (~{round(hits * scale)} in the book)"
+    lines = [f"Dry run over {estimate['chars']} characters, {estimate['words']} words"
+             + ("" if scale == 1.0 else f" (a 1/{scale:.1f} sample)") + "."]
+    runaway_at = max(1, estimate['words'] * DRY_RUN_RUNAWAY_SHARE)
+    for category in ('REPLACE', 'PERIODS', 'UPPER_TO_LOWER', 'CHOICE', 'ROMAN', 'CAPS'):
+        hits = estimate[category]
+        if not hits:
+            continue
+        firing = sorted(((n, rule) for rule, n in hits.items() if n), key=lambda item: -item[0])
+        lines.append("")
+        if category in ('ROMAN', 'CAPS'):
+            noun = "numeral(s)" if category == 'ROMAN' else "sequence(s), each asked about once unless ignored"
+            lines.append(f"{category}: {sum(n for n, _ in firing)} hit(s) of {len(firing)} distinct {noun}")
+        else:
+            lines.append(f"{category}: {sum(n for n, _ in firing)} hit(s) from {len(firing)} of {len(hits)} rule(s)")
+        if category == 'PERIODS':
+            lines.append("  (Insert Periods is currently disabled in run_processing, so these are not applied)")
+        for n, rule in firing:
+            flag = "  <-- runaway?" if category == 'REPLACE' and n >= runaway_at else ""
+            lines.append(f"  {projected(n):>12}  {rule!r}{flag}")
+    return "\n".join(lines) + "\n"
+
+
+def dry_run(content, steps=None, sample_kb=None, sample_paragraphs=None, seed=None):
+    """Runs a (optionally sampled) dry run over `content` and returns the formatted report."""
+    started = time.monotonic()
+    sample = sample_text(content, sample_kb, sample_paragraphs, seed)
+    scale = len(content) / len(sample) if sample and len(sample) < len(content) else 1.0
+    report = format_dry_run_report(estimate_rule_hits(sample, steps), scale)
+    log_message(f"Dry run over {len(sample)} of {len(content)} characters took {time.monotonic() - started:.2f}s.")
+    return report
+
+
+def dry_run_button_command():
+    """Shows the dry-run estimate for the loaded book and the ticked steps in a window."""
+    try:
+        report = dry_run(HtmlDocument(text).text if is_html_path(filepath) else text, read_step_flags())
+    except Exception as e:
+        log_message(f"Error during dry run: {e}", level="ERROR")
+        messagebox.showerror("Error", f"Error during dry run: {e}")
+        return
+    window = tk.Toplevel(root)
+    window.title("Dry Run")
+    report_area = tk.Text(window, wrap=tk.NONE, width=90, height=30)
+    scrollbar = tk.Scrollbar(window, command=report_area.yview)
+    report_area.config(yscrollcommand=scrollbar.set)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    report_area.pack(fill=tk.BOTH, expand=True)
+    report_area.insert(tk.END, report)
+    report_area.config(state=tk.DISABLED)
+
+
+# --- Rule Analytics ---
+# Every run counts the hits of each data-file rule (REPLACE, PERIODS, UPPER_TO_LOWER,
+# CHOICE) while applying it, and the counts are stored per book in the library index,
+# so the statistics for the whole library are one GROUP BY away. --rule-report combines
+# them with a static check of .data.txt: dead rules (no hit in any book where their step
+# ran), shadowed REPLACE rules (an earlier rule always rewrites their match first) and
+# conflicting rules (duplicate keys, or a sequence both ignored and auto-lowercased).
+# --prune-rules also writes .data.pruned.txt with those lines commented out and each
+# duplicate collapsed onto the line that is loaded, leaving .data.txt itself untouched.
+ANALYTICS_CATEGORIES = ('REPLACE', 'PERIODS', 'UPPER_TO_LOWER', 'CHOICE') # Sections whose hits are counted
+ANALYTICS_SECTIONS = {REPLACE_SECTION_MARKER: 'REPLACE', PERIODS_SECTION_MARKER: 'PERIODS',
+                      LOWERCASE_SECTION_MARKER: 'UPPER_TO_LOWER', CHOICE_SECTION_MARKER: 'CHOICE',
+                      IGNORE_SECTION_MARKER: 'CAP_IGNORE'}
+PRUNE_MIN_BOOKS = 10 # A rule is only pruned as dead once its step has run on this many books
+PRUNED_DATA_FILE_NAME = ".data.pruned.txt" # Written next to .data.txt by --prune-rules
+RULE_REPORT_TOP = 20 # Busiest rules listed in the report
+
+rule_hits = {} # Category -> {rule: hits} for the current run; a category is present once its step ran
+
+
+def count_rule_hits(category, hits):
+    """Adds {rule: hits} for one category to the counts of the current run."""
+    counts = rule_hits.setdefault(category, {})
+    for rule, n in hits.items():
+        counts[rule] = counts.get(rule, 0) + n
+
+
+def read_rule_lines():
+    """
+    Parses the rule sections of .data.txt the way load_data_file() does, but keeps every
+    line. Returns (lines of the file, [(line number, category, key, target)]).
+    """
+    data_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), DATA_FILE_NAME)
+    with open(data_file_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    rules = []
+    category = None
+    for number, line in enumerate(lines, 1):
+        stripped_line = line.strip().lstrip('\ufeff\u200b\u00A0')
+        if stripped_line in ALL_SECTION_MARKERS:
+            category = ANALYTICS_SECTIONS.get(stripped_line)
+            continue
+        if not category or not stripped_line or stripped_line.startswith('#'):
+            continue
+        if category in ('REPLACE', 'CHOICE'):
+            parts = stripped_line.split('->')
+            if len(parts) == 2:
+                rules.append((number, category, parts[0].strip(), parts[1].strip()))
+        else:
+            rules.append((number, category, stripped_line, None))
+    return lines, rules
+
+
+def find_rule_problems(rules):
+    """
+    Static checks of the rule lines from read_rule_lines(). Returns a list of problem dicts
+    with kind ('conflict', 'duplicate', 'shadowed' or 'ignored_and_lowered'), category,
+    rule, line, detail and, for the pruned file, 'drop' (comment the line out) or
+    'rewrite' (the line that is loaded, with the target that wins).
+    """
+    problems = []
+    first_line = {} # (category, key) -> (line, target) of the first definition
+    last_target = {} # (category, key) -> target of the last definition (the one a dict keeps)
+    for number, category, key, target in rules:
+        first_line.setdefault((category, key), (number, target))
+        last_target[(category, key)] = target
+    for number, category, key, target in rules:
+        first, first_target = first_line[(category, key)]
+        if number == first:
+            continue
+        if target == first_target:
+            problems.append({'kind': 'duplicate', 'category': category, 'rule': key, 'line': number,
+                             'detail': f"same as line {first}", 'drop': True})
+        else:
+            problems.append({'kind': 'conflict', 'category': category, 'rule': key, 'line': number,
+                             'detail': f"line {first} says {first_target!r}, this line {target!r}; "
+                                       f"{last_target[(category, key)]!r} is used, in line {first}'s place",
+                             'drop': True})
+    for (category, key), (number, target) in first_line.items():
+        if last_target[(category, key)] != target:
+            problems.append({'kind': 'conflict', 'category': category, 'rule': key, 'line': number,
+                             'detail': "loaded here with the last duplicate's target",
+                             'rewrite': f"{key} -> {last_target[(category, key)]}\n"})
+
+    # REPLACE rules run in load order; a later rule whose key contains an earlier key is
+    # never matched once the earlier rule has rewritten that part of it
+    replace_order = [(number, key, last_target[('REPLACE', key)])
+                     for (category, key), (number, _) in first_line.items() if category == 'REPLACE']
+    for k, (number, key, target) in enumerate(replace_order):
+        if k and not k % CHECK_EVERY:
+            check_cancelled()
+        for earlier_number, earlier_key, earlier_target in replace_order[:k]:
+            if earlier_key and earlier_key in key and key not in key.replace(earlier_key, earlier_target):
+                problems.append({'kind': 'shadowed', 'category': 'REPLACE', 'rule': key, 'line': number,
+                                 'detail': f"line {earlier_number} ({earlier_key!r} -> {earlier_target!r}) rewrites it first",
+                                 'drop': True})
+                break
+
+    # UPPER_TO_LOWER runs before the all-caps questions, so an ignored sequence it lowercases never comes up
+    lowered = {key for (category, key) in first_line if category == 'UPPER_TO_LOWER'}
+    for (category, key), (number, _) in first_line.items():
+        if category == 'CAP_IGNORE' and key in lowered:
+            problems.append({'kind': 'ignored_and_lowered', 'category': category, 'rule': key, 'line': number,
+                             'detail': "also in UPPER_TO_LOWER, which lowercases it first", 'drop': True})
+    return sorted(problems, key=lambda problem: problem['line'])
+
+
+def load_rule_statistics(conn):
+    """
+    Aggregates the per-book rule hits in the library index.
+    Returns ({category: books where its step ran}, {(category, rule): (hits, books with a hit)}).
+    """
+    books = {}
+    for row in conn.execute("SELECT rule_categories FROM books WHERE rule_categories != ''"):
+        for category in row['rule_categories'].split(','):
+            books[category] = books.get(category, 0) + 1
+    totals = {(row['category'], row['rule']): (row['hits'], row['books']) for row in conn.execute(
+        "SELECT category, rule, SUM(hits) AS hits, COUNT(*) AS books FROM rule_hits GROUP BY category, rule")}
+    return books, totals
+
+
+def build_rule_report(prune=False):
+    """
+    Builds the rule analytics report from the library index and .data.txt. With `prune`,
+    also writes .data.pruned.txt. Returns the report text.
+    """
+    lines, rules = read_rule_lines()
+    problems = find_rule_problems(rules)
+    conn = open_library_index()
+    try:
+        books, totals = load_rule_statistics(conn)
+    finally:
+        conn.close()
+
+    dead = []
+    seen = set()
+    for number, category, key, target in rules:
+        if category not in ANALYTICS_CATEGORIES or (category, key) in seen or not books.get(category):
+            continue
+        seen.add((category, key))
+        if (category, key) not in totals or not totals[(category, key)][0]:
+            dead.append({'kind': 'dead', 'category': category, 'rule': key, 'line': number,
+                         'detail': f"no hit in {books[category]} book(s)",
+                         'drop': books[category] >= PRUNE_MIN_BOOKS})
+
+    counted = ", ".join(f"{category} in {books.get(category, 0)}" for category in ANALYTICS_CATEGORIES)
+    report = [f"Rule analytics from the library index (books counted: {counted})."]
+    titles = {'conflict': "Conflicting rules (same key, different targets)",
+              'duplicate': "Duplicate rules (same key and target)",
+              'shadowed': "Shadowed REPLACE rules (never match)",
+              'ignored_and_lowered': "CAP_IGNORE entries that are also auto-lowercased",
+              'dead': f"Dead rules (pruned once their step has run on {PRUNE_MIN_BOOKS} books)"}
+    for kind, title in titles.items():
+        found = [problem for problem in problems + dead if problem['kind'] == kind]
+        if found:
+            report.append("")
+            report.append(f"{title}: {len(found)}")
+            report.extend(f"  line {p['line']}: {p['category']} {p['rule']!r}: {p['detail']}" for p in found)
+    busiest = sorted(totals.items(), key=lambda item: -item[1][0])[:RULE_REPORT_TOP]
+    if busiest:
+        report.append("")
+        report.append("Busiest rules:")
+        report.extend(f"  {hits:>10} hit(s) in {n} book(s)  {category} {rule!r}" for (category, rule), (hits, n) in busiest)
+
+    if prune:
+        changes = {}
+        for problem in problems + dead:
+            if problem.get('rewrite'):
+                changes[problem['line']] = problem['rewrite']
+            elif problem.get('drop'):
+                changes[problem['line']] = f"# pruned ({problem['kind']}): {lines[problem['line'] - 1].strip()}\n"
+        pruned_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), PRUNED_DATA_FILE_NAME)
+        with open(pruned_path, 'w', encoding='utf-8') as f:
+            f.writelines(changes.get(number, line) for number, line in enumerate(lines, 1))
+        report.append("")
+        report.append(f"Wrote {pruned_path} ({len(changes)} line(s) changed); review it and rename it to {DATA_FILE_NAME} to use it.")
+    log_message(f"Rule report: {len(problems)} static problem(s), {len(dead)} dead rule(s).")
+    return "\n".join(report) + "\n"
+
+
+# --- Series Session ---
+# Interactive questions for a series of books are asked once. Every book is run up to
+# the interactive stages, the undecided all-caps sequences and CHOICE contexts of all
+# the books are merged into one deduplicated queue, and after the operator has answered
+# it each book is processed headlessly with the answers applied in one batch pass.
+SERIES_CONTEXT_CHARS = 80 # Characters searched/shown on each side of an occurrence
+SERIES_PREPASS_STEPS = ('normalize_characters', 'apply_replacements', 'insert_periods', 'remove_pagination', 'plugin_stages') # Stages before the interactive ones
+SERIES_CAPS_OPTIONS = [('y', "Yes (y)"), ('n', "No (n)"), ('a', "Add to Ignore (a)"), ('i', "Auto Lowercase (i)")]
+
+series_decisions = None # {'choice': {context key: option}, 'caps': {sequence: 'y'/'n'}} while a session writes its books
+
+
+def series_context_key(text_content, start, end):
+    """
+    (word, previous word, next word), lower-cased. CHOICE occurrences with the same key
+    (e.g. "the lead singer" in three books) are asked about once.
+    """
+    before = _WORD_RE.findall(text_content, max(0, start - SERIES_CONTEXT_CHARS), start)
+    after = _WORD_RE.search(text_content, end, end + SERIES_CONTEXT_CHARS)
+    return (text_content[start:end].lower(), before[-1].lower() if before else '', after.group(0).lower() if after else '')
+
+
+def splice_edits(text_content, edits, rule='EDIT'):
+    """Applies (start, end, replacement) edits in one pass; overlapping edits after the first are dropped."""
+    pieces = []
+    applied = []
+    pos = 0
+    for start, end, replacement in sorted(edits):
+        if start < pos:
+            continue
+        pieces.append(text_content[pos:start])
+        pieces.append(replacement)
+        applied.append((start, end, text_content[start:end], replacement, rule))
+        pos = end
+    pieces.append(text_content[pos:])
+    record_changes(applied)
+    return "".join(pieces)
+
+
+def build_series_queue(books, steps):
+    """
+    Runs each book up to the interactive stages (storing the result in book['text']) and
+    returns the merged question queue: CHOICE contexts first, then all-caps sequences,
+    each with every (book number, start, end) occurrence across the series.
+    """
+    prepass = {step: step in SERIES_PREPASS_STEPS and steps.get(step, False) for step in HEADLESS_STEP_DEFAULTS}
+    questions = {}
+    for book_no, book in enumerate(books):
+        check_cancelled()
+        book_text = process_text_headless(book['content'], book['path'], **prepass)
+        if is_html_path(book['path']): # Questions are about the text nodes, as run_processing sees them
+            book_text = HtmlDocument(book_text).text
+        if steps.get('process_all_caps') and lowercase_set: # Same pre-apply as run_processing
+            book_text = replace_words(book_text, {w: w.lower() for w in lowercase_set})
+        book['text'] = book_text
+        found = []
+        if steps.get('process_choices'):
+            for word, options in choices.items():
+                for m in find_word_matches(book_text, word):
+                    found.append(('choice', series_context_key(book_text, m.start(), m.end()), word, options, m))
+        if steps.get('process_all_caps'):
+            for m in get_token_table(book_text).all_caps_sequences():
+                if m.group(0) not in ignore_set:
+                    found.append(('caps', m.group(0), m.group(0), SERIES_CAPS_OPTIONS, m))
+        for kind, key, word, options, m in found:
+            item = questions.setdefault((kind, key), {
+                'kind': kind, 'key': key, 'word': word, 'options': options, 'occurrences': [],
+                'sample': (book['path'], book_text, m.start(), m.end()), # Shown when asking
+            })
+            item['occurrences'].append((book_no, m.start(), m.end()))
+    return sorted(questions.values(), key=lambda item: item['kind'] != 'choice')
+
+
+def record_series_answer(item, answer, decisions):
+    """Stores one answer; all-caps 'a' and 'i' are also saved to .data.txt like handle_caps_choice."""
+    if item['kind'] == 'choice':
+        decisions['choice'][item['key']] = answer
+        return
+    seq = item['key']
+    if answer == 'a':
+        ignore_set.add(seq)
+        save_caps_data_file(ignore_set, lowercase_set)
+    elif answer == 'i':
+        lowercase_set.add(seq) # The pre-apply lowercases it in this run and every later one
+        save_caps_data_file(ignore_set, lowercase_set)
+    else:
+        decisions['caps'][seq] = answer
+
+
+def apply_series_choice_decisions():
+    """Replaces process_choices in a series run: applies the shared CHOICE answers in one splice."""
+    global text
+    answers = series_decisions['choice']
+    edits = []
+    for word in choices:
+        found = find_word_matches(text, word)
+        count_rule_hits('CHOICE', {word: len(found)})
+        for m in found:
+            option = answers.get(series_context_key(text, m.start(), m.end()))
+            if option is not None:
+                edits.append((m.start(), m.end(), option))
+    text = splice_edits(text, edits, rule='SERIES_CHOICE')
+    log_message(f"Applied {len(edits)} series CHOICE replacement(s).")
+
+
+def apply_series_caps_decisions():
+    """Replaces the interactive all-caps pass in a series run: lowercases every sequence answered 'y'."""
+    global text
+    mapping = {seq: seq.lower() for seq, answer in series_decisions['caps'].items() if answer == 'y'}
+    if mapping:
+        text = replace_words(text, mapping, rule='SERIES_CAPS')
+    log_message(f"Lowercased {len(mapping)} series all-caps sequence(s).")
+
+
+def run_series_session(paths, steps, ask):
+    """
+    Processes a series of books with one shared set of interactive answers.
+    ask(item, number, total) returns the answer for a queue item (a CHOICE option, or
+    'y'/'n'/'a'/'i' for all-caps), or None to leave it. Writes <stem>_output.txt next to
+    every book and returns the output paths. The loaded book and checkboxes are untouched.
+    """
+    global series_decisions
+    saved = {name: globals()[name] for name in
+             [step + '_var' for step in HEADLESS_STEP_DEFAULTS] + ['text', 'filepath', 'segment_chunks', 'chapters', 'scene_breaks']}
+    try:
+        books = []
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                books.append({'path': str(path), 'content': f.read()})
+        update_status_label(f"Series session: reading {len(books)} book(s)...")
+        questions = build_series_queue(books, steps)
+        occurrences = sum(len(item['occurrences']) for item in questions)
+        log_message(f"Series session: {len(books)} book(s), {len(questions)} question(s) covering {occurrences} occurrence(s).")
+
+        decisions = {'choice': {}, 'caps': {}}
+        for number, item in enumerate(questions, 1):
+            check_cancelled()
+            answer = ask(item, number, len(questions))
+            check_cancelled()
+            if answer is not None:
+                record_series_answer(item, answer, decisions)
+
+        outputs = []
+        series_decisions = decisions
+        for book in books:
+            check_cancelled()
+            update_status_label(f"Series session: writing {Path(book['path']).name}...")
+            started = time.perf_counter()
+            result = process_text_headless(book['content'], book['path'], **steps)
+            out_path = output_path_for(book['path'])
+            with open(out_path, 'w', encoding='utf-8') as f:
+                f.write(result)
+            if segment_chunks:
+                write_segments(result, segment_chunks, out_path, chapters=chapters)
+            if chapters:
+                write_chapters(result, chapters, out_path, scene_breaks)
+            if change_report_wanted:
+                write_change_report(out_path)
+            record_gui_output(str(out_path), book['path'], time.perf_counter() - started)
+            outputs.append(out_path)
+        log_message(f"Series session finished: wrote {len(outputs)} book(s).")
+        return outputs
+    finally:
+        series_decisions = None
+        globals().update(saved)
+
+
+def ask_series_question(item, number, total):
+    """
+    Tk-thread prompt for one series question: shows the first occurrence in the text
+    area with buttons for the options and waits for a click. Returns the answer, or
+    None if the session was cancelled or the question skipped.
+    """
+    path, sample_text, start, end = item['sample']
+    books = len({book_no for book_no, _, _ in item['occurrences']})
+    show_span("highlight", start, end, content=sample_text, background="lightblue", foreground="black")
+    status_label.config(text=f"Series question {number}/{total}: '{item['word']}' - "
+                             f"{len(item['occurrences'])} occurrence(s) in {books} book(s) (shown: {Path(path).name})")
+    for widget in choice_frame.winfo_children():
+        widget.destroy()
+    answer = {}
+    def choose(value):
+        answer['value'] = value
+        choice_var.set(choice_var.get() + 1)
+    if item['kind'] == 'choice':
+        buttons = [(option, option) for option in item['options']] + [(None, "Skip")]
+    else:
+        buttons = SERIES_CAPS_OPTIONS
+    for i, (value, label) in enumerate(buttons):
+        tk.Button(choice_frame, text=label, command=lambda v=value: choose(v)).pack(side=tk.LEFT, padx=5)
+        if i < 9:
+            root.bind(str(i + 1), lambda event, v=value: choose(v))
+    choice_var.set(0)
+    root.wait_variable(choice_var)
+    for i in range(1, 10):
+        root.unbind(str(i))
+    for widget in choice_frame.winfo_children():
+        widget.destroy()
+    text_area.tag_remove("highlight", "1.0", tk.END)
+    return None if cancel_event.is_set() else answer.get('value')
+
+
+def ask_series_question_on_console(item, number, total):
+    """Command-line prompt for one series question (used by --series)."""
+    path, sample_text, start, end = item['sample']
+    context = sample_text[max(0, start - SERIES_CONTEXT_CHARS):end + SERIES_CONTEXT_CHARS].replace("\n", " ")
+    print(f"\n[{number}/{total}] '{item['word']}' - {len(item['occurrences'])} occurrence(s), e.g. in {Path(path).name}:")
+    print(f"    ...{context}...")
+    values = [value for value, _ in SERIES_CAPS_OPTIONS] if item['kind'] == 'caps' else list(item['options'])
+    for i, value in enumerate(values, 1):
+        print(f"  {i}) {value}" if item['kind'] == 'choice' else f"  {i}) {dict(SERIES_CAPS_OPTIONS)[value]}")
+    reply = input("Choice (Enter to skip): ").strip()
+    if reply.isdigit() and 1 <= int(reply) <= len(values):
+        return values[int(reply) - 1]
+    return None
+
+
+def _series_worker(paths, steps):
+    """Worker thread body for a GUI series session."""
+    try:
+        outputs = run_series_session(paths, steps,
+                                     lambda item, number, total: run_on_ui_thread(ask_series_question, item, number, total))
+        update_status_label(f"Series session finished: wrote {len(outputs)} book(s).")
+        ui_queue.put(('finished', 'done'))
+    except ProcessingCancelled:
+        log_message("Series session cancelled by user.")
+        ui_queue.put(('finished', 'cancelled'))
+    except Exception as e:
+        log_message(f"Error during series session: {e}", level="ERROR")
+        ui_queue.put(('finished', e))
+
+
+def series_session_button_command():
+    """'Series Session...' button: picks several books and starts a shared interactive session."""
+    global processing_thread, run_started_at
+    initial_dir = default_file_directory if default_file_directory and default_file_directory.is_dir() else Path.home()
+    paths = filedialog.askopenfilenames(title="Select the books of the series", initialdir=str(initial_dir),
+                                        filetypes=[("Text files", "*.txt"), ("HTML files", "*.html *.xhtml"), ("All files", "*.*")])
+    if not paths:
+        return
+    log_message(f"Series session started for {len(paths)} book(s).")
+    start_processing_button.config(state=tk.DISABLED)
+    cancel_event.clear()
+    run_started_at = datetime.datetime.now()
+    if cancel_button is not None:
+        cancel_button.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+    processing_thread = threading.Thread(target=_series_worker, args=(list(paths), read_step_flags()),
+                                         name="bookfix-series", daemon=True)
+    processing_thread.start()
+
+
 # --- Main Processing Workflow ---
-def run_processing():
+def read_step_flags():
+    """Reads every processing-step checkbox (BooleanVar or StaticFlag) into a plain dict."""
+    flags = {}
+    for step in HEADLESS_STEP_DEFAULTS:
+        var = globals()[step + '_var']
+        flags[step] = bool(var.get()) if var is not None else False
+    return flags
+
+
+def run_processing(steps=None):
     """
     Manages the main text processing workflow based on checkbox states.
     Assumes file and data are already loaded into global variables.
     Performs interactive choices, applies automatic replacements,
     removes pagination, converts roman numerals, converts to lowercase,
     processes all-caps sequences, updates the GUI, and displays the save button.
+    `steps` is a snapshot from read_step_flags(); the background worker passes one
+    because Tk variables must only be read on the Tk thread.
     """
     global text, choices, replacements, periods, \
            process_choices_var, apply_replacements_var, insert_periods_var, \
            remove_pagination_var, convert_roman_var, convert_lowercase_var, \
            process_all_caps_var, ignore_set, lowercase_set, \
-           lowercased_original_spans, decided_sequences_text # Declare necessary globals
+           lowercased_original_spans, decided_sequences_text, segment_chunks, \
+           chapters, scene_breaks, change_stage, html_document, profile_run_dir # Declare necessary globals
 
     log_message("Starting run_processing (dispatch section).")
+    steps = steps if steps is not None else read_step_flags()
+    stage_report.clear()
+    rule_hits.clear()
+    profile_run_dir = None # Each run profiles into a directory of its own
+    # HTML is parsed once here; every stage below sees only the text of its text nodes
+    html_document = None
+    if is_html_path(filepath):
+        begin_html_document()
+    begin_change_log(steps['change_report'], track=html_document is not None)
+    if html_document is not None:
+        html_document.layer_base = len(change_layers)
 
     # Initialize sets for tracking decisions within this run at the start of processing
     # These need to be re-initialized each time processing starts
@@ -1225,21 +4786,49 @@ def run_processing():
     # --- Processing Steps (Conditional based on Checkboxes) ---
     # Ordered according to the checkboxes in the GUI
 
+    # 0a. Normalize Characters (first, so every later stage and rule sees plain characters)
+    check_cancelled()
+    if steps['normalize_characters']:
+        log_message("Checkbox 'Normalize Characters' is checked. Executing normalize_characters().")
+        update_status_label("Normalizing characters...")
+        run_stage('normalize_characters', normalize_characters)
+        update_text_area()
+        log_message("normalize_characters() finished.")
+    else:
+        log_message("Checkbox 'Normalize Characters' is NOT checked. Skipping normalize_characters().")
+    run_plugin_stages('normalize_characters', steps)
+
+    # 0b. Detect Chapters (must see the original headings before any rule rewrites them)
+    run_chapter_detection = steps['detect_chapters'] and not is_html_path(filepath)
+    chapters = []
+    scene_breaks = []
+    check_cancelled()
+    if run_chapter_detection:
+        log_message("Checkbox 'Detect Chapters' is checked. Executing mark_chapter_headings().")
+        update_status_label("Detecting chapters...")
+        # If the stage runs over budget its markers are rolled back, so there is nothing to collect
+        run_chapter_detection = run_stage('detect_chapters', mark_chapter_headings)
+        log_message("mark_chapter_headings() finished.")
+    else:
+        log_message("Chapter detection is off (or the input is HTML). Skipping mark_chapter_headings().")
 
 
     # 2. Apply Automatic Replacements (Original Bookfix)
-    if apply_replacements_var.get():
+    check_cancelled()
+    if steps['apply_replacements']:
         log_message("Checkbox 'Apply Automatic Replacements' is checked. Executing apply_automatic_replacements().")
         update_status_label("Applying automatic replacements...")
-        apply_automatic_replacements() # Apply automatic find/replace rules
+        run_stage('apply_replacements', apply_automatic_replacements) # Apply automatic find/replace rules
         update_text_area() # Update text area after this step
         log_message("apply_automatic_replacements() finished.")
     else:
         log_message("Checkbox 'Apply Automatic Replacements' is NOT checked. Skipping apply_automatic_replacements().")
+    run_plugin_stages('apply_replacements', steps)
 
 
     # 3. Insert Periods into Abbreviations (if uncommented and checked)
-    if insert_periods_var.get():
+    check_cancelled()
+    if steps['insert_periods']:
         log_message("Checkbox 'Insert Periods into Abbreviations' is checked.")
         update_status_label("Inserting periods into abbreviations...")
         # insert_periods_into_abbreviations() # This line is currently commented out in your script
@@ -1252,20 +4841,37 @@ def run_processing():
 
 
     # 4. Remove Pagination
-    if remove_pagination_var.get():
+    check_cancelled()
+    if steps['remove_pagination'] and html_document is not None:
         log_message("Checkbox 'Remove Pagination' is checked. Executing remove_pagination().")
         update_status_label("Removing pagination...")
-        remove_pagination() # Remove detected pagination elements
+        run_stage('remove_pagination', remove_pagination) # Remove the page-number elements from the HTML tree
         update_text_area() # Update text area after this step
         log_message("remove_pagination() finished.")
-    else:
+    elif not steps['remove_pagination']:
         log_message("Checkbox 'Remove Pagination' is NOT checked. Skipping remove_pagination().")
 
+    # 4b. Line Filters: TXT page numbers and running headers in one pass over the lines
+    check_cancelled()
+    if steps['remove_pagination'] and html_document is None:
+        log_message("Checkbox 'Remove Pagination' is checked. Executing apply_line_filters() for the page lines.")
+        update_status_label("Removing pagination...")
+        run_stage('line_filters', lambda: apply_line_filters(paginate=True))
+        update_text_area()
+        log_message("apply_line_filters() finished.")
+    run_plugin_stages('line_filters', steps)
+
     # 1. Interactive Choices (Original Bookfix)
-    if process_choices_var.get():
+    check_cancelled()
+    if steps['process_choices'] and series_decisions is not None:
+        log_message("Series session: applying the shared CHOICE answers.")
+        run_stage('process_choices', apply_series_choice_decisions)
+        update_text_area()
+    elif steps['process_choices']:
         log_message("Checkbox 'Interactive Choices' is checked. Executing process_choices().")
         update_status_label("Starting interactive choices...")
-        process_choices() # Handle interactive replacements based on choices
+        change_stage = 'process_choices'
+        run_on_ui_thread(process_choices) # Handle interactive replacements based on choices (needs the Tk thread)
         log_message("process_choices() finished.")
         # process_choices updates the global 'text' variable and text_area
     else:
@@ -1273,63 +4879,116 @@ def run_processing():
 
 
    # 5 Process all capps
-    if process_all_caps_var.get():
+    check_cancelled()
+    if steps['process_all_caps']:
         log_message("Checkbox 'Process All-Caps Sequences' is checked.")
 
         # ——— Pre‑apply your UPPER_TO_LOWER rules ———
         update_status_label("Applying auto‑lowercase rules...")
         if lowercase_set:
-            mapping = { word: word.lower() for word in lowercase_set }
-            text = apply_upper_to_lower(text, mapping)
+            run_stage('lowercase_rules', apply_lowercase_rules) # Its own stage name and budget, apart from the caps pass
             update_text_area()
-            log_message(f"Auto‑lowercased {len(mapping)} words from lowercase_set: {mapping.keys()}")
 
         # ——— Now run your interactive all‑caps pass ———
-        update_status_label("Starting all‑caps interactive processing...")
-        process_all_caps_sequences_gui()
-        log_message("process_all_caps_sequences_gui() finished.")
+        if series_decisions is not None: # Answers were collected once for the whole series
+            log_message("Series session: applying the shared all-caps answers.")
+            run_stage('process_all_caps', apply_series_caps_decisions)
+            update_text_area()
+        elif root is not None:
+            update_status_label("Starting all‑caps interactive processing...")
+            change_stage = 'process_all_caps'
+            run_on_ui_thread(process_all_caps_sequences_gui)
+            log_message("process_all_caps_sequences_gui() finished.")
+        else:
+            log_message("No GUI available. Skipping interactive all-caps pass.")
     else:
         log_message("Checkbox 'Process All-Caps Sequences' is NOT checked. Skipping process_all_caps_sequences_gui().")
 
 
     # 6. Convert Roman Numerals
-    if convert_roman_var.get():
+    check_cancelled()
+    if steps['convert_roman']:
         log_message("Checkbox 'Convert Roman Numerals' is checked. Executing convert_roman_numerals().")
         update_status_label("Converting Roman numerals...")
-        convert_roman_numerals() # Convert Roman numerals to Arabic
+        run_stage('convert_roman', convert_roman_numerals) # Convert Roman numerals to Arabic
         update_text_area() # Update text area after this step
         log_message("convert_roman_numerals() finished.")
     else:
         log_message("Checkbox 'Convert Roman Numerals' is NOT checked. Skipping convert_roman_numerals().")
 
 
+    # 6b. Spell out numbers (after Roman numerals so converted chapter numbers are spoken too)
+    check_cancelled()
+    if steps['verbalize_numbers']:
+        log_message("Checkbox 'Spell Out Numbers' is checked. Executing verbalize_numbers().")
+        update_status_label("Spelling out numbers...")
+        run_stage('verbalize_numbers', verbalize_numbers)
+        update_text_area()
+        log_message("verbalize_numbers() finished.")
+    elif steps['apply_replacements']: # The ordinals used to be REPLACE rules; keep spelling them out
+        log_message("Checkbox 'Spell Out Numbers' is NOT checked. Spelling out ordinals only.")
+        run_stage('verbalize_ordinals', verbalize_ordinals)
+        update_text_area()
+    else:
+        log_message("Checkbox 'Spell Out Numbers' is NOT checked. Skipping verbalize_numbers().")
+
+
     # 7. Convert to Lowercase
-    if convert_lowercase_var.get():
+    check_cancelled()
+    if steps['convert_lowercase']:
         log_message("Checkbox 'Convert to Lowercase' is checked. Executing convert_to_lowercase().")
         update_status_label("Converting to lowercase...")
-        convert_to_lowercase() # Convert all text to lowercase
+        run_stage('convert_lowercase', convert_to_lowercase) # Convert all text to lowercase
         update_text_area() # Update text area after this step
         log_message("convert_to_lowercase() finished.")
     else:
         log_message("Checkbox 'Convert to Lowercase' is NOT checked. Skipping convert_to_lowercase().")
+    run_plugin_stages('convert_lowercase', steps)
 
-    # 8. Remove Blank Lines (should be the very last step)
-    if remove_blank_lines_var.get():
-        log_message("Checkbox 'Remove Blank Lines' is checked. Executing remove_blank_lines().")
+    # 8. Remove Blank Lines and Trim Whitespace (should be the very last step; one pass for both)
+    check_cancelled()
+    if steps['remove_blank_lines'] or steps['trim_whitespace']:
+        log_message("Executing apply_line_filters() (blank lines: %s, trim: %s)."
+                    % (steps['remove_blank_lines'], steps['trim_whitespace']))
         update_status_label("Removing blank lines...")
-        # call your function and update the global text
-        text = remove_blank_lines(text)
+        run_stage('remove_blank_lines', lambda: apply_line_filters(drop_blank=steps['remove_blank_lines'],
+                                                                   trim=steps['trim_whitespace']))
         update_text_area()
-        log_message("remove_blank_lines() finished.")
+        log_message("apply_line_filters() finished.")
     else:
         log_message("Checkbox 'Remove Blank Lines' is NOT checked. Skipping remove_blank_lines().")
 
+    # Put the processed text back into the HTML document and serialize it, once
+    check_cancelled()
+    if html_document is not None:
+        finish_html_document(squeeze_blank_lines=steps['remove_blank_lines'])
+        update_text_area()
+
+    # Strip the chapter markers and build the chapter offsets index on the final text
+    check_cancelled()
+    if run_chapter_detection:
+        collect_chapters()
+        update_text_area()
+
+    # 9. Split into TTS chunks (runs on the final text)
+    check_cancelled()
+    if steps['segment_output']:
+        log_message("Checkbox 'Split into TTS Chunks' is checked. Executing segment_for_tts().")
+        update_status_label("Splitting into TTS chunks...")
+        if not run_stage('segment_output', segment_for_tts):
+            segment_chunks = []
+        log_message("segment_for_tts() finished.")
+    else:
+        segment_chunks = []
+        log_message("Checkbox 'Split into TTS Chunks' is NOT checked. Skipping segment_for_tts().")
+
 
 
     # --- End Processing Steps ---
 
     # Update the GUI display and status
     log_message("All processing steps checked have finished.")
+    log_stage_report()
     update_status_label("Processing complete.") # Update status to "Processing complete"
     log_message("About to show Save button…")
     display_save_button() # Make the save button available
@@ -1355,8 +5014,7 @@ def start_processing_button_command():
     # This ensures we start with the text loaded after file selection, not a potentially old state
     # The 'text' global variable holds the content loaded from the file initially.
     # Processing functions will modify this 'text' variable.
-    text_area.delete("1.0", tk.END)
-    text_area.insert("1.0", text)
+    render_text_view(first_line=0)
     log_message("Text area cleared and re-populated with initial text.")
 
     # Clear the execution log file at the start of a new run
@@ -1375,37 +5033,143 @@ def start_processing_button_command():
     except Exception as e:
         log_message(f"Error clearing debug.txt file: {e}", level="ERROR")
 
-    # Added: Clear the matches.txt file at the start of processing
-    try:
-        open('matches.txt', 'w', encoding='utf-8').close()
-        log_message("Cleared matches.txt log file.")
-    except Exception as e:
-        log_message(f"Error clearing matches.txt log file: {e}", level="ERROR")
+    # Start an empty choice trace (when tracing is on)
+    reset_choice_trace()
 
 
-    log_message("Calling run_processing().")
-    # Assuming run_processing calls process_choices if the checkbox is checked
-    run_processing() # Call the main processing function
-    log_message("Returned from run_processing().")
+    log_message("Starting run_processing() on the worker thread.")
+    # The worker re-enables the start button through finish_background_run() when it ends
+    start_background_run()
 
+# --- Virtualized Text View ---
+# The Text widget only ever holds a window of VIEW_WINDOW_LINES lines of the book around
+# the part being looked at. Book offsets are mapped to widget indices through a line-start
+# index (bisect) instead of Tk's "1.0+Nc" arithmetic, which walks the widget from the top,
+# so loading, highlighting and scrolling cost the same on a 20 MB book as on a short story.
+# The global 'text' is the only copy of the book; nothing is read back from the widget.
+VIEW_WINDOW_LINES = 400 # Lines of the book loaded into the widget at a time
+
+view_source = None # The string the current window was cut from
+view_first_line = 0 # Book line (0-based) shown on widget line 1
+view_last_line = 0 # Book line (0-based) just past the last one shown
+
+
+def render_text_view(content=None, center=None, first_line=None):
+    """
+    Loads a window of lines of `content` (default: the global text) into the text area:
+    centred on offset `center`, starting at book line `first_line`, or else at the
+    same place as the current window.
+    """
+    global view_source, view_first_line, view_last_line
+    if text_area is None:
+        return
+    content = text if content is None else content
+    index = get_line_index(content)
+    if center is not None:
+        first_line = index.line_of(center) - VIEW_WINDOW_LINES // 2
+    elif first_line is None:
+        first_line = view_first_line
+    first_line = max(0, min(first_line, len(index) - VIEW_WINDOW_LINES))
+    # Reloading the same window (e.g. after an edit) keeps the scroll position
+    top = text_area.index("@0,0") if first_line == view_first_line and view_source is not None else None
+    view_source = content
+    view_first_line = first_line
+    view_last_line = min(len(index), first_line + VIEW_WINDOW_LINES)
+    text_area.delete("1.0", tk.END)
+    text_area.insert("1.0", content[index.line_start(view_first_line):index.line_start(view_last_line)])
+    if top is not None:
+        text_area.yview(top)
+
+
+def patch_text_view(start, end, replacement, previous):
+    """
+    Mirrors previous[start:end] = replacement (already applied to the global text) in the
+    loaded window without reloading it. Falls back to render_text_view() when the window
+    was not cut from `previous`, the edit is outside it, or the edit adds or removes lines.
+    """
+    global view_source
+    if text_area is None:
+        return
+    line, column = get_line_index(text).line_col(start) # Same line and column as before: no line breaks involved
+    if view_source is not previous or "\n" in replacement or "\n" in previous[start:end] or \
+            not view_first_line <= line < view_last_line:
+        render_text_view()
+        return
+    widget_line = line - view_first_line + 1
+    text_area.delete(f"{widget_line}.{column}", f"{widget_line}.{column + end - start}")
+    text_area.insert(f"{widget_line}.{column}", replacement)
+    view_source = text
+
+
+def widget_index(offset, content=None):
+    """Tk "line.column" index of offset `offset` in `content` (default: the global text), sliding the window to it if needed."""
+    content = text if content is None else content
+    index = get_line_index(content)
+    line = index.line_of(offset)
+    if view_source is not content or not view_first_line <= line < view_last_line:
+        render_text_view(content, center=offset)
+    line, column = index.line_col(offset)
+    return f"{line - view_first_line + 1}.{column}"
+
+
+def show_span(tag, start, end, content=None, **style):
+    """Highlights offsets start..end of `content` (default: the global text) with `tag` and scrolls them into view."""
+    content = text if content is None else content
+    index = get_line_index(content)
+    last = index.line_of(max(start, end - 1))
+    if view_source is not content or not (view_first_line <= index.line_of(start) and last < view_last_line):
+        render_text_view(content, center=start)
+    text_area.tag_remove(tag, "1.0", tk.END)
+    text_area.tag_add(tag, widget_index(start, content), widget_index(end, content))
+    text_area.tag_config(tag, **style)
+    text_area.see(widget_index(start, content))
+
+
+def on_view_scroll(first, last):
+    """
+    yscrollcommand of the text area: when the user scrolls to either end of the
+    loaded window and there is more book that way, slide the window by half.
+    """
+    if view_source is None:
+        return
+    index = get_line_index(view_source)
+    shift = VIEW_WINDOW_LINES // 2
+    if float(last) >= 1.0 and view_last_line < len(index):
+        new_first = view_first_line + shift
+    elif float(first) <= 0.0 and view_first_line > 0:
+        new_first = view_first_line - shift
+    else:
+        return
+    # Keep the line at the top of the screen where it is, after Tk finishes this scroll
+    top_line = view_first_line + int(text_area.index("@0,0").split(".")[0]) - 1
+    def slide():
+        render_text_view(view_source, first_line=new_first)
+        text_area.yview(f"{top_line - view_first_line + 1}.0")
+    root.after_idle(slide)
 
-    # Re-enable the start button after processing
-    start_processing_button.config(state=tk.NORMAL)
-    log_message("Start Processing button re-enabled.")
 
 # --- GUI Update Functions ---
 def update_text_area():
     """Refreshes the main text area with the current content of the 'text' variable."""
     global text, text_area # Need global text_area here
+    if text_area is None: # Headless run, nothing to refresh
+        return
+    if not on_ui_thread(): # Worker thread: let the Tk thread do it
+        ui_queue.put(('text', text))
+        return
     log_message("Updating text area with current text variable content.")
-    text_area.delete("1.0", tk.END) # Clear existing content
-    text_area.insert("1.0", text) # Insert the current text
+    render_text_view() # Reload the visible window from the current text
 
 def update_status_label(message):
     """Updates the status label with a given message."""
     global status_label # Need global status_label here
     log_message(f"Updating status label: {message}")
-    status_label.config(text=message)
+    if status_label is None:
+        return
+    if on_ui_thread():
+        status_label.config(text=message)
+    else:
+        ui_queue.put(('status', message))
 
 def save_file():
     """Saves the final processed text to a new file."""
@@ -1426,16 +5190,46 @@ def save_file():
         # Open the output file for writing (overwriting if it exists)
         with open(output_filepath, "w", encoding="utf-8") as output_file:
             output_file.write(text) # Write the processed text to the file
+        if segment_chunks: # Chunks were computed by the 'Split into TTS Chunks' step
+            write_segments(text, segment_chunks, output_filepath, chapters=chapters)
+        if chapters: # Chapters were found by the 'Detect Chapters' step
+            write_chapters(text, chapters, output_filepath, scene_breaks)
+        if change_report_wanted: # 'Write Change Report' was on for this run
+            write_change_report(output_filepath)
         # Show a success message box
         log_message("File saved successfully.")
+        record_gui_output(output_filepath)
         messagebox.showinfo("Info", f"Output saved to {output_filepath}")
     except Exception as e:
         # Show an error message box if saving fails
         log_message(f"Error saving output file: {e}", level="ERROR")
         messagebox.showerror("Error", f"Error saving output: {e}")
 
+def record_gui_output(output_filepath, source_path=None, seconds=None):
+    """Records an interactively processed book in the library index so scans leave it alone."""
+    source_path = source_path or filepath
+    try:
+        with open(source_path, 'rb') as f:
+            data = f.read()
+        st = os.stat(source_path)
+        conn = open_library_index()
+        try:
+            record_processed_book(conn, str(Path(source_path).resolve()), st.st_size, st.st_mtime_ns, hash_content(data),
+                                  compute_ruleset_hash(), output_filepath, seconds if seconds is not None else last_run_seconds,
+                                  mode='gui', hits=rule_hits)
+        finally:
+            conn.close()
+    except Exception as e:
+        log_message(f"Could not record '{source_path}' in the library index: {e}", level="WARNING")
+
+
 def display_save_button():
     """Makes the Save button visible and forces the window to expand."""
+    if save_button is None: # Headless run, no button to show
+        return
+    if not on_ui_thread():
+        run_on_ui_thread(display_save_button)
+        return
     # Show the Save button alongside Start/Quit
     save_button.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
 
@@ -1448,6 +5242,460 @@ def display_save_button():
 
 
 
+# --- Library Index and Watch-Folder Mode ---
+# Watches the default directory (normally the Calibre library) and processes new or
+# changed book files without the GUI. Linux uses inotify; everything else polls.
+WATCH_EXTENSIONS = (".txt", ".xhtml", ".html") # File types picked up by watch mode
+WATCH_DEBOUNCE_SECONDS = 2.0 # A file must be quiet this long before it is processed
+WATCH_POLL_INTERVAL_SECONDS = 5.0 # Rescan interval for the polling fallback
+OUTPUT_SUFFIX = "_output.txt" # Suffix used for processed output files
+INDEX_FILE_NAME = ".bookfix_index.sqlite" # Library index of processed books (kept next to .data.txt)
+# Files this program writes itself; never treat them as input
+WORK_FILE_NAMES = {DATA_FILE_NAME, "debug.txt", "matches.txt", "pagination_debug.txt",
+                   CHOICE_TRACE_FILE, CHOICE_TRACE_FILE + ".1"}
+
+# inotify constants (from <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def is_watch_candidate(path):
+    """Returns True if `path` looks like a book file watch mode should process."""
+    name = os.path.basename(path)
+    if name in WORK_FILE_NAMES or name.startswith('.'):
+        return False
+    if name.endswith(OUTPUT_SUFFIX): # Never re-process our own output
+        return False
+    if name.endswith(tuple("_output_changes." + fmt for fmt in CHANGE_REPORT_FORMATS)): # ...or its change report
+        return False
+    if os.path.basename(os.path.dirname(path)).endswith((CHUNKS_DIR_SUFFIX, CHAPTERS_DIR_SUFFIX)): # ...or its chunks/chapters
+        return False
+    return name.lower().endswith(WATCH_EXTENSIONS)
+
+
+def is_excluded_watch_dir(dirpath):
+    """
+    Returns True for directories watch and scan never enter: hidden ones, the chunk and
+    chapter folders of our outputs, and the profile directory (its .alloc.txt files would
+    otherwise be picked up as books when it sits inside the watched tree).
+    """
+    name = os.path.basename(dirpath)
+    if name.startswith('.') or name.endswith((CHUNKS_DIR_SUFFIX, CHAPTERS_DIR_SUFFIX)):
+        return True
+    return os.path.realpath(dirpath) == os.path.realpath(profile_dir)
+
+
+def output_path_for(source_path):
+    """Returns the output path used for a processed source file (next to the source)."""
+    source_path = Path(source_path)
+    return source_path.with_name(source_path.stem + OUTPUT_SUFFIX)
+
+
+def _library_index_path():
+    """Returns the path of the library index database (kept next to .data.txt)."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), INDEX_FILE_NAME)
+
+
+def open_library_index(index_path=None):
+    """
+    Opens (creating if needed) the SQLite library index of processed books.
+    One row per source file: size, mtime, content hash, ruleset hash, output path, timings
+    and any skipped stages with the reason (over budget or plugin error), plus the per-rule hits of
+    its last run in rule_hits (only rules that fired are stored).
+    """
+    import sqlite3
+    conn = sqlite3.connect(index_path or _library_index_path())
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS books ("
+        " source_path TEXT PRIMARY KEY,"
+        " size INTEGER NOT NULL,"
+        " mtime_ns INTEGER NOT NULL,"
+        " content_hash TEXT NOT NULL,"
+        " ruleset_hash TEXT NOT NULL,"
+        " output_path TEXT NOT NULL,"
+        " mode TEXT NOT NULL," # 'headless' or 'gui' (interactive output is never overwritten by a scan)
+        " processed_at TEXT NOT NULL,"
+        " seconds REAL NOT NULL,"
+        " skipped_stages TEXT NOT NULL DEFAULT ''," # Comma-separated <stage>=over_budget or <stage>=plugin_error
+        " rule_categories TEXT NOT NULL DEFAULT '')" # Comma-separated rule categories whose hits were counted
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS rule_hits ("
+        " source_path TEXT NOT NULL,"
+        " category TEXT NOT NULL,"
+        " rule TEXT NOT NULL,"
+        " hits INTEGER NOT NULL,"
+        " PRIMARY KEY (source_path, category, rule))"
+    )
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(books)")}
+    if 'skipped_stages' not in columns: # Index written before stage budgets existed
+        conn.execute("ALTER TABLE books ADD COLUMN skipped_stages TEXT NOT NULL DEFAULT ''")
+    if 'rule_categories' not in columns: # Index written before rule analytics existed
+        conn.execute("ALTER TABLE books ADD COLUMN rule_categories TEXT NOT NULL DEFAULT ''")
+    conn.commit()
+    return conn
+
+
+def load_index_rows(conn):
+    """Loads the whole index in one query. Returns {source_path: sqlite3.Row}."""
+    return {row['source_path']: row for row in conn.execute("SELECT * FROM books")}
+
+
+def record_processed_book(conn, source_path, size, mtime_ns, content_hash, ruleset_hash,
+                          output_path, seconds, mode='headless', skipped='', hits=None):
+    """Inserts or updates the index row for `source_path`, and its rule hits ({category: {rule: hits}})."""
+    hits = hits or {}
+    conn.execute(
+        "INSERT OR REPLACE INTO books (source_path, size, mtime_ns, content_hash, ruleset_hash,"
+        " output_path, mode, processed_at, seconds, skipped_stages, rule_categories)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (str(source_path), size, mtime_ns, content_hash, ruleset_hash, str(output_path), mode,
+         datetime.datetime.now().isoformat(timespec='seconds'), seconds, skipped, ",".join(sorted(hits)))
+    )
+    conn.execute("DELETE FROM rule_hits WHERE source_path = ?", (str(source_path),))
+    conn.executemany("INSERT INTO rule_hits (source_path, category, rule, hits) VALUES (?, ?, ?, ?)",
+                     [(str(source_path), category, rule, n)
+                      for category, counts in hits.items() for rule, n in counts.items() if n])
+    conn.commit()
+
+
+def hash_content(data):
+    """Returns the content hash stored in the index for raw file bytes."""
+    import hashlib
+    return hashlib.sha1(data).hexdigest()
+
+
+def compute_ruleset_hash(steps=None):
+    """
+    Hashes the loaded rules together with the enabled processing steps, so books are
+    reprocessed when either changes.
+    """
+    import hashlib
+    import json
+    flags = dict(HEADLESS_STEP_DEFAULTS)
+    flags.update(steps or {})
+    payload = json.dumps({
+        'choices': choices,
+        'replacements': replacements,
+        'periods': sorted(periods),
+        'ignore': sorted(ignore_set),
+        'lowercase': sorted(lowercase_set),
+        'normalize': normalization,
+        'nfkc': normalize_nfkc,
+        'steps': flags,
+        'segmenter': _segmenter_options() if flags.get('segment_output') else None,
+        **({'plugins': plugin_fingerprint()} if plugin_stages and flags.get('plugin_stages') else {}),
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def needs_processing(row, path, ruleset_hash, conn=None):
+    """
+    Decides whether `path` must be (re)processed given its index row.
+    Only stats the file in the common case; the content is hashed only when
+    size matches but mtime moved (e.g. a Calibre re-export of identical text).
+    Books saved from the GUI are only processed again if their output is gone.
+    """
+    if row is None:
+        return True
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False # Vanished; nothing to do
+    if not os.path.exists(row['output_path']):
+        return True
+    if row['mode'] != 'headless': # Interactive output is never overwritten, even if the source changed
+        return False
+    if row['ruleset_hash'] != ruleset_hash:
+        return True
+    if row['size'] == st.st_size and row['mtime_ns'] == st.st_mtime_ns:
+        return False
+    if row['size'] != st.st_size:
+        return True
+    with open(path, 'rb') as f:
+        if hash_content(f.read()) != row['content_hash']:
+            return True
+    if conn is not None: # Same content, just touched: remember the new mtime
+        conn.execute("UPDATE books SET mtime_ns = ? WHERE source_path = ?", (st.st_mtime_ns, str(path)))
+        conn.commit()
+    return False
+
+
+headless_steps = {} # Step overrides used by headless workers (see set_step_flags)
+
+
+def _watch_worker_init(steps=None, segmenter=None, budgets=None, change_format=None):
+    """Worker process initializer: load the rules once per worker and apply the run options."""
+    global headless_steps, change_report_format
+    load_data_file()
+    headless_steps = dict(steps or {})
+    if budgets:
+        stage_budgets.update(budgets) # Includes a --stage-budget default from the command line
+    if change_format:
+        change_report_format = change_format
+    if segmenter:
+        configure_segmenter(**segmenter)
+
+
+def _segmenter_options():
+    """Returns the active segmenter settings for passing to worker processes."""
+    return {'max_chars': segment_max_chars or 0, 'max_tokens': segment_max_tokens or 0, 'fmt': segment_format}
+
+
+def process_file_for_watch(path):
+    """
+    Worker entry point: processes one file headlessly and writes <stem>_output.txt next to it.
+    Returns (path, output_path, size, mtime_ns, content_hash, seconds, skipped_stages(), rule_hits).
+    """
+    started = time.perf_counter()
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    result = process_text_headless(data.decode('utf-8'), path, **headless_steps)
+    out_path = output_path_for(path)
+    with open(out_path, 'w', encoding='utf-8') as f:
+        f.write(result)
+    if segment_chunks:
+        write_segments(result, segment_chunks, out_path, chapters=chapters)
+    if chapters:
+        write_chapters(result, chapters, out_path, scene_breaks)
+    if change_report_wanted:
+        write_change_report(out_path)
+    return (str(path), str(out_path), st.st_size, st.st_mtime_ns, hash_content(data),
+            time.perf_counter() - started, skipped_stages(), dict(rule_hits))
+
+
+def _record_worker_result(conn, future, path, ruleset_hash):
+    """Records a finished worker future in the index and logs the outcome."""
+    try:
+        src, out, size, mtime_ns, content_hash, seconds, skipped, hits = future.result()
+    except Exception as e:
+        log_message(f"Error processing '{path}': {e}", level="ERROR")
+        return False
+    record_processed_book(conn, src, size, mtime_ns, content_hash, ruleset_hash, out, seconds,
+                          skipped=",".join(f"{stage}={reason}" for stage, reason in skipped), hits=hits)
+    log_message(f"Processed '{src}' -> '{out}' in {seconds:.2f}s.")
+    over_budget = [stage for stage, reason in skipped if reason == 'over_budget']
+    plugin_errors = [stage for stage, reason in skipped if reason == 'plugin_error']
+    if over_budget:
+        log_message(f"'{src}': stage(s) over budget and skipped: {', '.join(over_budget)}", level="WARNING")
+    if plugin_errors:
+        log_message(f"'{src}': plugin pass(es) failed and skipped: {', '.join(plugin_errors)}", level="WARNING")
+    return True
+
+
+def scan_library(directory, workers=2, steps=None):
+    """
+    Processes every new or changed book under `directory` once and returns
+    (processed, skipped, failed). Up-to-date books cost one stat() each.
+    `steps` overrides HEADLESS_STEP_DEFAULTS.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    directory = str(Path(directory).expanduser().resolve())
+    conn = open_library_index()
+    ruleset_hash = compute_ruleset_hash(steps)
+    rows = load_index_rows(conn)
+    todo = []
+    skipped = 0
+    for path in _iter_watch_files(directory):
+        if needs_processing(rows.get(path), path, ruleset_hash, conn):
+            todo.append(path)
+        else:
+            skipped += 1
+    log_message(f"Library scan of '{directory}': {len(todo)} to process, {skipped} up to date.")
+
+    processed = failed = 0
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_watch_worker_init,
+                                 initargs=(steps, _segmenter_options(), stage_budgets, change_report_format)) as pool:
+            futures = {pool.submit(process_file_for_watch, path): path for path in todo}
+            for future in as_completed(futures):
+                if _record_worker_result(conn, future, futures[future], ruleset_hash):
+                    processed += 1
+                else:
+                    failed += 1
+    conn.close()
+    log_message(f"Library scan finished: {processed} processed, {skipped} skipped, {failed} failed.")
+    return processed, skipped, failed
+
+
+def _iter_watch_files(directory):
+    """Yields every candidate file under `directory` (recursive)."""
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [d for d in dirnames if not is_excluded_watch_dir(os.path.join(dirpath, d))]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if is_watch_candidate(path):
+                yield path
+
+
+def _poll_snapshot(directory):
+    """Returns {path: (size, mtime_ns)} for every candidate file under `directory`."""
+    snapshot = {}
+    for path in _iter_watch_files(directory):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue # Vanished between walk and stat
+        snapshot[path] = (st.st_size, st.st_mtime_ns)
+    return snapshot
+
+
+def _inotify_open(directory):
+    """
+    Sets up recursive inotify watches on `directory`.
+    Returns (libc, fd, wd_to_dir) or None when inotify is not available.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+    except Exception as e:
+        log_message(f"inotify unavailable ({e}); falling back to polling.", level="WARNING")
+        return None
+    wd_to_dir = {}
+    for dirpath, dirnames, _ in os.walk(directory):
+        dirnames[:] = [d for d in dirnames if not is_excluded_watch_dir(os.path.join(dirpath, d))]
+        _inotify_add_dir(libc, fd, wd_to_dir, dirpath)
+    return libc, fd, wd_to_dir
+
+
+def _inotify_add_dir(libc, fd, wd_to_dir, dirpath):
+    """Adds a single directory watch."""
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+    wd = libc.inotify_add_watch(fd, os.fsencode(dirpath), mask)
+    if wd >= 0:
+        wd_to_dir[wd] = dirpath
+    else:
+        log_message(f"Could not watch directory '{dirpath}'", level="WARNING")
+
+
+def _inotify_read(libc, fd, wd_to_dir, timeout):
+    """Waits up to `timeout` seconds and returns the set of changed candidate paths."""
+    import select
+    import struct
+    changed = set()
+    readable, _, _ = select.select([fd], [], [], timeout)
+    if not readable:
+        return changed
+    try:
+        data = os.read(fd, 64 * 1024)
+    except BlockingIOError:
+        return changed
+    header = struct.Struct('iIII')
+    pos = 0
+    while pos + header.size <= len(data):
+        wd, mask, _cookie, name_len = header.unpack_from(data, pos)
+        pos += header.size
+        name = data[pos:pos + name_len].rstrip(b'\0')
+        pos += name_len
+        parent = wd_to_dir.get(wd)
+        if parent is None or not name:
+            continue
+        path = os.path.join(parent, os.fsdecode(name))
+        if mask & IN_ISDIR:
+            # New sub-directory (e.g. a new Calibre book folder): watch it and pick up its files
+            if mask & (IN_CREATE | IN_MOVED_TO) and not is_excluded_watch_dir(path):
+                _inotify_add_dir(libc, fd, wd_to_dir, path)
+                changed.update(_iter_watch_files(path))
+        elif is_watch_candidate(path):
+            changed.add(path)
+    return changed
+
+
+def watch_directory(directory, workers=2, debounce=WATCH_DEBOUNCE_SECONDS,
+                    poll_interval=WATCH_POLL_INTERVAL_SECONDS, force_poll=False, steps=None):
+    """
+    Watches `directory` for new or changed book files and processes them headlessly.
+    Events are debounced per file, work runs on a bounded process pool, and files the
+    library index records as up to date are skipped. Runs until Ctrl+C.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    directory = str(Path(directory).expanduser().resolve())
+    log_message(f"Watching '{directory}' with {workers} worker(s).")
+    conn = open_library_index()
+    ruleset_hash = compute_ruleset_hash(steps)
+
+    inotify = None if force_poll else _inotify_open(directory)
+    if inotify:
+        log_message("Using inotify for change detection.")
+        snapshot = None
+    else:
+        log_message(f"Polling for changes every {poll_interval} seconds.")
+        snapshot = _poll_snapshot(directory)
+
+    pending = {} # path -> monotonic time of the last event seen for it
+    in_flight = {} # future -> path
+    now = time.monotonic()
+    rows = load_index_rows(conn)
+    for path in _iter_watch_files(directory): # Catch up on anything added while we were not running
+        if needs_processing(rows.get(path), path, ruleset_hash, conn):
+            pending[path] = now - debounce
+    del rows
+    log_message(f"{len(pending)} file(s) need processing at startup.")
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_watch_worker_init,
+                               initargs=(steps, _segmenter_options(), stage_budgets, change_report_format))
+    last_poll = time.monotonic()
+    try:
+        while True:
+            wait = min(debounce, poll_interval) / 2
+            if inotify:
+                changed = _inotify_read(*inotify, wait)
+            else:
+                time.sleep(wait)
+                changed = set()
+                if time.monotonic() - last_poll >= poll_interval:
+                    new_snapshot = _poll_snapshot(directory)
+                    changed = {p for p, sig in new_snapshot.items() if snapshot.get(p) != sig}
+                    snapshot = new_snapshot
+                    last_poll = time.monotonic()
+
+            now = time.monotonic()
+            for path in changed:
+                pending[path] = now
+
+            # Collect finished work
+            for future in [f for f in in_flight if f.done()]:
+                _record_worker_result(conn, future, in_flight.pop(future), ruleset_hash)
+
+            # Dispatch files that have been quiet long enough, up to the pool size
+            busy = set(in_flight.values())
+            for path, last_event in list(pending.items()):
+                if len(in_flight) >= workers:
+                    break
+                if now - last_event < debounce or path in busy:
+                    continue
+                del pending[path]
+                if not os.path.isfile(path):
+                    continue
+                row = conn.execute("SELECT * FROM books WHERE source_path = ?", (path,)).fetchone()
+                if not needs_processing(row, path, ruleset_hash, conn):
+                    continue
+                log_message(f"Queueing '{path}' for processing.")
+                in_flight[pool.submit(process_file_for_watch, path)] = path
+    except KeyboardInterrupt:
+        log_message("Watch mode stopped by user.")
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        conn.close()
+        if inotify:
+            os.close(inotify[1])
+
+
 # --- Program Exit Function ---
 def quit_program():
     """Exits the program cleanly."""
@@ -1459,9 +5707,154 @@ def quit_program():
     # Force exit the script
     os._exit(0)
 
+# --- Command Line ---
+def parse_command_line(argv=None):
+    """Parses command-line options. With no options the GUI is started as before."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Preprocess ebook text for TTS.")
+    parser.add_argument("--watch", nargs="?", const="", metavar="DIR",
+                        help="Watch DIR (default: the # DEFAULT_FILE_DIR from .data.txt) and process new or changed files without the GUI.")
+    parser.add_argument("--scan", nargs="?", const="", metavar="DIR",
+                        help="Process every new or changed file under DIR (default: # DEFAULT_FILE_DIR) once and exit.")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Number of worker processes for headless modes.")
+    parser.add_argument("--poll", action="store_true",
+                        help="Use polling instead of inotify in watch mode.")
+    parser.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE_SECONDS,
+                        help="Seconds a file must be unchanged before watch mode processes it.")
+    parser.add_argument("--chapters", action="store_true",
+                        help="Detect chapter headings and also write one file per chapter (<name>_output_chapters/).")
+    parser.add_argument("--chunks", action="store_true",
+                        help="Also split each output into TTS-sized chunks with a manifest (<name>_output_chunks/).")
+    parser.add_argument("--chunk-chars", type=int, default=SEGMENT_MAX_CHARS,
+                        help="Maximum characters per chunk (0 for no character limit).")
+    parser.add_argument("--chunk-tokens", type=int, default=0,
+                        help="Maximum whitespace-separated tokens per chunk (0 for no token limit).")
+    parser.add_argument("--chunk-format", choices=SEGMENT_FORMATS, default="files",
+                        help="Write chunks as numbered text files or as a single JSONL file.")
+    parser.add_argument("--series", nargs="+", metavar="FILE",
+                        help="Process several books of a series, asking each interactive question once on the console.")
+    parser.add_argument("--interactive", action="store_true",
+                        help="With --series: ask the Interactive Choices questions too (all-caps questions are always asked).")
+    parser.add_argument("--changes", choices=CHANGE_REPORT_FORMATS, default=None,
+                        help="Also write a review report of every edit (<name>_output_changes.html or .txt).")
+    parser.add_argument("--dry-run", nargs="+", metavar="FILE",
+                        help="Count the hits of every rule in FILE(s) without processing them, busiest rules first.")
+    parser.add_argument("--sample-kb", type=int, default=None, metavar="N",
+                        help="With --dry-run: only look at the first N KB of each file.")
+    parser.add_argument("--sample-paragraphs", type=int, default=None, metavar="N",
+                        help="With --dry-run: only look at N random paragraphs of each file.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="With --sample-paragraphs: random seed, for repeatable samples.")
+    parser.add_argument("--rule-report", action="store_true",
+                        help="Report dead, shadowed and conflicting rules using the hit counts stored in the library index.")
+    parser.add_argument("--prune-rules", action="store_true",
+                        help="Like --rule-report, and also write .data.pruned.txt with those rules commented out.")
+    parser.add_argument("--stage-budget", type=float, default=None, metavar="SECONDS",
+                        help="Default time budget per stage; a stage that runs longer is skipped (overrides 'default' in # STAGE_BUDGETS).")
+    parser.add_argument("--plugin-workers", type=int, default=1, metavar="N",
+                        help="Processes for pure plugin passes over books larger than 1 MB (default: 1, in process).")
+    parser.add_argument("--list-plugins", action="store_true",
+                        help="List the plugin stages from bookfix_plugins/ and entry points, in the passes they run as.")
+    parser.add_argument("--choice-trace", action="store_true",
+                        help="Write a JSON Lines trace of the interactive choices to choice_trace.jsonl (also BOOKFIX_CHOICE_TRACE=1).")
+    parser.add_argument("--expand-choice-trace", nargs="?", const="matches.txt", metavar="OUT",
+                        help="Expand choice_trace.jsonl into the old verbose matches.txt format (written to OUT, default matches.txt) and exit.")
+    parser.add_argument("--profile", default=None, metavar="MODES",
+                        help="Profile every stage: cpu (cProfile .prof files), mem (tracemalloc top allocations) or all.")
+    parser.add_argument("--profile-dir", default=None, metavar="DIR",
+                        help="Directory for the per-run profile directories (default: bookfix_profile/).")
+    return parser.parse_args(argv)
+
+
+def _command_line_steps(args):
+    """Returns the headless step overrides selected on the command line."""
+    global change_report_format
+    configure_segmenter(max_chars=args.chunk_chars, max_tokens=args.chunk_tokens, fmt=args.chunk_format)
+    if args.stage_budget is not None:
+        stage_budgets['default'] = args.stage_budget
+    if args.changes:
+        change_report_format = args.changes
+    return {'change_report': bool(args.changes), 'segment_output': args.chunks, 'detect_chapters': args.chapters}
+
+
+def run_command_line(args):
+    """
+    Runs the headless mode selected on the command line.
+    Returns an exit code, or None if no headless mode was requested (start the GUI).
+    """
+    global plugin_workers, choice_trace_enabled
+    plugin_workers = max(1, args.plugin_workers)
+    if args.choice_trace:
+        choice_trace_enabled = True
+    if args.expand_choice_trace:
+        with open(args.expand_choice_trace, 'w', encoding='utf-8') as f:
+            f.writelines(expand_choice_trace())
+        print(f"Wrote {args.expand_choice_trace}.")
+        return 0
+    if args.profile is not None or args.profile_dir:
+        try:
+            configure_profiling(args.profile if args.profile is not None else profile_modes, args.profile_dir)
+        except ValueError as e:
+            log_message(str(e), level="ERROR")
+            return 2
+    if args.list_plugins:
+        load_data_file()
+        for anchor in PLUGIN_ANCHORS:
+            for group in plugin_pass_groups(anchor):
+                print(f"after {anchor}: " + " + ".join(f"{stage['name']} ({stage['locality']})" for stage in group))
+        return 0
+    if args.watch is not None:
+        load_data_file()
+        directory = args.watch or default_file_directory
+        if not directory or not Path(directory).expanduser().is_dir():
+            log_message("No directory to watch. Pass one to --watch or set # DEFAULT_FILE_DIR in .data.txt.", level="ERROR")
+            return 1
+        watch_directory(directory, workers=args.workers, debounce=args.debounce, force_poll=args.poll,
+                        steps=_command_line_steps(args))
+        return 0
+    if args.rule_report or args.prune_rules:
+        load_data_file()
+        print(build_rule_report(prune=args.prune_rules), end="")
+        return 0
+    if args.dry_run:
+        load_data_file()
+        for path in args.dry_run:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            if is_html_path(path): # Only the text nodes are processed
+                content = HtmlDocument(content).text
+            print(f"== {path}")
+            print(dry_run(content, sample_kb=args.sample_kb, sample_paragraphs=args.sample_paragraphs, seed=args.seed))
+        return 0
+    if args.series:
+        load_data_file()
+        steps = dict(HEADLESS_STEP_DEFAULTS, **_command_line_steps(args), process_choices=args.interactive)
+        outputs = run_series_session(args.series, steps, ask_series_question_on_console)
+        print(f"Wrote {len(outputs)} book(s).")
+        return 0
+    if args.scan is not None:
+        load_data_file()
+        directory = args.scan or default_file_directory
+        if not directory or not Path(directory).expanduser().is_dir():
+            log_message("No directory to scan. Pass one to --scan or set # DEFAULT_FILE_DIR in .data.txt.", level="ERROR")
+            return 1
+        _, _, failed = scan_library(directory, workers=args.workers, steps=_command_line_steps(args))
+        return 1 if failed else 0
+    return None
+
+
 # --- Main Application Entry Point ---
 # This ensures the main() function is called when the script is executed directly
 if __name__ == "__main__":
+    # Headless modes (e.g. --watch) never touch Tk
+    exit_code = run_command_line(parse_command_line())
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+    # Import Tk only now that we know the GUI is wanted
+    load_tk()
+
     # Create the main Tkinter window. This MUST happen before any calls that use 'root'.
     root = tk.Tk()
     root.title("Bookfix GUI") # Set the window title
@@ -1542,6 +5935,13 @@ if __name__ == "__main__":
         convert_lowercase_var = BooleanVar(value=True)
         process_all_caps_var = BooleanVar(value=True) # New checkbox variable
         remove_blank_lines_var = BooleanVar(value=True)
+        segment_output_var = BooleanVar(value=False)
+        detect_chapters_var = BooleanVar(value=False)
+        verbalize_numbers_var = BooleanVar(value=True)
+        normalize_characters_var = BooleanVar(value=True)
+        change_report_var = BooleanVar(value=False)
+        trim_whitespace_var = BooleanVar(value=False)
+        plugin_stages_var = BooleanVar(value=True)
 
 
         # Frame to hold the processing step checkboxes
@@ -1558,6 +5958,13 @@ if __name__ == "__main__":
         ttk.Checkbutton(processing_options_frame, text="Process All-Caps Sequences (Last)", variable=process_all_caps_var).grid(row=2, column=0, sticky=tk.W, padx=5, pady=2) # New checkbox
             # New blank-line removal checkbox
         ttk.Checkbutton(processing_options_frame, text="Remove Blank Lines", variable=remove_blank_lines_var).grid(row=2, column=1, sticky=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(processing_options_frame, text="Split into TTS Chunks", variable=segment_output_var).grid(row=2, column=2, sticky=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(processing_options_frame, text="Detect Chapters", variable=detect_chapters_var).grid(row=3, column=0, sticky=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(processing_options_frame, text="Spell Out Numbers", variable=verbalize_numbers_var).grid(row=3, column=1, sticky=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(processing_options_frame, text="Normalize Characters", variable=normalize_characters_var).grid(row=3, column=2, sticky=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(processing_options_frame, text="Write Change Report", variable=change_report_var).grid(row=4, column=0, sticky=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(processing_options_frame, text="Trim Whitespace", variable=trim_whitespace_var).grid(row=4, column=1, sticky=tk.W, padx=5, pady=2)
+        ttk.Checkbutton(processing_options_frame, text="Plugin Stages", variable=plugin_stages_var).grid(row=4, column=2, sticky=tk.W, padx=5, pady=2)
 
         # Configure columns to expand evenly
         processing_options_frame.columnconfigure(0, weight=1)
@@ -1565,8 +5972,25 @@ if __name__ == "__main__":
         processing_options_frame.columnconfigure(2, weight=1)
 
 
+        # Find box (Enter or F3 for the next hit), answered from the search index
+        find_frame = tk.Frame(root)
+        find_frame.pack(padx=10, fill=tk.X)
+        tk.Label(find_frame, text="Find:").pack(side=tk.LEFT)
+        find_entry = tk.Entry(find_frame, width=30)
+        find_entry.pack(side=tk.LEFT, padx=5)
+        find_entry.bind("<Return>", find_next_command)
+        root.bind("<F3>", find_next_command)
+        find_whole_word_var = BooleanVar(value=False)
+        find_match_case_var = BooleanVar(value=False)
+        ttk.Checkbutton(find_frame, text="Whole word", variable=find_whole_word_var).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(find_frame, text="Match case", variable=find_match_case_var).pack(side=tk.LEFT, padx=5)
+        tk.Button(find_frame, text="Find Next", command=find_next_command).pack(side=tk.LEFT, padx=5)
+        find_label = tk.Label(find_frame, text="")
+        find_label.pack(side=tk.LEFT, padx=5)
+
         # Text area to display and show highlighted text
         text_area = tk.Text(root, wrap=tk.WORD, width=80, height=20)
+        text_area.config(yscrollcommand=on_view_scroll) # Slides the loaded window at its edges
         text_area.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
         # Display initial text content
         update_text_area()
@@ -1588,11 +6012,26 @@ if __name__ == "__main__":
         start_processing_button = tk.Button(button_frame, text="Start Processing", command=start_processing_button_command)
         start_processing_button.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
 
+        # Series session button: answer the interactive questions once for several books
+        series_button = tk.Button(button_frame, text="Series Session...", command=series_session_button_command)
+        series_button.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+
+        # Dry run button: count what the ticked steps would change, without changing anything
+        dry_run_button = tk.Button(button_frame, text="Dry Run", command=dry_run_button_command)
+        dry_run_button.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+
+        # Rule preview button: hits of a new REPLACE/CHOICE rule while it is being typed
+        preview_button = tk.Button(button_frame, text="Preview Rule...", command=rule_preview_button_command)
+        preview_button.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+
 
         # Save button (initially hidden, displayed after processing)
         save_button = tk.Button(button_frame, text="Save", command=save_file)
         # save_button.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True) # Don't pack here, display_save_button does this later
 
+        # Cancel button (shown only while processing is running)
+        cancel_button = tk.Button(button_frame, text="Cancel", command=cancel_processing)
+
         # An empty frame used as a spacer to push Save and Quit buttons apart
         empty_frame = tk.Frame(button_frame)
         empty_frame.pack(side=tk.LEFT, fill=tk.X, expand=True)
@@ -1609,6 +6048,7 @@ if __name__ == "__main__":
         # The processing workflow will be triggered by the 'Start Processing' button click.
         log_message("Starting Tkinter main loop.")
         center_window(root)
+        root.after(UI_POLL_MS, poll_ui_queue) # Drain messages from the processing worker
         root.mainloop()
 
     else:
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import bookfix  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def quiet_bookfix(tmp_path, monkeypatch):
+    """Runs each test in a scratch directory so bookfix's logs and debug files stay out of the repo."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bookfix, "log_file_path", str(tmp_path / "bookfix_execution.log"))
+    yield
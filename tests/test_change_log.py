@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+import bookfix
+
+
+@pytest.fixture
+def change_log(monkeypatch):
+    for name in ("change_log_enabled", "change_log_source", "change_report_wanted"):
+        monkeypatch.setattr(bookfix, name, getattr(bookfix, name))
+    monkeypatch.setattr(bookfix, "change_layers", [])
+    monkeypatch.setattr(bookfix, "change_notes", [])
+    monkeypatch.setattr(bookfix, "text", "")
+    bookfix.begin_change_log(True)
+
+
+def report_edit_by_edit():
+    """The report built the slow way: every edit mapped back through each earlier layer in turn."""
+    entries = []
+    for k, layer in enumerate(bookfix.change_layers):
+        for start, end, before, after, rule in layer.edits:
+            if rule in bookfix.CHANGE_SUMMARY_ONLY_RULES:
+                continue
+            for j in range(k - 1, -1, -1):
+                start = bookfix.change_layers[j].to_input(start)
+                end = bookfix.change_layers[j].to_input(end, at_end=True)
+            entries.append((start, max(start, end), before, after, rule, layer.stage))
+    entries.sort(key=lambda entry: entry[0])
+    return entries
+
+
+def random_edits(rng, text, count):
+    edits = []
+    pos = 0
+    while len(edits) < count:
+        start = pos + rng.randint(0, 6)
+        if start > len(text):
+            break
+        end = min(len(text), start + rng.randint(0, 3))
+        edits.append((start, end, "".join(rng.choice("xyz") for _ in range(rng.randint(0, 3)))))
+        pos = end + 1
+    return edits
+
+
+def test_edits_map_to_original(change_log):
+    text = "The cat sat on the mat."
+    text = bookfix.splice_edits(text, [(4, 7, "dog")], "A")
+    text = bookfix.splice_edits(text, [(0, 0, ">> "), (8, 11, "stood")], "B")
+    assert text == ">> The dog stood on the mat."
+    entries, counts = bookfix.build_change_report()
+    assert [(start, end, before, after) for start, end, before, after, _, _ in entries] == [
+        (0, 0, "", ">> "), (4, 7, "cat", "dog"), (8, 11, "sat", "stood")]
+    assert counts == {"A": 1, "B": 2}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_edit_by_edit_mapping(change_log, seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice("ab \n") for _ in range(3000))
+    # Many edits early on and a few per later stage, so some blocks move whole and some are split
+    for count in [600] + [rng.choice([0, 1, 3, 40]) for _ in range(12)] + [800]:
+        text = bookfix.splice_edits(text, random_edits(rng, text, count), rng.choice(["R1", "R2", "TRIM"]))
+    entries, counts = bookfix.build_change_report()
+    assert entries == report_edit_by_edit()
+    assert sum(counts.values()) == sum(len(layer.edits) for layer in bookfix.change_layers)
@@ -0,0 +1,53 @@
+import pytest
+
+import bookfix
+
+
+@pytest.mark.parametrize("line", [
+    "Part of me wanted to leave.",
+    "Book me a flight, she said.",
+    "Part of the problem was money.",
+    "Introduction to the family went badly.",
+    "Chapters of her life were missing.",
+])
+def test_prose_starting_with_a_heading_keyword_is_not_a_heading(line):
+    assert bookfix.classify_heading_line(line, previous_blank=True) is None
+
+
+@pytest.mark.parametrize("line", [
+    "Chapter 12",
+    "CHAPTER XIV",
+    "Chapter Twenty-One: The Storm",
+    "Part One",
+    "Book III",
+    "Chap. 4",
+    "Chapter",
+    "Prologue",
+    "Epilogue: Ten Years Later",
+])
+def test_numbered_headings(line):
+    assert bookfix.classify_heading_line(line, previous_blank=True) == 'numbered'
+
+
+def test_numbered_heading_needs_a_blank_line_before_it():
+    assert bookfix.classify_heading_line("Chapter 12", previous_blank=False) is None
+
+
+@pytest.mark.parametrize("line", ["DC", "MIX", "MCMXC"])
+def test_large_bare_roman_numerals_are_text(line):
+    assert bookfix.classify_heading_line(line, previous_blank=True, next_blank=True) is None
+
+
+def test_bare_roman_numeral_must_sit_between_blank_lines():
+    assert bookfix.classify_heading_line("XII", previous_blank=True, next_blank=True) == 'roman'
+    assert bookfix.classify_heading_line("I", previous_blank=True, next_blank=True) == 'roman'
+    assert bookfix.classify_heading_line("XII", previous_blank=True, next_blank=False) is None
+    assert bookfix.classify_heading_line("XII", previous_blank=False, next_blank=True) is None
+
+
+def test_mark_chapter_headings_ignores_prose(monkeypatch):
+    monkeypatch.setattr(bookfix, "text", "Chapter 1\n\nPart of me wanted to leave.\nBook me a flight.\n\n"
+                                         "MIX\nDC\n\nII\n\nThe end.")
+    monkeypatch.setattr(bookfix, "change_layers", [])
+    bookfix.mark_chapter_headings()
+    assert bookfix.chapter_headings == [('numbered', 'Chapter 1'), ('roman', 'II')]
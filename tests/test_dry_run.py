@@ -0,0 +1,19 @@
+import bookfix
+
+
+def test_dry_run_ignores_the_processing_runs_cancel_and_budget(monkeypatch):
+    monkeypatch.setattr(bookfix, "cancel_event", bookfix.threading.Event())
+    monkeypatch.setattr(bookfix, "_token_table", None)
+    bookfix.cancel_event.set() # Left over from a cancelled run
+    monkeypatch.setattr(bookfix, "stage_deadline", 0) # A worker stage long past its budget
+    assert "50000 words" in bookfix.dry_run("word " * 50000)
+
+
+def test_caps_count_leaves_out_words_the_lowercase_rules_handle(monkeypatch):
+    monkeypatch.setattr(bookfix, "_token_table", None)
+    monkeypatch.setattr(bookfix, "lowercase_set", {"THE", "WAR OF"})
+    monkeypatch.setattr(bookfix, "ignore_set", {"BBC"})
+    estimate = bookfix.estimate_rule_hits("THE END came. NASA and the BBC. WAR OF THE WORLDS. THE\n",
+                                          {'process_all_caps': True})
+    assert estimate['UPPER_TO_LOWER'] == {"THE": 3, "WAR OF": 1}
+    assert estimate['CAPS'] == {"END": 1, "NASA": 1, "WORLDS": 1}
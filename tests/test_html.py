@@ -0,0 +1,57 @@
+import html
+
+import pytest
+
+import bookfix
+
+BOOK = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+        '<html><head><title>T &amp; U</title><style>p.x { color: red }</style></head>\n'
+        '<body><!-- note -->\n<p class="chapter">It&#8217;s&nbsp;a > b &lt; c</p><p>Two<br/>lines</p>\n'
+        '<span class="page-number">12</span>\n<p>A <i>word</i> split<b>here</b>.</p>\n'
+        '<script>if (a < b) { go(); }</script><![CDATA[ raw ]]></body></html>\n')
+
+
+@pytest.fixture
+def document(monkeypatch):
+    monkeypatch.setattr(bookfix, "change_layers", [])
+    document = bookfix.HtmlDocument(BOOK)
+    document.layer_base = 0
+    return document
+
+
+def test_parts_keep_the_source(document):
+    assert "".join(document.parts) == BOOK
+    assert all(BOOK.startswith(part, offset) for part, offset in zip(document.parts, document.part_offsets))
+
+
+def test_unchanged_text_serializes_byte_for_byte(document):
+    assert document.serialize(document.text) == BOOK
+
+
+def test_text_is_the_decoded_text_nodes(document):
+    assert "T & U" in document.text
+    assert "It’s\xa0a > b < c" in document.text
+    assert "Two\nlines" in document.text # Blocks without whitespace of their own are kept apart
+    assert "A word split\nhere." not in document.text and "A word splithere." in document.text
+    assert "go()" not in document.text and "color" not in document.text and "note" not in document.text
+
+
+def test_piece_offsets_point_at_their_nodes(document):
+    for k, part in enumerate(document.piece_parts):
+        if part is not None:
+            piece = document.text[document.piece_starts[k]:document.piece_starts[k + 1]]
+            assert html.unescape(document.parts[part]) == piece
+
+
+def test_edits_stay_in_their_node(document, monkeypatch):
+    monkeypatch.setattr(bookfix, "change_log_enabled", True)
+    start = document.text.index("word")
+    edited = bookfix.splice_edits(document.text, [(start, start + 4, "longer word")], rule='TEST')
+    result = document.serialize(edited)
+    assert "<i>longer word</i> split<b>here</b>" in result
+    assert result.replace("longer word", "word") == BOOK
+
+
+def test_page_number_elements_are_found(document):
+    found = ["".join(document.parts[first:last + 1]) for first, last in document.page_elements]
+    assert found == ['<span class="page-number">12</span>']
@@ -0,0 +1,18 @@
+import re
+import subprocess
+import sys
+
+from conftest import ROOT
+
+IMPORT_BUDGET_US = 500_000 # Cumulative import time of bookfix, in microseconds (about 0.1 s on a laptop)
+
+
+def test_import_is_tk_free_and_within_budget():
+    probe = ("import sys; sys.path.insert(0, sys.argv[1]); import bookfix; "
+             "print(sorted(name for name in ('tkinter', 'bs4', 'lxml') if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", probe, str(ROOT)],
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+    timing = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| bookfix$", result.stderr, re.M)
+    assert timing, result.stderr[-2000:]
+    assert int(timing.group(1)) < IMPORT_BUDGET_US
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+import bookfix
+
+
+@pytest.fixture
+def book(tmp_path):
+    source = tmp_path / "book.txt"
+    source.write_bytes(b"Chapter 1\n\nIt was a dark night.\n")
+    output = tmp_path / "book_fixed.txt"
+    output.write_text("done")
+    return source, output
+
+
+def index_row(source, output, mode):
+    st = os.stat(source)
+    return {"mode": mode, "output_path": str(output), "ruleset_hash": "rules", "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns, "content_hash": bookfix.hash_content(source.read_bytes())}
+
+
+@pytest.mark.parametrize("mode", ["headless", "gui"])
+def test_unchanged_book_is_skipped(book, mode):
+    source, output = book
+    assert not bookfix.needs_processing(index_row(source, output, mode), source, "rules")
+
+
+def test_changed_source_is_reprocessed_headless(book):
+    source, output = book
+    row = index_row(source, output, "headless")
+    source.write_bytes(b"Chapter 1\n\nIt was a dark and stormy night.\n")
+    assert bookfix.needs_processing(row, source, "rules")
+    assert bookfix.needs_processing(index_row(source, output, "headless"), source, "new rules")
+
+
+def test_gui_output_is_never_overwritten(book):
+    source, output = book
+    row = index_row(source, output, "gui")
+    source.write_bytes(b"Chapter 1\n\nIt was a dark and stormy night.\n")
+    assert not bookfix.needs_processing(row, source, "new rules")
+    output.unlink()
+    assert bookfix.needs_processing(row, source, "new rules")
+
+
+def test_scan_skips_the_profile_directory(tmp_path, monkeypatch):
+    (tmp_path / "book.txt").write_text("A book.")
+    runs = tmp_path / "bookfix_profile" / "run_1"
+    runs.mkdir(parents=True)
+    (runs / "01_normalize_characters.alloc.txt").write_text("allocation sites")
+    monkeypatch.setattr(bookfix, "profile_dir", tmp_path / "bookfix_profile")
+    assert list(bookfix._iter_watch_files(str(tmp_path))) == [str(tmp_path / "book.txt")]
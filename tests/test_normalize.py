@@ -0,0 +1,22 @@
+import unicodedata
+
+import bookfix
+
+
+def test_nfkc_edits_match_unicodedata():
+    sample = "ﬁne café ① Ａ é 각 ½ plain"
+    edits = bookfix.nfkc_edits(sample)
+    assert bookfix.splice_edits(sample, edits) == unicodedata.normalize('NFKC', sample)
+    assert (0, 1, "fi") in edits # One edit per changed character
+    assert (9, 10, "1") in edits
+
+
+def test_nfkc_on_html_keeps_text_nodes_apart(monkeypatch):
+    monkeypatch.setattr(bookfix, "normalize_nfkc", True)
+    monkeypatch.setattr(bookfix, "normalization", {})
+    monkeypatch.setattr(bookfix, "normalization_table", {})
+    steps = {step: False for step in bookfix.HEADLESS_STEP_DEFAULTS}
+    steps['normalize_characters'] = True
+    markup = "<p>The ﬁrst <i>oﬃce</i> of ① <b>ﬂoor</b>.</p>"
+    result = bookfix.process_text_headless(markup, "book.xhtml", **steps)
+    assert result == "<p>The first <i>office</i> of 1 <b>floor</b>.</p>"
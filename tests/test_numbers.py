@@ -0,0 +1,88 @@
+import pytest
+
+import bookfix
+
+
+@pytest.mark.parametrize("n, words", [
+    (0, "zero"),
+    (13, "thirteen"),
+    (40, "forty"),
+    (105, "one hundred five"),
+    (1234567, "one million two hundred thirty-four thousand five hundred sixty-seven"),
+    (10 ** 15, "one zero zero zero zero zero zero zero zero zero zero zero zero zero zero zero"),
+])
+def test_number_to_words(n, words):
+    assert bookfix.number_to_words(n) == words
+
+
+@pytest.mark.parametrize("n, words", [
+    (1, "first"), (2, "second"), (3, "third"), (11, "eleventh"), (12, "twelfth"),
+    (20, "twentieth"), (22, "twenty-second"), (101, "one hundred first"), (112, "one hundred twelfth"),
+])
+def test_ordinal_to_words(n, words):
+    assert bookfix.ordinal_to_words(n) == words
+
+
+@pytest.mark.parametrize("n, words", [
+    (1984, "nineteen eighty-four"), (1905, "nineteen oh five"), (1900, "nineteen hundred"),
+    (2007, "two thousand seven"), (2010, "twenty ten"),
+])
+def test_year_to_words(n, words):
+    assert bookfix.year_to_words(n) == words
+
+
+@pytest.mark.parametrize("source, spoken", [
+    ("$3.50", "three dollars and fifty cents"),
+    ("$1", "one dollar"),
+    ("$0.99", "ninety-nine cents"),
+    ("£2 million", "two million pounds"),
+    ("a .45 and a .357", "a forty-five and a three fifty-seven"),
+    ("2.5 kg", "two point five kg"),
+    ("1,234 items", "one thousand two hundred thirty-four items"),
+    ("the 21st of May 1984", "the twenty-first of May nineteen eighty-four"),
+    ("3RD floor", "third floor"),
+])
+def test_verbalize_text(source, spoken):
+    assert bookfix.verbalize_text(source) == spoken
+
+
+@pytest.mark.parametrize("source", ["version 1.2.3", "call 555-1234", "on 12/25/2020", "at 10:30"])
+def test_dates_times_and_versions_are_left_alone(source):
+    assert bookfix.verbalize_text(source) == source
+
+
+def test_verbalize_text_records_each_number(monkeypatch):
+    monkeypatch.setattr(bookfix, "change_log_enabled", True)
+    monkeypatch.setattr(bookfix, "change_layers", [])
+    assert bookfix.verbalize_text("7 and 8") == "seven and eight"
+    assert [edit[:4] for edit in bookfix.change_layers[0].edits] == [(0, 1, "7", "seven"), (6, 7, "8", "eight")]
+
+
+@pytest.mark.parametrize("source, spoken", [
+    ("-5 degrees", "minus five degrees"),
+    ("a −3.5 drop", "a minus three point five drop"),
+    ("Catch-22 is", "Catch-twenty-two is"), # A hyphen after a word is not a minus
+    ("5 - 3", "five - three"),
+    ("50% off", "fifty percent off"),
+    ("12.5 % more", "twelve point five percent more"),
+])
+def test_signs_and_percentages(source, spoken):
+    assert bookfix.verbalize_text(source) == spoken
+
+
+@pytest.mark.parametrize("source, spoken", [
+    ("page 2050 of 3000", "page two thousand fifty of three thousand"),
+    ("1500 soldiers", "one thousand five hundred soldiers"),
+    ("in 1984 he left", "in nineteen eighty-four he left"),
+    ("the summer of 1969 was hot", "the summer of nineteen sixty-nine was hot"),
+    ("It was 1984.", "It was nineteen eighty-four."),
+    ("1999% up", "one thousand nine hundred ninety-nine percent up"),
+])
+def test_years_need_context(source, spoken):
+    assert bookfix.verbalize_text(source) == spoken
+
+
+def test_ordinals_only(monkeypatch):
+    monkeypatch.setattr(bookfix, "text", "the 21st of 1500 men, a .45 and 3 more")
+    bookfix.verbalize_ordinals()
+    assert bookfix.text == "the twenty-first of 1500 men, a forty-five and 3 more"
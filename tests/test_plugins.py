@@ -0,0 +1,55 @@
+import pytest
+
+import bookfix
+
+
+@pytest.fixture
+def plugin(monkeypatch):
+    """Registers the given stages as the only plugin stages for one test."""
+    def register(*stages):
+        monkeypatch.setattr(bookfix, "plugin_stages", [])
+        bookfix._register_plugin_stages(list(stages), "test", "test_plugins")
+    yield register
+
+
+def test_diff_edits_rebuild_the_new_text():
+    old = "Hello world again\nsecond line\n\nthird"
+    new = "Hello World again\nsecond line, changed\nthird\nfourth"
+    edits = bookfix.diff_edits(old, new)
+    assert bookfix.splice_edits(old, edits) == new
+    assert (6, 11, "World") in edits # Narrowed to the changed word
+
+
+def test_document_plugin_keeps_html_text_nodes_apart(plugin):
+    plugin({'name': 'shout', 'func': lambda doc: doc.replace("world", "big planet").replace("again", "once more"),
+            'locality': 'document', 'after': 'normalize_characters'})
+    markup = "<html><body><p>Hello <i>world</i> and <b>again</b>.</p></body></html>"
+    steps = {step: False for step in bookfix.HEADLESS_STEP_DEFAULTS}
+    steps['plugin_stages'] = True
+    result = bookfix.process_text_headless(markup, "book.xhtml", **steps)
+    assert result == "<html><body><p>Hello <i>big planet</i> and <b>once more</b>.</p></body></html>"
+
+
+def test_failed_plugin_is_reported_apart_from_budget_skips(plugin, monkeypatch, tmp_path):
+    from concurrent.futures import Future
+
+    def boom(doc):
+        raise RuntimeError("boom")
+    plugin({'name': 'boom', 'func': boom, 'locality': 'document', 'after': 'normalize_characters'})
+    steps = {step: False for step in bookfix.HEADLESS_STEP_DEFAULTS}
+    steps['plugin_stages'] = True
+    assert bookfix.process_text_headless("Hello world.", "book.txt", **steps) == "Hello world."
+    assert bookfix.skipped_stages() == [("plugin:boom", "plugin_error")]
+
+    messages = []
+    monkeypatch.setattr(bookfix, "log_message", lambda message, level="INFO": messages.append((level, message)))
+    conn = bookfix.open_library_index(str(tmp_path / "index.sqlite"))
+    future = Future()
+    future.set_result(("book.txt", "book_output.txt", 12, 0, "hash", 0.1,
+                       [("plugin:boom", "plugin_error"), ("verbalize_numbers", "over_budget")], {}))
+    assert bookfix._record_worker_result(conn, future, "book.txt", "rules")
+    row = bookfix.load_index_rows(conn)["book.txt"]
+    assert row["skipped_stages"] == "plugin:boom=plugin_error,verbalize_numbers=over_budget"
+    warnings = [message for level, message in messages if level == "WARNING"]
+    assert warnings == ["'book.txt': stage(s) over budget and skipped: verbalize_numbers",
+                        "'book.txt': plugin pass(es) failed and skipped: plugin:boom"]
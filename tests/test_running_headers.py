@@ -0,0 +1,67 @@
+import random
+
+import bookfix
+
+
+def make_book(pages=40, lines_per_page=30, seed=3):
+    """Pages of prose with a numbered running header, the author's name on every other page and noise lines."""
+    rng = random.Random(seed)
+    lines = []
+    for page in range(1, pages + 1):
+        lines.append(f"THE LOST FLEET {page + 200}" if page % 2 else "JACK CAMPBELL")
+        for n in range(lines_per_page - 1):
+            if rng.random() < 0.05:
+                lines.append("\"Yes.\"") # Short, frequent, but at irregular gaps
+            else:
+                lines.append(f"Prose line {n} of page {page} that runs on long enough to be text and never repeats {rng.random()}.")
+    return lines
+
+
+def test_numbered_header_and_author_line_are_found():
+    headers, report = bookfix.detect_running_headers(make_book())
+    assert headers == {"the lost fleet #", "jack campbell"}
+    assert sum(line.startswith("Header: ") for line in report) == 2
+
+
+def test_irregular_short_lines_are_kept():
+    headers, report = bookfix.detect_running_headers(make_book())
+    assert '"yes."' not in headers
+    assert any(line.startswith("Kept: '\"yes.\"'") for line in report)
+
+
+def test_evenly_spaced_chapter_headings_are_not_headers():
+    lines = []
+    for chapter in range(1, 21):
+        lines.append(f"Chapter {chapter}")
+        lines.extend(f"Text {chapter}.{n} that is long enough to never look like a running header at all." for n in range(40))
+    headers, _ = bookfix.detect_running_headers(lines)
+    assert headers == set()
+
+
+def test_too_few_repeats_or_wrong_period_are_not_headers():
+    assert bookfix.detect_running_headers(make_book(pages=bookfix.HEADER_MIN_REPEATS))[0] == set()
+    every_line = ["Same short line"] * 200
+    assert bookfix.detect_running_headers(every_line)[0] == set()
+
+
+def test_pruning_the_shape_counter_keeps_real_headers(monkeypatch):
+    monkeypatch.setattr(bookfix, "HEADER_MAX_SHAPES", 50)
+    lines = make_book()
+    noisy = [f"short {i}x" if not i % 3 and not line.startswith(("THE", "JACK")) else line for i, line in enumerate(lines)]
+    headers, _ = bookfix.detect_running_headers(noisy)
+    assert headers == {"the lost fleet #", "jack campbell"}
+
+
+def test_shape_counter_stays_bounded_when_every_shape_repeats(monkeypatch):
+    monkeypatch.setattr(bookfix, "HEADER_MAX_SHAPES", 50)
+    sizes = []
+    prune = bookfix._prune_shape_stats
+    monkeypatch.setattr(bookfix, "_prune_shape_stats", lambda stats: sizes.append(len(stats)) or prune(stats))
+    lines = []
+    for page in range(1, 41):
+        lines.append(f"THE LOST FLEET {page + 200}")
+        for n in range(29): # Every short line appears twice, so none is a one-off
+            lines.append("note " + "".join(chr(97 + int(d)) for d in str((page * 29 + n) // 2))) # Digits would be masked
+    headers, _ = bookfix.detect_running_headers(lines)
+    assert headers == {"the lost fleet #"}
+    assert len(sizes) > 10 and max(sizes) == 50
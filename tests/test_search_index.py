@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+import bookfix
+
+WORDS = ["read", "Read", "reader", "bread", "tear", "gas", "gasoline", "the", "a", "aa", "Ünïcode", "x1"]
+
+
+def find_all(text, query, match_case):
+    """Every (overlapping) occurrence of `query`, with str.find."""
+    haystack, needle = (text, query) if match_case else (text.lower(), query.lower())
+    hits = []
+    start = haystack.find(needle)
+    while start != -1:
+        hits.append((start, start + len(query)))
+        start = haystack.find(needle, start + 1)
+    return hits
+
+
+def random_text(rng, words=300):
+    return "".join(rng.choice(WORDS) + rng.choice([" ", " ", ", ", ".\n", "-"]) for _ in range(words))
+
+
+def random_query(rng, text):
+    """A piece of the text starting on a word character (punctuation-led queries take the scan path)."""
+    while True:
+        start = rng.randrange(len(text))
+        query = text[start:start + rng.randint(1, 9)]
+        if query[0].isalnum():
+            return query
+
+
+@pytest.fixture
+def book(monkeypatch):
+    monkeypatch.setattr(bookfix, "change_log_enabled", False)
+    monkeypatch.setattr(bookfix, "_search_index", None)
+    monkeypatch.setattr(bookfix, "_line_index", None)
+    monkeypatch.setattr(bookfix, "text", random_text(random.Random(11)))
+
+
+def test_search_matches_str_find(book):
+    rng = random.Random(1)
+    for _ in range(300):
+        query = random_query(rng, bookfix.text)
+        match_case = rng.random() < 0.5
+        assert bookfix.search_text(query, match_case=match_case) == find_all(bookfix.text, query, match_case), query
+
+
+def test_search_matches_str_find_after_splice_text_edits(book):
+    rng = random.Random(2)
+    bookfix.search_text("read") # Build the index, so the edits below go through its journal
+    index = bookfix._search_index
+    for _ in range(200):
+        start = rng.randrange(len(bookfix.text))
+        end = min(len(bookfix.text), start + rng.randint(0, 6))
+        bookfix.splice_text(start, end, rng.choice(["", "read", "bread ", " gas", "X", "tear-gas", "\n"]))
+        query = random_query(rng, bookfix.text)
+        match_case = rng.random() < 0.5
+        assert bookfix.search_text(query, match_case=match_case) == find_all(bookfix.text, query, match_case), query
+    assert bookfix._search_index is index # Updated in place, never rebuilt
+
+
+def test_whole_word_search(book):
+    bookfix.text = "tear gas, tear gasoline, Tear Gas. retear gas"
+    assert bookfix.search_text("tear gas", whole_word=True) == [(0, 8), (25, 33)]
+    assert bookfix.search_text("tear gas", whole_word=True, match_case=True) == [(0, 8)]
+    assert bookfix.search_text("gas") == [(5, 8), (15, 18), (30, 33), (42, 45)]
+
+
+def test_punctuation_led_queries_fall_back_to_a_scan(book):
+    bookfix.text = "a, b, c"
+    assert bookfix.search_text(", ") == [(1, 3), (4, 6)]
+
+
+def test_preview_rule_counts_and_lists_hits(book):
+    bookfix.text = "He read it.\nShe READ it too."
+    count, lines = bookfix.preview_rule('CHOICE', "read", "reed")
+    assert count == 2
+    assert lines[0] == "2 hit(s) for CHOICE 'read' -> 'reed'"
+    assert lines[1].strip().startswith("1:4") and "[read -> reed]" in lines[1]
+
+
+def test_search_ignores_the_processing_runs_cancel(book, monkeypatch):
+    monkeypatch.setattr(bookfix, "cancel_event", bookfix.threading.Event())
+    bookfix.cancel_event.set() # Left over from a cancelled run
+    assert len(bookfix.search_text("word", text_content="word " * 10000)) == 10000
+    with pytest.raises(bookfix.ProcessingCancelled): # The processing run's own tables still stop
+        bookfix.TokenTable("word " * 10000)
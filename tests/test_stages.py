@@ -0,0 +1,11 @@
+import bookfix
+
+
+def test_each_stage_is_reported_once_under_its_own_name(monkeypatch):
+    monkeypatch.setattr(bookfix, "lowercase_set", {"NASA"})
+    monkeypatch.setattr(bookfix, "series_decisions", {"choice": {}, "caps": {"SAID SO": "y"}}) # As in a series session
+    result = bookfix.process_text_headless("NASA SAID SO.\n", "book.txt", **bookfix.HEADLESS_STEP_DEFAULTS)
+    assert result.startswith("nasa said so")
+    names = [entry['stage'] for entry in bookfix.stage_report]
+    assert 'lowercase_rules' in names and 'process_all_caps' in names
+    assert len(names) == len(set(names))
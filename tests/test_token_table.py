@@ -0,0 +1,78 @@
+import random
+import re
+
+import pytest
+
+import bookfix
+
+SAMPLE = "Read the READ me, read-only. Café naïve read\nTHE END IS NIGH, said NASA."
+
+
+def test_spans_match_the_word_regex():
+    table = bookfix.TokenTable(SAMPLE)
+    assert [table.span(i) for i in range(len(table))] == [m.span() for m in re.finditer(r"\w+", SAMPLE)]
+
+
+def test_postings_list_each_token_in_document_order():
+    table = bookfix.TokenTable(SAMPLE)
+    for token_id, word in enumerate(table.words):
+        positions = list(table.postings(token_id))
+        assert positions == sorted(positions)
+        assert [SAMPLE[slice(*table.span(i))] for i in positions] == [word] * len(positions)
+
+
+def test_positions_and_counts():
+    table = bookfix.TokenTable(SAMPLE)
+    assert table.count("read") == 2
+    assert table.count("read", ignore_case=True) == 4
+    assert table.count("missing") == 0
+    assert [m.group(0) for m in table.matches("READ", ignore_case=True)] == ["Read", "READ", "read", "read"]
+    assert table.next_match("read", 10) == (18, 22)
+    assert table.next_match("read", 100) is None
+
+
+def test_tokenizing_in_blocks_does_not_split_tokens(monkeypatch):
+    monkeypatch.setattr(bookfix, "TOKENIZE_BLOCK_CHARS", 7)
+    table = bookfix.TokenTable(SAMPLE)
+    assert [table.words[i] for i in table.ids] == re.findall(r"\w+", SAMPLE)
+
+
+def test_replace_matches_a_fresh_tokenization():
+    rng = random.Random(7)
+    table = bookfix.TokenTable(SAMPLE * 3)
+    for _ in range(20):
+        edits = {i: rng.choice(["", "x", "two words", "x-y", "!"]) for i in rng.sample(range(len(table)), 4)}
+        table = table.replace(edits)
+        fresh = bookfix.TokenTable(table.text)
+        assert list(table.starts) == list(fresh.starts)
+        assert list(table.lengths) == list(fresh.lengths)
+        assert [table.words[i] for i in table.ids] == [fresh.words[i] for i in fresh.ids]
+
+
+def test_all_caps_sequences_match_the_regex():
+    table = bookfix.TokenTable(SAMPLE)
+    expected = [m.group(0) for m in re.finditer(r"\b[A-Z](?:[A-Z ]*[A-Z])\b", SAMPLE)]
+    assert [m.group(0) for m in table.all_caps_sequences()] == expected
+
+
+@pytest.mark.parametrize("word, count", [("read", 4), ("the", 2), ("tear gas", 0)])
+def test_find_word_matches(word, count):
+    assert len(bookfix.find_word_matches(SAMPLE, word)) == count
+
+
+def test_phrase_fallback_calls_the_replacement_once_and_counts_real_changes(monkeypatch):
+    monkeypatch.setattr(bookfix, "change_log_enabled", True)
+    monkeypatch.setattr(bookfix, "change_layers", [])
+    monkeypatch.setattr(bookfix, "rule_hits", {})
+    calls = []
+
+    def shout(found):
+        calls.append(found)
+        return None if found == "New York" else found.upper() # Keep the correctly cased one
+
+    result = bookfix.replace_words("new york, New York and NEW york.", {"new york": shout}, ignore_case=True, rule='CHOICE')
+    assert result == "NEW YORK, New York and NEW YORK."
+    assert calls == ["new york", "New York", "NEW york"]
+    assert bookfix.rule_hits['CHOICE'] == {"new york": 2}
+    assert [edit[2:4] for layer in bookfix.change_layers for edit in layer.edits] == [
+        ("new york", "NEW YORK"), ("NEW york", "NEW YORK")]